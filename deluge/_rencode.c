@@ -0,0 +1,655 @@
+/*
+ * _rencode.c
+ *
+ * Copyright (C) 2012 Deluge Team
+ *
+ * Deluge is free software.
+ *
+ * You may redistribute it and/or modify it under the terms of the
+ * GNU General Public License, as published by the Free Software
+ * Foundation; either version 3 of the License, or (at your option)
+ * any later version.
+ *
+ * deluge is distributed in the hope that it will be useful,
+ * but WITHOUT ANY WARRANTY; without even the implied warranty of
+ * MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+ * See the GNU General Public License for more details.
+ *
+ * You should have received a copy of the GNU General Public License
+ * along with deluge.    If not, write to:
+ * 	The Free Software Foundation, Inc.,
+ * 	51 Franklin Street, Fifth Floor
+ * 	Boston, MA  02110-1301, USA.
+ *
+ *    In addition, as a special exception, the copyright holders give
+ *    permission to link the code of portions of this program with the OpenSSL
+ *    library.
+ *    You must obey the GNU General Public License in all respects for all of
+ *    the code used other than OpenSSL. If you modify file(s) with this
+ *    exception, you may extend this exception to your version of the file(s),
+ *    but you are not obligated to do so. If you do not wish to do so, delete
+ *    this exception statement from your version. If you delete this exception
+ *    statement from all source files in the program, then also delete it here.
+ *
+ */
+
+/*
+ * Native implementation of deluge/rencode.py.
+ *
+ * The output of dumps() is byte for byte the same as the output of the pure
+ * Python module, and loads() accepts the same input, so the two can be used
+ * on either side of a connection.  See deluge/rencode.py for the format.
+ */
+
+#define PY_SSIZE_T_CLEAN
+#include <Python.h>
+#include <string.h>
+
+#define DEFAULT_FLOAT_BITS 32
+#define MAX_INT_LENGTH 64
+
+#define CHR_LIST    59
+#define CHR_DICT    60
+#define CHR_INT     61
+#define CHR_INT1    62
+#define CHR_INT2    63
+#define CHR_INT4    64
+#define CHR_INT8    65
+#define CHR_FLOAT32 66
+#define CHR_FLOAT64 44
+#define CHR_TRUE    67
+#define CHR_FALSE   68
+#define CHR_NONE    69
+#define CHR_TERM    127
+
+#define INT_POS_FIXED_START 0
+#define INT_POS_FIXED_COUNT 44
+#define DICT_FIXED_START 102
+#define DICT_FIXED_COUNT 25
+#define INT_NEG_FIXED_START 70
+#define INT_NEG_FIXED_COUNT 32
+#define STR_FIXED_START 128
+#define STR_FIXED_COUNT 64
+#define LIST_FIXED_START (STR_FIXED_START + STR_FIXED_COUNT)
+#define LIST_FIXED_COUNT 64
+
+/* Encoding */
+
+typedef struct {
+    char *data;
+    Py_ssize_t len;
+    Py_ssize_t size;
+    int float_bits;
+} buffer_t;
+
+static int
+buffer_reserve(buffer_t *b, Py_ssize_t n)
+{
+    char *data;
+    Py_ssize_t size;
+
+    if (b->len + n <= b->size)
+        return 0;
+    size = b->size;
+    while (size < b->len + n)
+        size *= 2;
+    data = PyMem_Realloc(b->data, size);
+    if (data == NULL) {
+        PyErr_NoMemory();
+        return -1;
+    }
+    b->data = data;
+    b->size = size;
+    return 0;
+}
+
+static int
+buffer_write(buffer_t *b, const char *s, Py_ssize_t n)
+{
+    if (buffer_reserve(b, n) < 0)
+        return -1;
+    memcpy(b->data + b->len, s, n);
+    b->len += n;
+    return 0;
+}
+
+static int
+buffer_put(buffer_t *b, char c)
+{
+    if (buffer_reserve(b, 1) < 0)
+        return -1;
+    b->data[b->len++] = c;
+    return 0;
+}
+
+static void
+pack_big_endian(char *p, unsigned PY_LONG_LONG x, int size)
+{
+    int i;
+    for (i = size - 1; i >= 0; i--) {
+        p[i] = (char)(x & 0xff);
+        x >>= 8;
+    }
+}
+
+static int
+encode_long_long(buffer_t *b, PY_LONG_LONG x)
+{
+    char buf[9];
+    int size;
+
+    if (x >= 0 && x < INT_POS_FIXED_COUNT)
+        return buffer_put(b, (char)(INT_POS_FIXED_START + x));
+    if (x >= -INT_NEG_FIXED_COUNT && x < 0)
+        return buffer_put(b, (char)(INT_NEG_FIXED_START - 1 - x));
+
+    if (x >= -128 && x < 128) {
+        buf[0] = CHR_INT1;
+        size = 1;
+    } else if (x >= -32768 && x < 32768) {
+        buf[0] = CHR_INT2;
+        size = 2;
+    } else if (x >= -2147483647LL - 1 && x < 2147483648LL) {
+        buf[0] = CHR_INT4;
+        size = 4;
+    } else {
+        buf[0] = CHR_INT8;
+        size = 8;
+    }
+    pack_big_endian(buf + 1, (unsigned PY_LONG_LONG)x, size);
+    return buffer_write(b, buf, size + 1);
+}
+
+static int
+encode_big_int(buffer_t *b, PyObject *x)
+{
+    PyObject *s;
+    int ret = -1;
+
+    s = PyObject_Str(x);
+    if (s == NULL)
+        return -1;
+    if (PyString_GET_SIZE(s) >= MAX_INT_LENGTH) {
+        PyErr_SetString(PyExc_ValueError, "overflow");
+    } else if (buffer_put(b, CHR_INT) == 0 &&
+               buffer_write(b, PyString_AS_STRING(s), PyString_GET_SIZE(s)) == 0) {
+        ret = buffer_put(b, CHR_TERM);
+    }
+    Py_DECREF(s);
+    return ret;
+}
+
+static int
+encode_string(buffer_t *b, const char *s, Py_ssize_t n)
+{
+    char len[32];
+
+    if (n < STR_FIXED_COUNT) {
+        if (buffer_put(b, (char)(STR_FIXED_START + n)) < 0)
+            return -1;
+    } else {
+        PyOS_snprintf(len, sizeof(len), "%" PY_FORMAT_SIZE_T "d:", n);
+        if (buffer_write(b, len, strlen(len)) < 0)
+            return -1;
+    }
+    return buffer_write(b, s, n);
+}
+
+static int
+encode_float(buffer_t *b, double x)
+{
+    char buf[9];
+
+    if (b->float_bits == 32) {
+        buf[0] = CHR_FLOAT32;
+        if (_PyFloat_Pack4(x, (unsigned char *)buf + 1, 0) < 0)
+            return -1;
+        return buffer_write(b, buf, 5);
+    }
+    buf[0] = CHR_FLOAT64;
+    if (_PyFloat_Pack8(x, (unsigned char *)buf + 1, 0) < 0)
+        return -1;
+    return buffer_write(b, buf, 9);
+}
+
+static int encode_object(buffer_t *b, PyObject *x);
+
+static int
+encode_sequence(buffer_t *b, PyObject **items, Py_ssize_t n)
+{
+    Py_ssize_t i;
+
+    if (n < LIST_FIXED_COUNT) {
+        if (buffer_put(b, (char)(LIST_FIXED_START + n)) < 0)
+            return -1;
+    } else if (buffer_put(b, CHR_LIST) < 0) {
+        return -1;
+    }
+    for (i = 0; i < n; i++) {
+        if (encode_object(b, items[i]) < 0)
+            return -1;
+    }
+    if (n >= LIST_FIXED_COUNT)
+        return buffer_put(b, CHR_TERM);
+    return 0;
+}
+
+static int
+encode_dict(buffer_t *b, PyObject *x)
+{
+    Py_ssize_t n = PyDict_Size(x);
+    Py_ssize_t pos = 0;
+    PyObject *key, *value;
+
+    if (n < DICT_FIXED_COUNT) {
+        if (buffer_put(b, (char)(DICT_FIXED_START + n)) < 0)
+            return -1;
+    } else if (buffer_put(b, CHR_DICT) < 0) {
+        return -1;
+    }
+    /* PyDict_Next walks the dict in the same order as dict.items() */
+    while (PyDict_Next(x, &pos, &key, &value)) {
+        if (encode_object(b, key) < 0 || encode_object(b, value) < 0)
+            return -1;
+    }
+    if (n >= DICT_FIXED_COUNT)
+        return buffer_put(b, CHR_TERM);
+    return 0;
+}
+
+static int
+encode_object(buffer_t *b, PyObject *x)
+{
+    int ret;
+
+    if (x == Py_None)
+        return buffer_put(b, CHR_NONE);
+    if (PyBool_Check(x))
+        return buffer_put(b, x == Py_True ? CHR_TRUE : CHR_FALSE);
+    if (PyInt_CheckExact(x))
+        return encode_long_long(b, PyInt_AS_LONG(x));
+    if (PyString_CheckExact(x))
+        return encode_string(b, PyString_AS_STRING(x), PyString_GET_SIZE(x));
+    if (PyLong_CheckExact(x)) {
+        int overflow;
+        PY_LONG_LONG v = PyLong_AsLongLongAndOverflow(x, &overflow);
+        if (overflow)
+            return encode_big_int(b, x);
+        if (v == -1 && PyErr_Occurred())
+            return -1;
+        return encode_long_long(b, v);
+    }
+    if (PyFloat_CheckExact(x))
+        return encode_float(b, PyFloat_AS_DOUBLE(x));
+    if (PyUnicode_CheckExact(x)) {
+        PyObject *s = PyUnicode_AsUTF8String(x);
+        if (s == NULL)
+            return -1;
+        ret = encode_string(b, PyString_AS_STRING(s), PyString_GET_SIZE(s));
+        Py_DECREF(s);
+        return ret;
+    }
+
+    if (Py_EnterRecursiveCall(" while encoding an object with rencode"))
+        return -1;
+    if (PyList_CheckExact(x))
+        ret = encode_sequence(b, PySequence_Fast_ITEMS(x), PyList_GET_SIZE(x));
+    else if (PyTuple_CheckExact(x))
+        ret = encode_sequence(b, PySequence_Fast_ITEMS(x), PyTuple_GET_SIZE(x));
+    else if (PyDict_CheckExact(x))
+        ret = encode_dict(b, x);
+    else {
+        /* The pure module fails to find an encoder for the type */
+        PyErr_SetObject(PyExc_KeyError, (PyObject *)Py_TYPE(x));
+        ret = -1;
+    }
+    Py_LeaveRecursiveCall();
+    return ret;
+}
+
+static PyObject *
+rencode_dumps(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"x", "float_bits", NULL};
+    PyObject *x, *result = NULL;
+    buffer_t b;
+
+    b.float_bits = DEFAULT_FLOAT_BITS;
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "O|i:dumps", kwlist, &x, &b.float_bits))
+        return NULL;
+    if (b.float_bits != 32 && b.float_bits != 64) {
+        PyErr_Format(PyExc_ValueError, "Float bits (%d) is not 32 or 64", b.float_bits);
+        return NULL;
+    }
+
+    b.len = 0;
+    b.size = 256;
+    b.data = PyMem_Malloc(b.size);
+    if (b.data == NULL)
+        return PyErr_NoMemory();
+    if (encode_object(&b, x) == 0)
+        result = PyString_FromStringAndSize(b.data, b.len);
+    PyMem_Free(b.data);
+    return result;
+}
+
+/* Decoding */
+
+typedef struct {
+    const unsigned char *data;
+    Py_ssize_t len;
+    Py_ssize_t pos;
+    int decode_utf8;
+} reader_t;
+
+static PyObject *
+invalid_data(void)
+{
+    PyErr_SetNone(PyExc_ValueError);
+    return NULL;
+}
+
+static PY_LONG_LONG
+unpack_big_endian(const unsigned char *p, int size)
+{
+    unsigned PY_LONG_LONG x = 0;
+    int i;
+
+    for (i = 0; i < size; i++)
+        x = (x << 8) | p[i];
+    /* Sign extend */
+    if (size < 8 && (p[0] & 0x80))
+        x |= ~0ULL << (size * 8);
+    return (PY_LONG_LONG)x;
+}
+
+static PyObject *
+decode_fixed_int(reader_t *r, int size)
+{
+    PY_LONG_LONG x;
+
+    if (r->pos + 1 + size > r->len)
+        return invalid_data();
+    x = unpack_big_endian(r->data + r->pos + 1, size);
+    r->pos += 1 + size;
+    /* struct.unpack only returns a long when the value doesn't fit an int */
+    if (x >= LONG_MIN && x <= LONG_MAX)
+        return PyInt_FromLong((long)x);
+    return PyLong_FromLongLong(x);
+}
+
+static PyObject *
+decode_int(reader_t *r)
+{
+    const unsigned char *start = r->data + r->pos + 1;
+    const unsigned char *end;
+    PyObject *s, *n;
+    Py_ssize_t size;
+
+    end = memchr(start, CHR_TERM, r->len - r->pos - 1);
+    if (end == NULL)
+        return invalid_data();
+    size = end - start;
+    if (size >= MAX_INT_LENGTH) {
+        PyErr_SetString(PyExc_ValueError, "overflow");
+        return NULL;
+    }
+    if (size > 1 && ((start[0] == '-' && start[1] == '0') || start[0] == '0'))
+        return invalid_data();
+
+    s = PyString_FromStringAndSize((const char *)start, size);
+    if (s == NULL)
+        return NULL;
+    n = PyNumber_Int(s);
+    Py_DECREF(s);
+    if (n == NULL)
+        return NULL;
+    r->pos += size + 2;
+    return n;
+}
+
+static PyObject *
+make_string(reader_t *r, Py_ssize_t start, Py_ssize_t size)
+{
+    if (size < 0 || start + size > r->len)
+        return invalid_data();
+    r->pos = start + size;
+    if (r->decode_utf8)
+        return PyUnicode_DecodeUTF8((const char *)r->data + start, size, NULL);
+    return PyString_FromStringAndSize((const char *)r->data + start, size);
+}
+
+static PyObject *
+decode_string(reader_t *r)
+{
+    Py_ssize_t i = r->pos;
+    Py_ssize_t size = 0;
+
+    if (r->data[i] == '0' && i + 1 < r->len && r->data[i + 1] != ':')
+        return invalid_data();
+    while (i < r->len && r->data[i] != ':') {
+        if (r->data[i] < '0' || r->data[i] > '9' || size > PY_SSIZE_T_MAX / 10 - 1)
+            return invalid_data();
+        size = size * 10 + (r->data[i] - '0');
+        i++;
+    }
+    if (i >= r->len)
+        return invalid_data();
+    return make_string(r, i + 1, size);
+}
+
+static PyObject *
+decode_float(reader_t *r, int size)
+{
+    double x;
+
+    if (r->pos + 1 + size > r->len)
+        return invalid_data();
+    if (size == 4)
+        x = _PyFloat_Unpack4(r->data + r->pos + 1, 0);
+    else
+        x = _PyFloat_Unpack8(r->data + r->pos + 1, 0);
+    if (x == -1.0 && PyErr_Occurred())
+        return NULL;
+    r->pos += 1 + size;
+    return PyFloat_FromDouble(x);
+}
+
+static PyObject *decode_object(reader_t *r);
+
+/* Decodes count items, or items up to CHR_TERM if count is negative */
+static PyObject *
+decode_list(reader_t *r, Py_ssize_t count)
+{
+    PyObject *list, *item, *tuple;
+
+    list = PyList_New(0);
+    if (list == NULL)
+        return NULL;
+    while (count < 0 ? 1 : PyList_GET_SIZE(list) < count) {
+        if (r->pos >= r->len)
+            goto error;
+        if (count < 0 && r->data[r->pos] == CHR_TERM) {
+            r->pos++;
+            break;
+        }
+        item = decode_object(r);
+        if (item == NULL)
+            goto error;
+        if (PyList_Append(list, item) < 0) {
+            Py_DECREF(item);
+            goto error;
+        }
+        Py_DECREF(item);
+    }
+    tuple = PyList_AsTuple(list);
+    Py_DECREF(list);
+    return tuple;
+
+error:
+    Py_DECREF(list);
+    if (!PyErr_Occurred())
+        invalid_data();
+    return NULL;
+}
+
+static PyObject *
+decode_dict(reader_t *r, Py_ssize_t count)
+{
+    PyObject *dict, *key, *value;
+    Py_ssize_t i = 0;
+
+    dict = PyDict_New();
+    if (dict == NULL)
+        return NULL;
+    while (count < 0 || i < count) {
+        if (r->pos >= r->len)
+            goto error;
+        if (count < 0 && r->data[r->pos] == CHR_TERM) {
+            r->pos++;
+            break;
+        }
+        key = decode_object(r);
+        if (key == NULL)
+            goto error;
+        if (r->pos >= r->len) {
+            Py_DECREF(key);
+            goto error;
+        }
+        value = decode_object(r);
+        if (value == NULL) {
+            Py_DECREF(key);
+            goto error;
+        }
+        if (PyDict_SetItem(dict, key, value) < 0) {
+            Py_DECREF(key);
+            Py_DECREF(value);
+            goto error;
+        }
+        Py_DECREF(key);
+        Py_DECREF(value);
+        i++;
+    }
+    return dict;
+
+error:
+    Py_DECREF(dict);
+    if (!PyErr_Occurred())
+        invalid_data();
+    return NULL;
+}
+
+static PyObject *
+decode_object(reader_t *r)
+{
+    unsigned char c = r->data[r->pos];
+    PyObject *result;
+
+    if (c >= STR_FIXED_START && c < STR_FIXED_START + STR_FIXED_COUNT)
+        return make_string(r, r->pos + 1, c - STR_FIXED_START);
+    if (c >= '0' && c <= '9')
+        return decode_string(r);
+    if (c < INT_POS_FIXED_START + INT_POS_FIXED_COUNT) {
+        r->pos++;
+        return PyInt_FromLong(c - INT_POS_FIXED_START);
+    }
+    if (c >= INT_NEG_FIXED_START && c < INT_NEG_FIXED_START + INT_NEG_FIXED_COUNT) {
+        r->pos++;
+        return PyInt_FromLong(-1 - (c - INT_NEG_FIXED_START));
+    }
+
+    switch (c) {
+    case CHR_INT1:
+        return decode_fixed_int(r, 1);
+    case CHR_INT2:
+        return decode_fixed_int(r, 2);
+    case CHR_INT4:
+        return decode_fixed_int(r, 4);
+    case CHR_INT8:
+        return decode_fixed_int(r, 8);
+    case CHR_INT:
+        return decode_int(r);
+    case CHR_FLOAT32:
+        return decode_float(r, 4);
+    case CHR_FLOAT64:
+        return decode_float(r, 8);
+    case CHR_TRUE:
+        r->pos++;
+        Py_RETURN_TRUE;
+    case CHR_FALSE:
+        r->pos++;
+        Py_RETURN_FALSE;
+    case CHR_NONE:
+        r->pos++;
+        Py_RETURN_NONE;
+    }
+
+    if (Py_EnterRecursiveCall(" while decoding rencode data"))
+        return NULL;
+    if (c >= LIST_FIXED_START) {
+        r->pos++;
+        result = decode_list(r, c - LIST_FIXED_START);
+    } else if (c >= DICT_FIXED_START && c < DICT_FIXED_START + DICT_FIXED_COUNT) {
+        r->pos++;
+        result = decode_dict(r, c - DICT_FIXED_START);
+    } else if (c == CHR_LIST) {
+        r->pos++;
+        result = decode_list(r, -1);
+    } else if (c == CHR_DICT) {
+        r->pos++;
+        result = decode_dict(r, -1);
+    } else {
+        /* Unknown typecode */
+        result = invalid_data();
+    }
+    Py_LeaveRecursiveCall();
+    return result;
+}
+
+static PyObject *
+rencode_loads(PyObject *self, PyObject *args, PyObject *kwargs)
+{
+    static char *kwlist[] = {"x", "decode_utf8", NULL};
+    PyObject *decode_utf8 = Py_False;
+    PyObject *result;
+    const char *data;
+    reader_t r;
+
+    if (!PyArg_ParseTupleAndKeywords(args, kwargs, "s#|O:loads", kwlist,
+                                     &data, &r.len, &decode_utf8))
+        return NULL;
+    r.data = (const unsigned char *)data;
+    r.pos = 0;
+    r.decode_utf8 = PyObject_IsTrue(decode_utf8);
+    if (r.decode_utf8 < 0)
+        return NULL;
+    if (r.len == 0)
+        return invalid_data();
+
+    result = decode_object(&r);
+    if (result != NULL && r.pos != r.len) {
+        Py_DECREF(result);
+        return invalid_data();
+    }
+    return result;
+}
+
+static PyMethodDef rencode_methods[] = {
+    {"dumps", (PyCFunction)rencode_dumps, METH_VARARGS | METH_KEYWORDS,
+     "dumps(x, float_bits=32) -> str\n\nDump data structure to str."},
+    {"loads", (PyCFunction)rencode_loads, METH_VARARGS | METH_KEYWORDS,
+     "loads(x, decode_utf8=False) -> object\n\nLoad a data structure from str."},
+    {NULL, NULL, 0, NULL}
+};
+
+PyMODINIT_FUNC
+init_rencode(void)
+{
+    PyObject *m;
+
+    m = Py_InitModule3("_rencode", rencode_methods,
+                       "Native implementation of deluge.rencode.");
+    if (m == NULL)
+        return;
+    PyModule_AddStringConstant(m, "__version__", "1.0.2");
+}
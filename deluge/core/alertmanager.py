@@ -41,7 +41,10 @@
 
 """
 
+import time
 import logging
+import threading
+from collections import deque
 from twisted.internet import reactor
 
 import deluge.component as component
@@ -50,6 +53,16 @@
 
 log = logging.getLogger(__name__)
 
+# The number of seconds a dispatch pass can run handlers before it lets the
+# reactor run and dispatches the remaining alerts in the next pass
+ALERT_DISPATCH_BUDGET = 0.1
+# The milliseconds the alert thread waits for an alert before checking if it
+# has been stopped
+ALERT_WAIT_TIMEOUT = 500
+# The ways the AlertManager learns of new alerts: "poll" checks for them every
+# update interval, "wait" has a thread waiting for them in libtorrent
+ALERT_WAKEUP_MODES = ("poll", "wait")
+
 class AlertManager(component.Component):
     def __init__(self):
         log.debug("AlertManager initialized..")
@@ -67,20 +80,104 @@ def __init__(self):
 
         # handlers is a dictionary of lists {"alert_type": [handler1,h2,..]}
         self.handlers = {}
-        self.delayed_calls = []
+        # The handlers called with the list of alerts of a dispatch pass
+        self.batch_handlers = set()
+        # The alerts waiting to be dispatched in the order they arrived, as
+        # runs of alerts of the same type [alert_type, deque(alerts), batched]
+        self.pending_alerts = deque()
+        self.dispatch_call = None
         self.wait_on_handler = False
 
+        self.wakeup_mode = "poll"
+        self.alert_thread = None
+        self.alert_thread_stopped = None
+        self.alerts_handled = threading.Event()
+
+    def start(self):
+        if self.wakeup_mode == "wait":
+            self.start_alert_thread()
+
     def update(self):
-        self.delayed_calls = [dc for dc in self.delayed_calls if dc.active()]
         self.handle_alerts(wait=self.wait_on_handler)
 
+    def _component_start_timer(self):
+        # The alert thread replaces the polling
+        if not self.alert_thread:
+            component.Component._component_start_timer(self)
+
+    def set_wakeup_mode(self, mode):
+        """
+        Sets how the AlertManager learns of new alerts.  The "wait" mode falls
+        back to polling if libtorrent cannot wait for alerts.
+
+        :param mode: str, one of ALERT_WAKEUP_MODES
+        """
+        if mode not in ALERT_WAKEUP_MODES:
+            log.warning("Unknown alert wakeup mode %s, polling for alerts", mode)
+            mode = "poll"
+        elif mode == "wait" and not hasattr(self.session, "wait_for_alert"):
+            log.warning("libtorrent cannot wait for alerts, polling for alerts")
+            mode = "poll"
+        self.wakeup_mode = mode
+
+        if self._component_state != "Started":
+            return
+        if mode == "wait" and not self.alert_thread:
+            if self._component_timer and self._component_timer.running:
+                self._component_timer.stop()
+            self.start_alert_thread()
+        elif mode == "poll" and self.alert_thread:
+            self.stop_alert_thread()
+            self._component_start_timer()
+
+    def start_alert_thread(self):
+        self.alert_thread_stopped = threading.Event()
+        self.alert_thread = threading.Thread(target=self.wait_for_alerts,
+                                             args=(self.alert_thread_stopped,),
+                                             name="AlertManager")
+        self.alert_thread.setDaemon(True)
+        self.alert_thread.start()
+        log.debug("Waiting for alerts in a thread")
+
+    def stop_alert_thread(self):
+        # Not joined as the thread can be waiting for the reactor, it
+        # exits within ALERT_WAIT_TIMEOUT
+        self.alert_thread_stopped.set()
+        self.alert_thread = None
+
+    def wait_for_alerts(self, stopped):
+        """
+        Waits for alerts in libtorrent and has the reactor handle them, runs
+        in the alert thread until `stopped` is set.
+        """
+        while not stopped.isSet():
+            if self.session.wait_for_alert(ALERT_WAIT_TIMEOUT) is None:
+                continue
+            # The alert stays in the queue until the reactor pops it
+            self.alerts_handled.clear()
+            reactor.callFromThread(self.on_alerts_available, stopped)
+            while True:
+                # wait only returns whether the event is set from Python 2.7
+                self.alerts_handled.wait(ALERT_WAIT_TIMEOUT / 1000.0)
+                if self.alerts_handled.isSet():
+                    break
+                if stopped.isSet():
+                    return
+
+    def on_alerts_available(self, stopped):
+        if not stopped.isSet():
+            self.handle_alerts(wait=self.wait_on_handler)
+        self.alerts_handled.set()
+
     def stop(self):
-        for dc in self.delayed_calls:
-            if dc.active():
-                dc.cancel()
-        self.delayed_calls = []
+        if self.alert_thread:
+            self.stop_alert_thread()
+        if self.dispatch_call and self.dispatch_call.active():
+            self.dispatch_call.cancel()
+        self.dispatch_call = None
+        self.pending_alerts.clear()
 
-    def register_handler(self, alert_type, handler):
+    def register_handler(self, alert_type, handler, batch=False):
         """
         Registers a function that will be called when 'alert_type' is pop'd
         in handle_alerts.  The handler function should look like: handler(alert)
@@ -88,6 +185,8 @@ def register_handler(self, alert_type, handler):
 
         :param alert_type: str, this is string representation of the alert name
         :param handler: func(alert), the function to be called when the alert is raised
+        :param batch: bool, if True the handler is called once per dispatch
+            pass with the list of alerts of this type instead: handler(alerts)
         """
         if alert_type not in self.handlers:
             # There is no entry for this alert type yet, so lets make it with an
@@ -96,6 +195,8 @@ def register_handler(self, alert_type, handler):
 
         # Append the handler to the list in the handlers dictionary
         self.handlers[alert_type].append(handler)
+        if batch:
+            self.batch_handlers.add(handler)
         log.debug("Registered handler for alert %s", alert_type)
 
     def deregister_handler(self, handler):
@@ -109,6 +210,7 @@ def deregister_handler(self, handler):
             if handler in value:
                 # Handler is in this alert type list
                 value.remove(handler)
+        self.batch_handlers.discard(handler)
 
     def handle_alerts(self, wait=False):
         """
@@ -118,17 +220,70 @@ def handle_alerts(self, wait=False):
         :param wait: bool, if True then the handler functions will be run right
             away and waited to return before processing the next alert
         """
-        alerts = self.session.pop_alerts()
-        # Loop through all alerts in the queue
+        self.queue_alerts(self.session.pop_alerts())
+        if wait:
+            self.dispatch_alerts(budget=None)
+        elif self.pending_alerts and not (self.dispatch_call and self.dispatch_call.active()):
+            self.dispatch_call = reactor.callLater(0, self.dispatch_alerts)
+
+    def queue_alerts(self, alerts):
+        """
+        Adds the alerts to the pending alerts, those without handlers are
+        only logged.  Consecutive alerts of the same type are kept together
+        so the batch handlers can get them in one call.
+
+        :param alerts: list, the libtorrent alerts
+        """
         for alert in alerts:
             alert_type = type(alert).__name__
             # Display the alert message
             if log.isEnabledFor(logging.DEBUG):
                 log.debug("%s: %s", alert_type, decode_string(alert.message()))
-            # Call any handlers for this alert type
-            if alert_type in self.handlers:
-                for handler in self.handlers[alert_type]:
-                    if not wait:
-                        self.delayed_calls.append(reactor.callLater(0, handler, alert))
-                    else:
-                        handler(alert)
+            if not self.handlers.get(alert_type):
+                continue
+            if self.pending_alerts and self.pending_alerts[-1][0] == alert_type \
+                    and not self.pending_alerts[-1][2]:
+                self.pending_alerts[-1][1].append(alert)
+            else:
+                self.pending_alerts.append([alert_type, deque([alert]), False])
+
+    def dispatch_alerts(self, budget=ALERT_DISPATCH_BUDGET):
+        """
+        Calls the handlers of the pending alerts in the order they arrived.
+        For each run of alerts of the same type the batch handlers get the
+        list of the alerts, then the other handlers are called for each
+        alert.  Once the handlers have run for `budget` seconds, the
+        remaining alerts are left for another pass so the reactor can serve
+        other requests meanwhile.
+
+        :param budget: float, the number of seconds to run handlers for, or
+            None to dispatch all the pending alerts
+        """
+        self.dispatch_call = None
+        start = time.time()
+        while self.pending_alerts:
+            run = self.pending_alerts[0]
+            alert_type, alerts, batched = run
+            # Copied as handlers can deregister themselves
+            handlers = list(self.handlers.get(alert_type, []))
+            if not batched:
+                for handler in handlers:
+                    if handler in self.batch_handlers:
+                        self.call_handler(handler, list(alerts))
+                run[2] = True
+
+            handlers = [handler for handler in handlers if handler not in self.batch_handlers]
+            while alerts:
+                if budget is not None and time.time() - start > budget:
+                    self.dispatch_call = reactor.callLater(0, self.dispatch_alerts)
+                    return
+                alert = alerts.popleft()
+                for handler in handlers:
+                    self.call_handler(handler, alert)
+            self.pending_alerts.popleft()
+
+    def call_handler(self, handler, alert):
+        try:
+            handler(alert)
+        except Exception, e:
+            log.exception("Error in the alert handler %s: %s", handler, e)
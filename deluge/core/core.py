@@ -57,6 +57,7 @@
 from deluge.core.authmanager import AUTH_LEVEL_ADMIN, AUTH_LEVEL_NONE
 from deluge.core.authmanager import AUTH_LEVELS_MAPPING, AUTH_LEVELS_MAPPING_REVERSE
 from deluge.core.torrentmanager import TorrentManager
+from deluge.core.torrent import Torrent
 from deluge.core.pluginmanager import PluginManager
 from deluge.core.alertmanager import AlertManager
 from deluge.core.filtermanager import FilterManager
@@ -465,6 +466,157 @@ def add_plugin_fields(args):
         d.addCallback(add_plugin_fields)
         return d
 
+    @export
+    def get_torrents_status_stream(self, filter_dict, keys):
+        """
+        Returns the status of the torrents matching filter_dict like
+        get_torrents_status, but as (torrent_id, status) pairs streamed to the
+        client in parts instead of a single dict.  This keeps the reply for a
+        large number of torrents from being built and sent all at once.
+
+        :param filter_dict: the filter selecting the torrents
+        :type filter_dict: dict
+        :param keys: the status keys
+        :type keys: list of str
+
+        :returns: the (torrent_id, status) pairs
+        :rtype: iterator
+
+        """
+        torrent_ids = self.filtermanager.filter_torrent_ids(filter_dict)
+        # Only used to refresh the status from libtorrent, the status
+        # themselves are built as they are sent
+        d = self.torrentmanager.torrents_status_update([], keys)
+
+        def iter_status(result):
+            torrent_keys, plugin_keys = self.torrentmanager.separate_keys(keys, torrent_ids)
+            for torrent_id in torrent_ids:
+                # The torrent may be removed while the reply is being sent
+                if torrent_id in self.torrentmanager.torrents:
+                    yield torrent_id, self.create_torrent_status(torrent_id, torrent_keys, plugin_keys)
+        d.addCallback(iter_status)
+        return d
+
+    @export
+    def get_torrents_status_since(self, version, keys):
+        """
+        Returns the status of the torrents that may have changed since the
+        status version `version`.  A client caching the status passes the
+        version returned by the previous call, or 0 to get every torrent, so
+        only the changed torrents are sent.
+
+        Plugin status fields only give the torrent a new version if the
+        plugin calls :meth:`FilterManager.update_torrent` or
+        :meth:`FilterManager.update_tree_field` when they change.
+
+        :param version: the status version the client has seen
+        :type version: int
+        :param keys: the status keys
+        :type keys: list of str
+
+        :returns: the current status version and the status of the torrents
+            that changed since `version`
+        :rtype: (int, dict)
+
+        """
+        # The torrents the user may see are found now, the session of the
+        # RPC is no longer known once the status is updated
+        visible_torrent_ids = self.torrentmanager.get_torrent_list()
+        d = self.torrentmanager.torrents_status_update([], keys)
+
+        def on_status_update(result):
+            # Taken before building the status, a later change gives a higher version
+            last_version = Torrent.last_version
+            torrents = self.torrentmanager.torrents
+            torrent_ids = [torrent_id for torrent_id in visible_torrent_ids
+                           if torrent_id in torrents and torrents[torrent_id].version > version]
+            torrent_keys, plugin_keys = self.torrentmanager.separate_keys(keys, torrent_ids)
+            status_dict = {}
+            for torrent_id in torrent_ids:
+                status_dict[torrent_id] = self.create_torrent_status(
+                    torrent_id, torrent_keys, plugin_keys)
+            return last_version, status_dict
+        d.addCallback(on_status_update)
+        return d
+
+    @export
+    def get_torrents_page(self, filter_dict, keys, sort_key, reverse=False, offset=0, limit=None):
+        """
+        Returns the status of a window of the torrents matching filter_dict,
+        sorted on sort_key.  The torrents are kept sorted by the
+        TorrentManager, so only the torrents in the window have their status
+        built and sent.
+
+        :param filter_dict: the filter selecting the torrents
+        :type filter_dict: dict
+        :param keys: the status keys
+        :type keys: list of str
+        :param sort_key: the status key to sort on
+        :type sort_key: str
+        :param reverse: if True, sort in descending order
+        :type reverse: bool
+        :param offset: the number of sorted torrents to skip
+        :type offset: int
+        :param limit: the maximum number of torrents, None for all of them
+        :type limit: int
+
+        :returns: the number of torrents matching filter_dict, the ids of the
+            torrents in the window in order and their status
+        :rtype: (int, list of str, dict)
+
+        """
+        # The torrents are found now, the session of the RPC, and so the
+        # torrents the user may see, is no longer known once the status is updated
+        if filter_dict:
+            torrent_ids = self.filtermanager.filter_torrent_ids(filter_dict)
+        else:
+            torrent_ids = self.torrentmanager.get_torrent_list()
+        # Refreshes the status from libtorrent, so the values sorted on are current
+        d = self.torrentmanager.torrents_status_update([], keys)
+
+        def on_status_update(result, torrent_ids):
+            # The torrent may be removed while the status is updated
+            torrent_ids = [torrent_id for torrent_id in torrent_ids
+                           if torrent_id in self.torrentmanager.torrents]
+            page = self.torrentmanager.get_sorted_torrent_ids(
+                sort_key, torrent_ids, reverse, offset, limit)
+            total = len(torrent_ids)
+            torrent_keys, plugin_keys = self.torrentmanager.separate_keys(keys, page)
+            status_dict = {}
+            for torrent_id in page:
+                status_dict[torrent_id] = self.create_torrent_status(
+                    torrent_id, torrent_keys, plugin_keys)
+            return total, page, status_dict
+        d.addCallback(on_status_update, torrent_ids)
+        return d
+
+    @export
+    def subscribe_torrents_status(self, filter_dict, keys):
+        """
+        Subscribes to the status of the torrents matching filter_dict.  The
+        values that change are pushed to the client in a
+        TorrentsStatusChangedEvent, so it has to be registered for it.
+
+        :param filter_dict: the filter selecting the torrents
+        :type filter_dict: dict
+        :param keys: the status keys to subscribe to
+        :type keys: list of str
+
+        :returns: the current values, in the layout described in
+            :mod:`deluge.core.statussubscription`
+        :rtype: dict
+
+        """
+        session_id = component.get("RPCServer").get_session_id()
+        return self.torrentmanager.subscribe_status(session_id, filter_dict, keys)
+
+    @export
+    def unsubscribe_torrents_status(self):
+        """
+        Stops pushing the status of the torrents to the client.
+        """
+        self.torrentmanager.unsubscribe_status(component.get("RPCServer").get_session_id())
+
     @export
     def get_filter_tree(self , show_zero_hits=True, hide_cat=None):
         """
@@ -479,6 +631,19 @@ def get_session_state(self):
         # Get the torrent list from the TorrentManager
         return self.torrentmanager.get_torrent_list()
 
+    @export
+    def get_torrents_load_progress(self):
+        """
+        Returns the progress of loading the torrents from the state when the
+        daemon starts.  Torrents that are loaded show up in the session state
+        while the rest are still loading.
+
+        :returns: {"loaded": int, "total": int, "finished": bool}
+        :rtype: dict
+
+        """
+        return self.torrentmanager.get_load_progress()
+
     @export
     def get_config(self):
         """Get all the preferences as a dictionary"""
@@ -652,7 +817,7 @@ def set_torrents_shared(self, torrent_ids, shared):
         for torrent_id in torrent_ids:
             self.torrentmanager[torrent_id].set_options({"shared": shared})
 
-    @export
+    @export(threaded=True)
     def get_path_size(self, path):
         """Returns the size of the file or folder 'path' and -1 if the path is
         unaccessible (non-existent or insufficient privs)"""
@@ -702,17 +867,26 @@ def upload_plugin(self, filename, filedump):
         the client side. 'plugin_data' is a xmlrpc.Binary object of the file data,
         ie, plugin_file.read()"""
 
-        try:
-            filedump = base64.decodestring(filedump)
-        except Exception, e:
-            log.error("There was an error decoding the filedump string!")
-            log.exception(e)
-            return
+        def write_plugin():
+            try:
+                data = base64.decodestring(filedump)
+            except Exception, e:
+                log.error("There was an error decoding the filedump string!")
+                log.exception(e)
+                return False
 
-        f = open(os.path.join(deluge.configmanager.get_config_dir(), "plugins", filename), "wb")
-        f.write(filedump)
-        f.close()
-        component.get("CorePluginManager").scan_for_plugins()
+            f = open(os.path.join(deluge.configmanager.get_config_dir(), "plugins", filename), "wb")
+            f.write(data)
+            f.close()
+            return True
+
+        def on_written(written):
+            if written:
+                component.get("CorePluginManager").scan_for_plugins()
+
+        # Only the plugin manager has to be used from the reactor thread
+        return component.get("RPCServer").run_threaded(
+            "core.upload_plugin", write_plugin, (), {}).addCallback(on_written)
 
     @export
     def rescan_plugins(self):
@@ -827,7 +1001,7 @@ def queue_bottom(self, torrent_ids):
             except KeyError:
                 log.warning("torrent_id: %s does not exist in the queue", torrent_id)
 
-    @export
+    @export(threaded=True)
     def glob(self, path):
         return glob.glob(path)
 
@@ -856,7 +1030,7 @@ def logError(failure):
 
         return d
 
-    @export
+    @export(threaded=True)
     def get_free_space(self, path=None):
         """
         Returns the number of free bytes at path
@@ -41,6 +41,7 @@
 import deluge.configmanager
 import deluge.common
 from deluge.core.rpcserver import RPCServer, export
+from deluge.core.authmanager import AUTH_LEVEL_ADMIN
 import deluge.error
 
 log = logging.getLogger(__name__)
@@ -141,6 +142,12 @@ def win_handler(ctrl_type):
             interface=interface
         )
 
+        self.watchdog = None
+        if options and (getattr(options, "watchdog", False) or
+                        getattr(options, "watchdog_threshold", None) is not None):
+            from deluge.core.watchdog import Watchdog, WATCHDOG_THRESHOLD
+            self.watchdog = Watchdog(threshold=options.watchdog_threshold or WATCHDOG_THRESHOLD)
+
         # Register the daemon and the core RPCs
         self.rpcserver.register_object(self.core)
         self.rpcserver.register_object(self)
@@ -184,6 +191,86 @@ def get_method_list(self):
         """
         return self.rpcserver.get_method_list()
 
+    @export()
+    def set_event_batching(self, enabled=True):
+        """
+        Sets whether the events for this session are sent in batches.  The
+        events are then held back for the time set in the core's
+        "event_batch_window" preference and sent in one message, with
+        superseded events dropped.
+
+        :param enabled: True to receive the events in batches
+        :type enabled: bool
+
+        """
+        self.rpcserver.set_event_batching(self.rpcserver.get_session_id(), enabled)
+
+    @export()
+    def set_compression(self, level=-1):
+        """
+        Sets the compression of the messages sent to this session.  Calling
+        it tells the daemon that the client accepts uncompressed messages,
+        which are sent to clients on the loopback interface.
+
+        :param level: the zlib compression level, a negative value uses the
+            daemon's level
+        :type level: int
+        :returns: the compression level used for this session
+        :rtype: int
+
+        """
+        return self.rpcserver.set_compression(self.rpcserver.get_session_id(), level)
+
+    @export()
+    def set_streaming(self, enabled=True):
+        """
+        Sets whether the items of methods returning an iterator are streamed
+        to this session in parts, instead of being sent in one response.
+
+        :param enabled: True to receive the items in parts
+        :type enabled: bool
+
+        """
+        self.rpcserver.set_streaming(self.rpcserver.get_session_id(), enabled)
+
+    @export(AUTH_LEVEL_ADMIN)
+    def get_rpc_stats(self):
+        """
+        Returns the call statistics of the exported methods and of the
+        connected sessions.
+
+        :returns: the statistics, see :meth:`RPCServer.get_rpc_stats`
+        :rtype: dict
+
+        """
+        return self.rpcserver.get_rpc_stats()
+
+    @export(AUTH_LEVEL_ADMIN)
+    def get_stall_reports(self):
+        """
+        Returns the reports of the last times the daemon was blocked, when it
+        was started with the --watchdog option.
+
+        :returns: the reports, see :meth:`deluge.core.watchdog.Watchdog.get_reports`
+        :rtype: list
+
+        """
+        if not self.watchdog:
+            raise deluge.error.DelugeError("The watchdog is not enabled, start deluged with --watchdog")
+        return self.watchdog.get_reports()
+
+    @export()
+    def get_thread_stats(self):
+        """
+        Returns the statistics of the exported methods run in threads.
+
+        :returns: the thread pool size and the queue and call counts of each
+            threaded method, see :meth:`RPCServer.get_thread_stats`
+        :rtype: dict
+
+        """
+        return self.rpcserver.get_thread_stats()
+
     @export(1)
     def authorized_call(self, rpc):
         """
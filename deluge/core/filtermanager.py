@@ -35,6 +35,9 @@
 
 import logging
 import deluge.component as component
+from deluge.core.authmanager import AUTH_LEVEL_ADMIN
+from deluge.core.keywordindex import KeywordIndex
+from deluge.common import decode_string
 
 STATE_SORT = ["All", "Downloading", "Seeding", "Active", "Paused", "Queued"]
 
@@ -46,77 +49,44 @@ def filter_keywords(torrent_ids, values):
     keywords = ",".join([v.lower() for v in values])
     keywords = keywords.split(",")
 
-
+    fm = component.get("FilterManager")
     for keyword in keywords:
-        torrent_ids = filter_one_keyword(torrent_ids, keyword)
+        if keyword:
+            torrent_ids = filter_one_keyword(fm, torrent_ids, keyword)
     return torrent_ids
 
-def filter_one_keyword(torrent_ids, keyword):
+def filter_one_keyword(fm, torrent_ids, keyword):
     """
     search torrent on keyword.
     searches title,state,tracker-status,tracker,files
     """
-    all_torrents = component.get("TorrentManager").torrents
+    all_torrents = fm.torrents.torrents
+    # The name, filename, tracker, torrent_id and files are in the index
+    matched = fm.search_keyword(keyword)
     #filter:
-    found = False
     for torrent_id in torrent_ids:
-        torrent = all_torrents[torrent_id]
-        if keyword in torrent.filename.lower():
-            yield torrent_id
-        elif keyword in torrent.state.lower():
+        if torrent_id in matched:
             yield torrent_id
-        elif torrent.trackers and keyword in torrent.trackers[0]["url"]:
-            yield torrent_id
-        elif keyword in torrent_id:
+            continue
+        torrent = all_torrents[torrent_id]
+        if keyword in torrent.state.lower():
             yield torrent_id
         #i want to find broken torrents (search on "error", or "unregistered")
         elif keyword in torrent.tracker_status.lower():
             yield torrent_id
-        else:
-            for t_file in torrent.get_files():
-                if keyword in t_file["path"].lower():
-                    yield torrent_id
-                    break
 
 def filter_by_name(torrent_ids, search_string):
-    all_torrents = component.get("TorrentManager").torrents
     try:
         search_string, match_case = search_string[0].split('::match')
     except ValueError:
         search_string = search_string[0]
         match_case = False
 
-    if match_case is False:
-        search_string = search_string.lower()
-
+    matched = component.get("FilterManager").search_name(search_string, match_case is not False)
     for torrent_id in torrent_ids:
-        torrent_name = all_torrents[torrent_id].get_name()
-        if match_case is False:
-            torrent_name = all_torrents[torrent_id].get_name().lower()
-        else:
-            torrent_name = all_torrents[torrent_id].get_name()
-
-        if search_string in torrent_name:
+        if torrent_id in matched:
             yield torrent_id
 
-def tracker_error_filter(torrent_ids, values):
-    filtered_torrent_ids = []
-    tm = component.get("TorrentManager")
-
-    # If this is a tracker_host, then we need to filter on it
-    if values[0] != "Error":
-        for torrent_id in torrent_ids:
-            if values[0] == tm[torrent_id].get_status(["tracker_host"])["tracker_host"]:
-                filtered_torrent_ids.append(torrent_id)
-        return filtered_torrent_ids
-
-    # Check all the torrent's tracker_status for 'Error:' and only return torrent_ids
-    # that have this substring in their tracker_status
-    for torrent_id in torrent_ids:
-        if _("Error") + ":" in tm[torrent_id].get_status(["tracker_host"])["tracker_host"]:
-            filtered_torrent_ids.append(torrent_id)
-    return filtered_torrent_ids
-
 class FilterManager(component.Component):
     """FilterManager
 
@@ -131,16 +101,42 @@ def __init__(self, core):
         self.register_filter("name", filter_by_name)
         self.tree_fields = {}
 
-        self.register_tree_field("state", self._init_state_tree)
+        # The tree fields are indexed so the torrents do not have to be
+        # walked for every filter or filter tree request.
+        # {field: {value: set(torrent_ids)}}
+        self.index = {}
+        # The values indexed for each torrent {torrent_id: {field: value}}
+        self.indexed_values = {}
+        # The torrents with an error in their tracker_status
+        self.tracker_errors = set()
+        # The torrents that need to be indexed again before the next request
+        self.dirty = set()
+        # The tree fields whose changes are not reported, they are indexed
+        # again for every request
+        self.untracked_fields = set()
+
+        # The index used by the keyword and name filters, it is only built
+        # once one of them is used
+        self.keyword_index = None
+        # The torrents that need to be added to the keyword index again
+        self.keyword_dirty = set()
+
+        # The torrents report the changes of these fields, see filter_field
+        self.register_tree_field("state", self._init_state_tree, tracked=True)
         def _init_tracker_tree():
             return {"Error": 0}
-        self.register_tree_field("tracker_host", _init_tracker_tree)
-
-        self.register_filter("tracker_host", tracker_error_filter)
+        self.register_tree_field("tracker_host", _init_tracker_tree, tracked=True)
 
         def _init_users_tree():
             return {"": 0}
-        self.register_tree_field("owner", _init_users_tree)
+        self.register_tree_field("owner", _init_users_tree, tracked=True)
+
+        event_manager = component.get("EventManager")
+        event_manager.register_event_handler("TorrentAddedEvent", self.on_torrent_added)
+        event_manager.register_event_handler("TorrentsAddedEvent", self.on_torrents_added)
+        event_manager.register_event_handler("TorrentRemovedEvent", self.on_torrent_removed)
+        event_manager.register_event_handler("TorrentFileRenamedEvent", self.on_torrent_renamed)
+        event_manager.register_event_handler("TorrentFolderRenamedEvent", self.on_torrent_renamed)
 
     def filter_torrent_ids(self, filter_dict):
         """
@@ -159,20 +155,51 @@ def filter_torrent_ids(self, filter_dict):
             torrent_ids = list(filter_dict["id"])
             del filter_dict["id"]
         else:
-            torrent_ids = self.torrents.get_torrent_list()
-
-        if not filter_dict: #return if there's  nothing more to filter
-            return torrent_ids
+            torrent_ids = None
 
         #special purpose: state=Active.
+        active = False
         if "state" in filter_dict:
             # We need to make sure this is a list for the logic below
             filter_dict["state"] = list(filter_dict["state"])
+            if "Active" in filter_dict["state"]:
+                active = True
+                filter_dict["state"].remove("Active")
+                if not filter_dict["state"]:
+                    del filter_dict["state"]
+
+        #indexed fields, answered from the index:
+        self.update_index()
+        matches = []
+        for field, values in filter_dict.items():
+            if field in self.index and field not in self.registered_filters:
+                if field == "tracker_host" and "Error" in values:
+                    matched = set(self.tracker_errors)
+                    values = [v for v in values if v != "Error"]
+                else:
+                    matched = set()
+                for value in values:
+                    matched.update(self.index[field].get(value, ()))
+                matches.append(matched)
+                del filter_dict[field]
+
+        if matches and torrent_ids is None:
+            visible_torrent_ids = self.get_visible_torrent_ids()
+            if visible_torrent_ids is not None:
+                matches.append(visible_torrent_ids)
+
+        if matches:
+            # Start with the smallest set to keep the intersections cheap
+            matches.sort(key=len)
+            matched = matches[0].intersection(*matches[1:])
+            if torrent_ids is None:
+                torrent_ids = list(matched)
+            else:
+                torrent_ids = [torrent_id for torrent_id in torrent_ids if torrent_id in matched]
+        elif torrent_ids is None:
+            torrent_ids = self.torrents.get_torrent_list()
 
-        if "state" in filter_dict and "Active" in filter_dict["state"]:
-            filter_dict["state"].remove("Active")
-            if not filter_dict["state"]:
-                del filter_dict["state"]
+        if active:
             torrent_ids = self.filter_state_active(torrent_ids)
 
         if not filter_dict: #return if there's  nothing more to filter
@@ -185,42 +212,53 @@ def filter_torrent_ids(self, filter_dict):
                 torrent_ids = list(set(self.registered_filters[field](torrent_ids, values)))
                 del filter_dict[field]
 
-
         if not filter_dict: #return if there's  nothing more to filter
             return torrent_ids
 
         #leftover filter arguments:
         #default filter on status fields.
-        for torrent_id in list(torrent_ids):
-            status = self.torrents[torrent_id].get_status(filter_dict.keys()) #status={key:value}
+        torrent_keys, plugin_keys = self.torrents.separate_keys(filter_dict.keys(), torrent_ids)
+        filtered_torrent_ids = []
+        for torrent_id in torrent_ids:
+            status = self.core.create_torrent_status(torrent_id, torrent_keys, plugin_keys) #status={key:value}
             for field, values in filter_dict.iteritems():
-                if (not status[field] in values) and torrent_id in torrent_ids:
-                    torrent_ids.remove(torrent_id)
-        return torrent_ids
+                if status.get(field) not in values:
+                    break
+            else:
+                filtered_torrent_ids.append(torrent_id)
+        return filtered_torrent_ids
 
     def get_filter_tree(self, show_zero_hits=True, hide_cat=None):
         """
         returns {field: [(value,count)] }
         for use in sidebar.
         """
-        torrent_ids = self.torrents.get_torrent_list()
         tree_keys = list(self.tree_fields.keys())
         if hide_cat:
             for cat in hide_cat:
                 tree_keys.remove(cat)
 
-        torrent_keys, plugin_keys = self.torrents.separate_keys(tree_keys, torrent_ids)
+        self.update_index()
         items = dict((field, self.tree_fields[field]()) for field in tree_keys)
 
-        for torrent_id in list(torrent_ids):
-            status = self.core.create_torrent_status(torrent_id, torrent_keys, plugin_keys) #status={key:value}
+        visible_torrent_ids = self.get_visible_torrent_ids()
+        if visible_torrent_ids is None:
             for field in tree_keys:
-                value = status[field]
-                items[field][value] = items[field].get(value, 0) + 1
+                for value, torrent_ids in self.index[field].iteritems():
+                    items[field][value] = items[field].get(value, 0) + len(torrent_ids)
+            tracker_errors = self.tracker_errors
+        else:
+            # Only count the torrents this session can see
+            for torrent_id in visible_torrent_ids:
+                indexed_values = self.indexed_values.get(torrent_id, {})
+                for field in tree_keys:
+                    value = indexed_values.get(field)
+                    items[field][value] = items[field].get(value, 0) + 1
+            tracker_errors = self.tracker_errors & visible_torrent_ids
 
         if "tracker_host" in items:
-            items["tracker_host"]["All"] = len(torrent_ids)
-            items["tracker_host"]["Error"] = len(tracker_error_filter(torrent_ids, ("Error",)))
+            items["tracker_host"]["All"] = len(self.torrents.get_torrent_list())
+            items["tracker_host"]["Error"] = len(tracker_errors)
 
         if "state" in tree_keys and not show_zero_hits:
             self._hide_state_items(items["state"])
@@ -235,6 +273,175 @@ def get_filter_tree(self, show_zero_hits=True, hide_cat=None):
 
         return sorted_items
 
+    def get_visible_torrent_ids(self):
+        """
+        Returns the set of torrent_ids the session can see, or None if it can
+        see all of them.
+        """
+        if component.get("RPCServer").get_session_auth_level() == AUTH_LEVEL_ADMIN:
+            return None
+        return set(self.torrents.get_torrent_list())
+
+    def on_torrent_added(self, torrent_id, from_state):
+        self.index_torrent(torrent_id)
+        self.update_keywords(torrent_id)
+
+    def on_torrents_added(self, torrent_ids, from_state):
+        for torrent_id in torrent_ids:
+            self.index_torrent(torrent_id)
+            self.update_keywords(torrent_id)
+
+    def on_torrent_removed(self, torrent_id):
+        self.unindex_torrent(torrent_id)
+        if self.keyword_index is not None:
+            self.keyword_dirty.discard(torrent_id)
+            self.keyword_index.remove(torrent_id)
+
+    def on_torrent_renamed(self, torrent_id, *args):
+        self.update_keywords(torrent_id)
+
+    def on_torrent_changed(self, torrent_id, attr):
+        """
+        Called by a torrent when one of the attributes the filters use
+        changes.
+        """
+        self.dirty.add(torrent_id)
+        if attr in ("has_metadata", "tracker_host"):
+            # The name, files or tracker may have changed
+            self.update_keywords(torrent_id)
+
+    def update_torrent(self, torrent_id):
+        """
+        Marks a torrent to be indexed again before the next filter request.
+        Plugins registering a tree field call this when the value of their
+        field changes for a torrent.
+        """
+        self.dirty.add(torrent_id)
+        # The value is part of the torrent's status too
+        if torrent_id in self.torrents.torrents:
+            self.torrents[torrent_id].bump_version()
+
+    def update_keywords(self, torrent_id):
+        """
+        Marks a torrent to be added to the keyword index again before the
+        next search.
+        """
+        if self.keyword_index is not None:
+            self.keyword_dirty.add(torrent_id)
+
+    def update_keyword_index(self):
+        """
+        Builds the keyword index on first use, after that only the torrents
+        that changed are added again.
+        """
+        if self.keyword_index is None:
+            self.keyword_index = KeywordIndex()
+            torrent_ids = self.torrents.torrents.keys()
+        elif self.keyword_dirty:
+            torrent_ids = self.keyword_dirty
+        else:
+            return
+        self.keyword_dirty = set()
+
+        for torrent_id in torrent_ids:
+            if torrent_id not in self.torrents.torrents:
+                self.keyword_index.remove(torrent_id)
+                continue
+            torrent = self.torrents[torrent_id]
+            strings = [decode_string(torrent.filename or ""), torrent_id]
+            if torrent.trackers:
+                strings.append(decode_string(torrent.trackers[0]["url"]))
+            strings.extend([f["path"] for f in torrent.get_files()])
+            self.keyword_index.add(torrent_id, torrent.get_name(), strings)
+
+    def search_keyword(self, keyword):
+        """
+        Returns the set of torrent_ids with the lowercase keyword in their
+        name, filename, first tracker, torrent_id or file paths.
+        """
+        self.update_keyword_index()
+        return self.keyword_index.search(keyword)
+
+    def search_name(self, search_string, match_case=False):
+        """
+        Returns the set of torrent_ids with search_string in their name.
+        """
+        self.update_keyword_index()
+        return self.keyword_index.search_name(search_string, match_case)
+
+    def update_index(self):
+        """
+        Indexes the torrents that changed since the last request.
+        """
+        for field in self.untracked_fields:
+            self.update_tree_field(field)
+
+        if not self.dirty:
+            return
+        # Indexing may mark a torrent again (e.g. when its tracker_host is
+        # first cached), that is picked up by the next request
+        dirty, self.dirty = self.dirty, set()
+        for torrent_id in dirty:
+            if torrent_id in self.torrents.torrents:
+                self.index_torrent(torrent_id)
+            else:
+                self.unindex_torrent(torrent_id)
+
+    def index_torrent(self, torrent_id, fields=None):
+        """
+        Puts the torrent under its current values in the index.
+
+        :param torrent_id: the torrent
+        :type torrent_id: string
+        :param fields: the fields to index, all of them if None
+        :type fields: list of str
+
+        """
+        if fields is None:
+            fields = self.index.keys()
+        keys = list(fields) + ["tracker_status"]
+        torrent_keys, plugin_keys = self.torrents.separate_keys(keys, [torrent_id])
+        status = self.core.create_torrent_status(torrent_id, torrent_keys, plugin_keys)
+        if not status:
+            return
+
+        torrent = self.torrents[torrent_id]
+        # The torrent tells us when one of the values it holds changes
+        torrent.filter_index_hook = self.on_torrent_changed
+
+        indexed_values = self.indexed_values.setdefault(torrent_id, {})
+        for field in fields:
+            value = status.get(field)
+            if field in indexed_values:
+                if indexed_values[field] == value:
+                    continue
+                self._remove_from_index(torrent_id, field, indexed_values[field])
+            indexed_values[field] = value
+            self.index[field].setdefault(value, set()).add(torrent_id)
+
+        if _("Error") + ":" in status["tracker_status"]:
+            self.tracker_errors.add(torrent_id)
+        else:
+            self.tracker_errors.discard(torrent_id)
+
+    def unindex_torrent(self, torrent_id):
+        """
+        Removes the torrent from the index.
+        """
+        self.dirty.discard(torrent_id)
+        self.tracker_errors.discard(torrent_id)
+        for field, value in self.indexed_values.pop(torrent_id, {}).iteritems():
+            self._remove_from_index(torrent_id, field, value)
+
+    def _remove_from_index(self, torrent_id, field, value):
+        torrent_ids = self.index[field].get(value)
+        if torrent_ids is None:
+            return
+        torrent_ids.discard(torrent_id)
+        if not torrent_ids:
+            # Only values that torrents have are shown in the tree
+            del self.index[field][value]
+
     def _init_state_tree(self):
         return {"All":len(self.torrents.get_torrent_list()),
             "Downloading":0,
@@ -252,21 +459,61 @@ def register_filter(self, id, filter_func, filter_value = None):
     def deregister_filter(self, id):
         del self.registered_filters[id]
 
-    def register_tree_field(self, field, init_func = lambda : {}):
+    def register_tree_field(self, field, init_func = lambda : {}, tracked=False):
+        """
+        Adds a field to the filter tree.
+
+        :param field: the status key
+        :type field: string
+        :param init_func: returns the values always shown in the tree
+        :type init_func: function
+        :param tracked: True if the plugin calls :meth:`update_torrent` or
+            :meth:`update_tree_field` whenever the value of the field
+            changes, otherwise the field is indexed again for every request
+        :type tracked: bool
+
+        """
         self.tree_fields[field] = init_func
+        if tracked:
+            self.untracked_fields.discard(field)
+        else:
+            self.untracked_fields.add(field)
+        self.update_tree_field(field)
 
     def deregister_tree_field(self, field):
+        self.untracked_fields.discard(field)
         if field in self.tree_fields:
             del self.tree_fields[field]
+        if field in self.index:
+            del self.index[field]
+            for indexed_values in self.indexed_values.itervalues():
+                indexed_values.pop(field, None)
+
+    def update_tree_field(self, field):
+        """
+        Indexes the field again for all torrents.  Plugins call this when the
+        values of their tree field change for many torrents at once, the
+        torrents whose value changed get a new status version.
+        """
+        self.index[field] = {}
+        old_values = {}
+        for torrent_id, indexed_values in self.indexed_values.iteritems():
+            if field in indexed_values:
+                old_values[torrent_id] = indexed_values.pop(field)
+        for torrent_id in self.torrents.torrents.keys():
+            self.index_torrent(torrent_id, [field])
+            # The value is part of the torrent's status too
+            if torrent_id in old_values and \
+                    old_values[torrent_id] != self.indexed_values.get(torrent_id, {}).get(field):
+                self.torrents[torrent_id].bump_version()
 
     def filter_state_active(self, torrent_ids):
-        for torrent_id in list(torrent_ids):
+        active_torrent_ids = []
+        for torrent_id in torrent_ids:
             status = self.torrents[torrent_id].get_status(["download_payload_rate", "upload_payload_rate"])
             if status["download_payload_rate"] or status["upload_payload_rate"]:
-                pass #ok
-            else:
-                torrent_ids.remove(torrent_id)
-        return torrent_ids
+                active_torrent_ids.append(torrent_id)
+        return active_torrent_ids
 
     def _hide_state_items(self, state_items):
         "for hide(show)-zero hits"
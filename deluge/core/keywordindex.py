@@ -0,0 +1,147 @@
+#
+# keywordindex.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+The KeywordIndex is used by the keyword and name filters to find the torrents
+containing a string without going through the name and files of every
+torrent.
+
+The lowercased text of each torrent is split into trigrams, and every trigram
+maps to the torrents containing it.  A search looks up the trigrams of the
+search string to find the few torrents that can match, and only checks the
+text of those.
+
+"""
+
+# The length of the n-grams indexed
+GRAM_SIZE = 3
+
+def get_grams(text):
+    """
+    Returns the set of n-grams in the text.
+    """
+    return set([text[i:i + GRAM_SIZE] for i in xrange(len(text) - GRAM_SIZE + 1)])
+
+class KeywordIndex(object):
+    def __init__(self):
+        # {torrent_id: (name, text)}, text being lowercased and holding the name
+        self.texts = {}
+        # {gram: set(torrent_ids)}
+        self.grams = {}
+
+    def __contains__(self, torrent_id):
+        return torrent_id in self.texts
+
+    def add(self, torrent_id, name, strings):
+        """
+        Adds a torrent to the index, replacing what was indexed for it.
+
+        :param torrent_id: the torrent
+        :type torrent_id: string
+        :param name: the name of the torrent, used by :meth:`search_name`
+        :type name: string
+        :param strings: the other strings to find the torrent by
+        :type strings: list of strings
+
+        """
+        self.remove(torrent_id)
+        text = u"\n".join([name] + list(strings)).lower()
+        self.texts[torrent_id] = (name, text)
+        for gram in get_grams(text):
+            self.grams.setdefault(gram, set()).add(torrent_id)
+
+    def remove(self, torrent_id):
+        """
+        Removes a torrent from the index.
+        """
+        if torrent_id not in self.texts:
+            return
+        name, text = self.texts.pop(torrent_id)
+        for gram in get_grams(text):
+            torrent_ids = self.grams[gram]
+            torrent_ids.discard(torrent_id)
+            if not torrent_ids:
+                del self.grams[gram]
+
+    def get_candidates(self, search_string):
+        """
+        Returns the torrent_ids whose text may contain search_string, which
+        must be lowercase.
+        """
+        if len(search_string) < GRAM_SIZE:
+            # Too short to be looked up, every torrent is a candidate
+            return self.texts.keys()
+
+        grams = []
+        for gram in get_grams(search_string):
+            if gram not in self.grams:
+                return []
+            grams.append(self.grams[gram])
+        grams.sort(key=len)
+        return grams[0].intersection(*grams[1:])
+
+    def search(self, keyword):
+        """
+        Returns the set of torrent_ids whose text contains the keyword.
+
+        :param keyword: the lowercase string to look for
+        :type keyword: string
+
+        """
+        return set([torrent_id for torrent_id in self.get_candidates(keyword)
+                    if keyword in self.texts[torrent_id][1]])
+
+    def search_name(self, search_string, match_case=False):
+        """
+        Returns the set of torrent_ids whose name contains search_string.
+
+        :param search_string: the string to look for
+        :type search_string: string
+        :param match_case: if False, the case is ignored
+        :type match_case: bool
+
+        """
+        if not match_case:
+            search_string = search_string.lower()
+
+        matched = set()
+        for torrent_id in self.get_candidates(search_string.lower()):
+            name = self.texts[torrent_id][0]
+            if not match_case:
+                name = name.lower()
+            if search_string in name:
+                matched.add(torrent_id)
+        return matched
@@ -141,7 +141,11 @@
     "cache_size": 512,
     "cache_expiry": 60,
     "auto_manage_prefer_seeds": False,
-    "shared": False
+    "shared": False,
+    "event_batch_window": 100,
+    "rpc_compression_level": 6,
+    "rpc_compression_threshold": 512,
+    "alert_wakeup": "wait"
 }
 
 class PreferencesManager(component.Component):
@@ -475,6 +479,24 @@ def _on_set_cache_expiry(self, key, value):
         log.debug("%s: %s", key, value)
         self.session_set_setting("cache_expiry", value)
 
+    def _on_set_event_batch_window(self, key, value):
+        log.debug("%s: %s", key, value)
+        # The window is set in milliseconds
+        component.get("RPCServer").event_batch_window = max(value, 0) / 1000.0
+
+    def _on_set_rpc_compression_level(self, key, value):
+        log.debug("%s: %s", key, value)
+        # Only used for the clients that connect after the change
+        component.get("RPCServer").compression_level = min(max(value, 0), 9)
+
+    def _on_set_rpc_compression_threshold(self, key, value):
+        log.debug("%s: %s", key, value)
+        component.get("RPCServer").compression_threshold = max(value, 0)
+
+    def _on_set_alert_wakeup(self, key, value):
+        log.debug("%s: %s", key, value)
+        component.get("AlertManager").set_wakeup_mode(value)
+
     def _on_auto_manage_prefer_seeds(self, key, value):
         log.debug("%s set to %s..", key, value)
         self.session_set_setting("auto_manage_prefer_seeds", value)
@@ -0,0 +1,227 @@
+#
+# resumestore.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+The ResumeDataStore keeps the libtorrent resume data of the torrents in small
+shard files instead of one big torrents.fastresume file.
+
+Torrents are placed into a shard based on the first characters of their
+torrent_id, and only the shards holding resume data that changed are rewritten
+when saving.
+
+"""
+
+import os
+import shutil
+import logging
+
+from deluge.bencode import bencode, bdecode
+
+log = logging.getLogger(__name__)
+
+# The number of leading torrent_id characters used to pick a shard, this gives
+# 256 shards for hex torrent_ids
+SHARD_PREFIX_LENGTH = 2
+
+class ResumeDataStore(object):
+    """
+    A dict-like store of bencoded resume data, keyed by torrent_id.
+
+    Values set on the store are only kept in memory until the next call to
+    :meth:`save`.  Reading a value loads the shard holding it from disk, the
+    shards read are cached until :meth:`clear_cache` is called.
+
+    :param path: the directory the shard files are stored in
+    :type path: string
+
+    """
+    def __init__(self, path):
+        self.path = path
+        # Changes waiting to be written {shard: {torrent_id: data or None}}
+        self.dirty = {}
+        # Shards read from disk {shard: {torrent_id: data}}
+        self.cache = {}
+
+    def exists(self):
+        """Returns True if the shard directory exists"""
+        return os.path.isdir(self.path)
+
+    def shard_name(self, torrent_id):
+        return torrent_id[:SHARD_PREFIX_LENGTH].lower()
+
+    def shard_path(self, shard):
+        return os.path.join(self.path, shard + ".fastresume")
+
+    def read_shard(self, shard):
+        """
+        Returns the resume data in a shard, reading it from disk if it is not
+        cached yet.
+
+        :returns: the resume data in the shard {torrent_id: data}
+        :rtype: dict
+
+        """
+        if shard not in self.cache:
+            self.cache[shard] = self._load_shard(shard)
+        return self.cache[shard]
+
+    def _load_shard(self, shard):
+        try:
+            shard_file = open(self.shard_path(shard), "rb")
+            data = bdecode(shard_file.read())
+            shard_file.close()
+        except IOError:
+            data = {}
+        except Exception, e:
+            log.warning("Unable to load fastresume shard %s: %s", shard, e)
+            data = {}
+
+        if not isinstance(data, dict):
+            data = {}
+        return data
+
+    def get(self, torrent_id, default=None):
+        """
+        Returns the resume data for `torrent_id`.
+
+        :param torrent_id: the torrent_id
+        :type torrent_id: string
+        :param default: the value returned if there is no resume data
+        :returns: the bencoded resume data
+        :rtype: string
+
+        """
+        shard = self.shard_name(torrent_id)
+        if torrent_id in self.dirty.get(shard, {}):
+            data = self.dirty[shard][torrent_id]
+            return default if data is None else data
+        return self.read_shard(shard).get(torrent_id, default)
+
+    def __getitem__(self, torrent_id):
+        data = self.get(torrent_id)
+        if data is None:
+            raise KeyError(torrent_id)
+        return data
+
+    def __setitem__(self, torrent_id, data):
+        self.dirty.setdefault(self.shard_name(torrent_id), {})[torrent_id] = data
+
+    def __contains__(self, torrent_id):
+        return self.get(torrent_id) is not None
+
+    def remove(self, torrent_id):
+        """
+        Removes the resume data for `torrent_id` on the next save.  This does
+        not read the shard from disk.
+
+        :param torrent_id: the torrent_id
+        :type torrent_id: string
+
+        """
+        self.dirty.setdefault(self.shard_name(torrent_id), {})[torrent_id] = None
+
+    def update(self, resume_data):
+        """
+        Adds all the resume data in `resume_data` to the store, this is used to
+        import an old torrents.fastresume file.
+
+        :param resume_data: {torrent_id: data, ...}
+        :type resume_data: dict
+
+        """
+        for torrent_id, data in resume_data.iteritems():
+            self[torrent_id] = data
+
+    def clear_cache(self):
+        """Drops the shards read from disk to free the memory they use"""
+        self.cache = {}
+
+    def save(self):
+        """
+        Writes out the shards with changed resume data.
+
+        :returns: True if all the changed shards were written
+        :rtype: bool
+
+        """
+        if not self.dirty:
+            return True
+
+        if not os.path.isdir(self.path):
+            try:
+                os.makedirs(self.path)
+            except OSError, e:
+                log.warning("Unable to create fastresume directory: %s", e)
+                return False
+
+        success = True
+        dirty, self.dirty = self.dirty, {}
+        for shard, changes in dirty.iteritems():
+            if shard in self.cache:
+                data = dict(self.cache[shard])
+            else:
+                data = self._load_shard(shard)
+            for torrent_id, value in changes.iteritems():
+                if value is None:
+                    data.pop(torrent_id, None)
+                else:
+                    data[torrent_id] = value
+
+            path = self.shard_path(shard)
+            try:
+                if data:
+                    shard_file = open(path + ".new", "wb")
+                    shard_file.write(bencode(data))
+                    shard_file.flush()
+                    os.fsync(shard_file.fileno())
+                    shard_file.close()
+                    shutil.move(path + ".new", path)
+                elif os.path.exists(path):
+                    os.remove(path)
+            except (IOError, OSError), e:
+                log.warning("Unable to save fastresume shard %s: %s", path, e)
+                # Keep the changes around so the next save tries again
+                pending = self.dirty.setdefault(shard, {})
+                for torrent_id, value in changes.iteritems():
+                    pending.setdefault(torrent_id, value)
+                success = False
+                continue
+
+            if shard in self.cache:
+                self.cache[shard] = data
+
+        log.debug("Saved %s fastresume shards.", len(dirty))
+        return success
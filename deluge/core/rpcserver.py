@@ -41,9 +41,13 @@
 import stat
 import logging
 import traceback
+import itertools
+from collections import Iterator
 
 from twisted.internet.protocol import Factory, Protocol
-from twisted.internet import reactor, defer
+from twisted.internet import reactor, defer, task, threads
+from twisted.python.threadpool import ThreadPool
+from twisted.python.failure import Failure
 
 from OpenSSL import crypto, SSL
 from types import FunctionType
@@ -60,15 +64,26 @@
 from deluge.error import (DelugeError, NotAuthorizedError, WrappedException,
                           _ClientSideRecreateError, IncompatibleClient)
 
-from deluge.transfer import DelugeTransferProtocol
+from deluge.transfer import DelugeTransferProtocol, encode_message
+from deluge.transfer import COMPRESSION_LEVEL, COMPRESSION_THRESHOLD
+from deluge.event import ClientDisconnectedEvent
+from deluge.core.rpcstats import RPCStats
 
 RPC_RESPONSE = 1
 RPC_ERROR = 2
 RPC_EVENT = 3
+RPC_EVENT_BATCH = 4
+RPC_RESPONSE_PART = 5
+
+# The number of items sent in each part of a streamed response
+STREAM_PART_SIZE = 100
+
+# The number of threads running the threaded exported methods
+RPC_THREAD_POOL_SIZE = 4
 
 log = logging.getLogger(__name__)
 
-def export(auth_level=AUTH_LEVEL_DEFAULT):
+def export(auth_level=AUTH_LEVEL_DEFAULT, threaded=False, max_concurrent=None):
     """
     Decorator function to register an object's method as an RPC.  The object
     will need to be registered with an :class:`RPCServer` to be effective.
@@ -77,11 +92,22 @@ def export(auth_level=AUTH_LEVEL_DEFAULT):
     :type func: function
     :param auth_level: the auth level required to call this method
     :type auth_level: int
+    :param threaded: if True, the method is run in the thread pool of the
+        :class:`RPCServer` so blocking I/O doesn't hold up the other clients.
+        It must not use the reactor or the components, and the session id
+        isn't available to it.
+    :type threaded: bool
+    :param max_concurrent: the number of calls of a threaded method that
+        may run at the same time, the other calls wait in a queue.  Defaults
+        to the size of the thread pool.
+    :type max_concurrent: int
 
     """
     def wrap(func, *args, **kwargs):
         func._rpcserver_export = True
         func._rpcserver_auth_level = auth_level
+        func._rpcserver_threaded = threaded
+        func._rpcserver_max_concurrent = max_concurrent
         doc = func.__doc__
         func.__doc__ = "**RPC Exported Function** (*Auth Level: %s*)\n\n" % auth_level
         if doc:
@@ -137,6 +163,10 @@ def getContext(self):
         return ctx
 
 class DelugeRPCProtocol(DelugeTransferProtocol):
+    # Set by daemon.set_streaming if the client handles streamed responses
+    streaming = False
+    # The number of calls made by the client
+    calls = 0
 
     def message_received(self, request):
         """
@@ -173,8 +203,100 @@ def sendData(self, data):
             be one of the RPC message types.
         :type data: object
 
+        :returns: the size of the serialized data and of the message sent
+        :rtype: tuple
+
+        """
+        return self.transfer_message(data)
+
+    def sendFrame(self, frame):
+        """
+        Sends an already encoded message to the client.
+
+        :param frame: the message as returned by :func:`deluge.transfer.encode_message`
+        :type frame: str
+
         """
-        self.transfer_message(data)
+        self.transfer_frame(frame)
+
+    def sendStream(self, request_id, iterator, send_error, finished=None):
+        """
+        Sends the items of the iterator to the client in parts of
+        STREAM_PART_SIZE items, as RPC_RESPONSE_PART messages followed by a
+        RPC_RESPONSE with the last part.  The parts are sent from a
+        cooperative task, so the reactor isn't blocked while a large response
+        is produced.  Clients that didn't ask for streaming with
+        daemon.set_streaming get all the items in a single RPC_RESPONSE.
+
+        :param request_id: the request_id of the call being answered
+        :type request_id: int
+        :param iterator: the result of the call
+        :type iterator: iterator
+        :param send_error: called from within an except clause to send the
+            exception raised by the iterator to the client
+        :type send_error: function
+        :param finished: called once the stream has been sent, with the total
+            size of the serialized data and of the messages sent, and True if
+            the iterator raised an exception or the stream was stopped
+        :type finished: function
+
+        """
+        sizes = [0, 0]
+
+        def send(data):
+            payload_size, frame_size = self.sendData(data)
+            sizes[0] += payload_size
+            sizes[1] += frame_size
+
+        def send_parts():
+            part = []
+            try:
+                for item in iterator:
+                    part.append(item)
+                    if len(part) % STREAM_PART_SIZE == 0:
+                        if self.streaming:
+                            send((RPC_RESPONSE_PART, request_id, part))
+                            part = []
+                        yield None
+            except Exception, e:
+                send_error()
+                if not isinstance(e, DelugeError):
+                    log.exception("Exception streaming RPC response: %s", e)
+                if finished:
+                    finished(sizes, True)
+            else:
+                send((RPC_RESPONSE, request_id, part))
+                if finished:
+                    finished(sizes)
+
+        def on_done(result):
+            self.streams.pop(request_id, None)
+            if isinstance(result, Failure) and result.check(task.TaskStopped):
+                # The client disconnected before the stream was sent
+                if finished:
+                    finished(sizes, True)
+        # Stopped streams errback with TaskStopped, which is expected
+        stream = self.streams[request_id] = task.cooperate(send_parts())
+        stream.whenDone().addBoth(on_done)
+
+    def negotiate_compression(self, level):
+        """
+        Sets the compression of the messages sent to a client which accepts
+        uncompressed messages.  Messages to clients on the loopback interface
+        are never compressed.
+
+        :param level: the compression level asked for by the client, a
+            negative value uses the daemon's level
+        :type level: int
+
+        """
+        rpcserver = component.get("RPCServer")
+        if self.is_loopback():
+            level = 0
+        elif level < 0:
+            level = rpcserver.compression_level
+        self.set_compression(min(level, 9), rpcserver.compression_threshold)
+        log.debug("Compression for session %s: %s", self.transport.sessionno, self.compression)
 
     def connectionMade(self):
         """
@@ -185,6 +307,8 @@ def connectionMade(self):
                  peer.host, peer.port)
         # Set the initial auth level of this session to AUTH_LEVEL_NONE
         self.factory.authorized_sessions[self.transport.sessionno] = AUTH_LEVEL_NONE
+        # Holds the tasks sending streamed responses, by request_id
+        self.streams = {}
 
     def connectionLost(self, reason):
         """
@@ -201,9 +325,18 @@ def connectionLost(self, reason):
             del self.factory.session_protocols[self.transport.sessionno]
         if self.transport.sessionno in self.factory.interested_events:
             del self.factory.interested_events[self.transport.sessionno]
+        self.factory.batched_sessions.discard(self.transport.sessionno)
+
+        # Nobody is left to receive the streams
+        for stream in self.streams.values():
+            stream.stop()
+        self.streams.clear()
 
         log.info("Deluge client disconnected: %s", reason.value)
 
+        # Let the core forget what it kept for this session
+        component.get("EventManager").emit(ClientDisconnectedEvent(self.transport.sessionno))
+
     def valid_session(self):
         return self.transport.sessionno in self.factory.authorized_sessions
 
@@ -223,6 +356,8 @@ def dispatch(self, request_id, method, args, kwargs):
         :type kwargs: dict
 
         """
+        self.calls += 1
+
         def sendError():
             """
             Sends an error response with the contents of the exception that was raised.
@@ -293,6 +428,12 @@ def sendError():
 
         if method in self.factory.methods and self.valid_session():
             log.debug("RPC dispatch %s", method)
+            rpcserver = component.get("RPCServer")
+            started = rpcserver.stats.call_started(method)
+
+            def call_finished(sizes=(0, 0), error=False):
+                rpcserver.stats.call_finished(method, started, sizes[0], sizes[1], error)
+
             try:
                 method_auth_requirement = self.factory.methods[method]._rpcserver_auth_level
                 auth_level = self.factory.authorized_sessions[self.transport.sessionno][0]
@@ -304,19 +445,32 @@ def sendError():
                 # Set the session_id in the factory so that methods can know
                 # which session is calling it.
                 self.factory.session_id = self.transport.sessionno
-                ret = self.factory.methods[method](*args, **kwargs)
+                func = self.factory.methods[method]
+                if func._rpcserver_threaded:
+                    ret = rpcserver.run_threaded(
+                        method, func, args, kwargs, func._rpcserver_max_concurrent)
+                else:
+                    ret = func(*args, **kwargs)
             except Exception, e:
                 sendError()
+                call_finished(error=True)
                 # Don't bother printing out DelugeErrors, because they are just
                 # for the client
                 if not isinstance(e, DelugeError):
                     log.exception("Exception calling RPC request: %s", e)
             else:
+                def send_response(result):
+                    # Iterators are streamed to the client
+                    if isinstance(result, Iterator):
+                        self.sendStream(request_id, result, sendError, call_finished)
+                    else:
+                        call_finished(self.sendData((RPC_RESPONSE, request_id, result)))
+
                 # Check if the return value is a deferred, since we'll need to
                 # wait for it to fire before sending the RPC_RESPONSE
                 if isinstance(ret, defer.Deferred):
                     def on_success(result):
-                        self.sendData((RPC_RESPONSE, request_id, result))
+                        send_response(result)
                         return result
 
                     def on_fail(failure):
@@ -324,11 +478,12 @@ def on_fail(failure):
                             failure.raiseException()
                         except Exception, e:
                             sendError()
+                        call_finished(error=True)
                         return failure
 
                     ret.addCallbacks(on_success, on_fail)
                 else:
-                    self.sendData((RPC_RESPONSE, request_id, ret))
+                    send_response(ret)
 
 class RPCServer(component.Component):
     """
@@ -361,6 +516,31 @@ def __init__(self, port=58846, interface="", allow_remote=False, listen=True):
         self.factory.session_protocols = {}
         # Holds the interested event list for the sessions
         self.factory.interested_events = {}
+        # Holds the session_ids that want their events sent in batches
+        self.factory.batched_sessions = set()
+
+        # The time in seconds events are held back for sessions receiving
+        # batches, a value of 0 disables batching
+        self.event_batch_window = 0.1
+        # Holds the events waiting to be sent in the next batch,
+        # {collapse_key: (order, (name, args))}
+        self.event_batch = {}
+        self.event_batch_order = itertools.count()
+        self.event_batch_timer = None
+
+        # The call statistics of the exported methods
+        self.stats = RPCStats()
+
+        # Runs the threaded methods, started when first needed
+        self.thread_pool = ThreadPool(0, RPC_THREAD_POOL_SIZE, "RPCServer")
+        # The DeferredSemaphore limiting the calls of each threaded method
+        self.thread_limits = {}
+        # The queue and call counts of each threaded method
+        self.thread_stats = {}
+
+        # The compression used for the clients that negotiated it at login
+        self.compression_level = COMPRESSION_LEVEL
+        self.compression_threshold = COMPRESSION_THRESHOLD
 
         self.listen = listen
         if not listen:
@@ -386,6 +566,99 @@ def __init__(self, port=58846, interface="", allow_remote=False, listen=True):
             log.error(e)
             sys.exit(0)
 
+    def stop(self):
+        # Send any events still waiting for the batch window
+        if self.event_batch:
+            self.send_event_batch()
+        if self.thread_pool.started:
+            self.thread_pool.stop()
+
+    def run_threaded(self, name, func, args, kwargs, max_concurrent=None):
+        """
+        Runs a threaded exported method in the thread pool.  Calls above the
+        method's concurrency limit are queued until a running call returns.
+
+        :param name: the name of the method, eg. "core.get_free_space"
+        :type name: str
+        :param func: the method
+        :type func: function
+        :param args: the arguments to call the method with
+        :type args: tuple
+        :param kwargs: the keyword arguments to call the method with
+        :type kwargs: dict
+        :param max_concurrent: the number of calls that may run at the same
+            time, the size of the thread pool if None
+        :type max_concurrent: int
+
+        :returns: a Deferred firing with the return value of the method
+        :rtype: twisted.internet.defer.Deferred
+
+        """
+        if not self.thread_pool.started:
+            self.thread_pool.start()
+
+        if name not in self.thread_limits:
+            self.thread_limits[name] = defer.DeferredSemaphore(
+                max_concurrent or RPC_THREAD_POOL_SIZE)
+            self.thread_stats[name] = {"queued": 0, "max_queued": 0, "running": 0, "calls": 0}
+        stats = self.thread_stats[name]
+        stats["queued"] += 1
+        stats["max_queued"] = max(stats["max_queued"], stats["queued"])
+
+        def on_done(result):
+            stats["running"] -= 1
+            stats["calls"] += 1
+            return result
+
+        def run():
+            stats["queued"] -= 1
+            stats["running"] += 1
+            d = threads.deferToThreadPool(reactor, self.thread_pool, func, *args, **kwargs)
+            return d.addBoth(on_done)
+        return self.thread_limits[name].run(run)
+
+    def get_rpc_stats(self):
+        """
+        Returns the call statistics of the exported methods, of the connected
+        sessions and of the threaded methods.
+
+        :returns: the statistics described in
+            :meth:`deluge.core.rpcstats.RPCStats.get_stats`, with a dict of
+            the "username", "calls", "bytes_sent" and "bytes_received" of
+            each session as "sessions" and the :meth:`get_thread_stats` as
+            "threads"
+        :rtype: dict
+
+        """
+        stats = self.stats.get_stats()
+        stats["sessions"] = {}
+        for session_id, protocol in self.factory.session_protocols.items():
+            session = self.factory.authorized_sessions.get(session_id)
+            stats["sessions"][session_id] = {
+                # Sessions that have not logged in yet have no username
+                "username": session[1] if isinstance(session, tuple) else "",
+                "calls": protocol.calls,
+                "bytes_sent": protocol.get_bytes_sent(),
+                "bytes_received": protocol.get_bytes_recv()
+            }
+        stats["threads"] = self.get_thread_stats()
+        return stats
+
+    def get_thread_stats(self):
+        """
+        Returns the statistics of the threaded methods called so far.
+
+        :returns: a dict with the size of the thread pool as "threads", and
+            the number of "queued", "running" and completed calls ("calls"),
+            and the longest queue ("max_queued") of each method as "methods"
+        :rtype: dict
+
+        """
+        return {
+            "threads": self.thread_pool.max,
+            "methods": dict((name, stats.copy()) for name, stats in self.thread_stats.items())
+        }
+
     def register_object(self, obj, name=None):
         """
         Registers an object to export it's rpc methods.  These methods should
@@ -508,14 +781,116 @@ def emit_event(self, event):
         :type event: :class:`deluge.event.DelugeEvent`
         """
         log.debug("intevents: %s", self.factory.interested_events)
+        # The message is the same for every session, so it is only encoded
+        # once for each compression used by the interested sessions.
+        frames = {}
+        batch = False
         # Find sessions interested in this event
         for session_id, interest in self.factory.interested_events.items():
             if event.name in interest:
-                log.debug("Emit Event: %s %s", event.name, event.args)
+                if self.event_batch_window > 0 and session_id in self.factory.batched_sessions:
+                    # This session gets the event with the next batch
+                    batch = True
+                    continue
+                protocol = self.factory.session_protocols[session_id]
+                if protocol.compression not in frames:
+                    log.debug("Emit Event: %s %s", event.name, event.args)
+                    frames[protocol.compression] = encode_message(
+                        (RPC_EVENT, event.name, event.args), protocol.compression)
                 # This session is interested so send a RPC_EVENT
-                self.factory.session_protocols[session_id].sendData(
-                    (RPC_EVENT, event.name, event.args)
-                )
+                protocol.sendFrame(frames[protocol.compression])
+
+        if batch:
+            self.queue_event(event)
+
+    def queue_event(self, event):
+        """
+        Adds the event to the next batch.  If the batch already contains an
+        event with the same collapse key, the older event is dropped and the
+        new one is put at the end of the batch.
+
+        :param event: the event to queue
+        :type event: :class:`deluge.event.DelugeEvent`
+        """
+        key = event.collapse_key
+        if key is None:
+            # This event is never collapsed, so give it a key of its own
+            key = object()
+        self.event_batch[key] = (self.event_batch_order.next(), (event.name, event.args))
+
+        if self.event_batch_timer is None:
+            self.event_batch_timer = reactor.callLater(self.event_batch_window,
+                                                       self.send_event_batch)
+
+    def send_event_batch(self):
+        """
+        Sends the queued events to the sessions receiving batches.  Each
+        session only gets the events it is interested in, and sessions with
+        the same interests and compression share the encoded message.
+        """
+        if self.event_batch_timer and self.event_batch_timer.active():
+            self.event_batch_timer.cancel()
+        self.event_batch_timer = None
+
+        events = [event for order, event in sorted(self.event_batch.itervalues())]
+        self.event_batch = {}
+
+        frames = {}
+        for session_id in self.factory.batched_sessions:
+            if session_id not in self.factory.interested_events:
+                continue
+            protocol = self.factory.session_protocols[session_id]
+            key = (frozenset(self.factory.interested_events[session_id]), protocol.compression)
+            if key not in frames:
+                batch = [e for e in events if e[0] in key[0]]
+                frames[key] = encode_message((RPC_EVENT_BATCH, batch), key[1]) if batch else None
+            if frames[key]:
+                protocol.sendFrame(frames[key])
+
+    def set_event_batching(self, session_id, enabled):
+        """
+        Sets whether the events for a session are sent in batches.
+
+        :param session_id: the session
+        :type session_id: int
+        :param enabled: True to send the events in batches
+        :type enabled: bool
+        """
+        if enabled:
+            self.factory.batched_sessions.add(session_id)
+        elif session_id in self.factory.batched_sessions:
+            # Send the events this session is still waiting for
+            if self.event_batch:
+                self.send_event_batch()
+            self.factory.batched_sessions.remove(session_id)
+
+    def set_compression(self, session_id, level):
+        """
+        Sets the compression of the messages sent to a session, see
+        :meth:`DelugeRPCProtocol.negotiate_compression`.
+
+        :param session_id: the session
+        :type session_id: int
+        :param level: the compression level asked for by the client
+        :type level: int
+        :returns: the compression level used
+        :rtype: int
+        """
+        protocol = self.factory.session_protocols[session_id]
+        protocol.negotiate_compression(level)
+        return protocol.compression
+
+    def set_streaming(self, session_id, enabled):
+        """
+        Sets whether the items of methods returning an iterator are streamed
+        to a session in RPC_RESPONSE_PART messages.
+
+        :param session_id: the session
+        :type session_id: int
+        :param enabled: True to stream the items
+        :type enabled: bool
+        """
+        self.factory.session_protocols[session_id].streaming = enabled
 
     def emit_event_for_session_id(self, session_id, event):
         """
@@ -0,0 +1,160 @@
+#
+# rpcstats.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+Keeps the call statistics of the exported methods for the RPCServer.
+
+The durations and sizes are kept for the calls of the last
+:data:`RPC_STATS_WINDOW` seconds, at most :data:`RPC_STATS_SAMPLES` per
+method, so the statistics follow changes in the load instead of averaging
+them away since the daemon started.
+"""
+
+import math
+import time
+from collections import deque
+
+# The number of seconds the samples are kept
+RPC_STATS_WINDOW = 300
+# The maximum number of samples kept for each method
+RPC_STATS_SAMPLES = 1000
+
+def percentile(values, percent):
+    """
+    Returns the nearest-rank percentile of the sorted values.
+
+    :param values: the values, sorted
+    :type values: list
+    :param percent: the percentile, between 0 and 100
+    :type percent: int
+
+    :returns: the value, or 0 if there are no values
+
+    """
+    if not values:
+        return 0
+    rank = int(math.ceil(percent / 100.0 * len(values)))
+    return values[min(max(rank, 1), len(values)) - 1]
+
+class MethodStats(object):
+    def __init__(self, max_samples):
+        self.calls = 0
+        self.errors = 0
+        self.in_flight = 0
+        # (time, duration, payload bytes, sent bytes) of the recent calls
+        self.samples = deque(maxlen=max_samples)
+
+class RPCStats(object):
+    """
+    Records the number of calls, the time they took and the size of the
+    responses for each method.
+    """
+    def __init__(self, window=RPC_STATS_WINDOW, max_samples=RPC_STATS_SAMPLES):
+        self.window = window
+        self.max_samples = max_samples
+        self.methods = {}
+
+    def call_started(self, method):
+        """
+        Records the start of a call.
+
+        :param method: the method called
+        :type method: str
+
+        :returns: the time the call started, to pass to :meth:`call_finished`
+        :rtype: float
+
+        """
+        if method not in self.methods:
+            self.methods[method] = MethodStats(self.max_samples)
+        self.methods[method].in_flight += 1
+        return time.time()
+
+    def call_finished(self, method, started, payload_bytes=0, sent_bytes=0, error=False):
+        """
+        Records the end of a call.
+
+        :param method: the method called
+        :type method: str
+        :param started: the value returned by :meth:`call_started`
+        :type started: float
+        :param payload_bytes: the size of the response before compression
+        :type payload_bytes: int
+        :param sent_bytes: the size of the response as sent
+        :type sent_bytes: int
+        :param error: True if the call failed
+        :type error: bool
+
+        """
+        stats = self.methods[method]
+        now = time.time()
+        stats.in_flight -= 1
+        stats.calls += 1
+        if error:
+            stats.errors += 1
+        stats.samples.append((now, now - started, payload_bytes, sent_bytes))
+
+    def get_stats(self):
+        """
+        Returns the statistics of each method.  The durations and sizes are
+        those of the calls in the window.
+
+        :returns: the window in seconds as "window" and a dict for each
+            method as "methods", with the "calls", "errors" and "in_flight"
+            counts since the start, the "window_calls", the "p50", "p95" and
+            "p99" durations in seconds, and the "payload_bytes" and
+            "sent_bytes" of the responses in the window
+        :rtype: dict
+
+        """
+        start = time.time() - self.window
+        methods = {}
+        for name, stats in self.methods.items():
+            while stats.samples and stats.samples[0][0] < start:
+                stats.samples.popleft()
+            durations = sorted(sample[1] for sample in stats.samples)
+            methods[name] = {
+                "calls": stats.calls,
+                "errors": stats.errors,
+                "in_flight": stats.in_flight,
+                "window_calls": len(durations),
+                "p50": percentile(durations, 50),
+                "p95": percentile(durations, 95),
+                "p99": percentile(durations, 99),
+                "payload_bytes": sum(sample[2] for sample in stats.samples),
+                "sent_bytes": sum(sample[3] for sample in stats.samples),
+            }
+        return {"window": self.window, "methods": methods}
@@ -0,0 +1,128 @@
+#
+# sortindex.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+A SortIndex keeps the torrents sorted on a status key, so a page of the
+sorted torrent list can be returned without sorting every torrent on each
+request.
+
+Only the torrents whose status version changed since the index was last
+updated have their value read again and are moved within the index.
+
+"""
+
+import bisect
+import itertools
+
+class SortIndex(object):
+    def __init__(self, key):
+        self.key = key
+        # The Torrent.last_version the index is up to date with
+        self.version = 0
+        # The sorted (value, torrent_id) pairs
+        self.entries = []
+        # The value of each torrent in the index {torrent_id: value}
+        self.values = {}
+
+    def update(self, torrents, last_version, get_value):
+        """
+        Brings the index up to date with the torrents.
+
+        :param torrents: the current torrents
+        :type torrents: dict of torrent_id: Torrent
+        :param last_version: Torrent.last_version, taken before the update
+        :type last_version: int
+        :param get_value: returns the value of the key for a torrent_id
+        :type get_value: function
+
+        """
+        for torrent_id in [torrent_id for torrent_id in self.values if torrent_id not in torrents]:
+            self.remove(torrent_id)
+
+        changed = {}
+        for torrent_id, torrent in torrents.iteritems():
+            if torrent.version <= self.version and torrent_id in self.values:
+                continue
+            value = get_value(torrent_id)
+            if torrent_id not in self.values or self.values[torrent_id] != value:
+                changed[torrent_id] = value
+
+        if len(changed) * 8 > len(self.entries):
+            # Cheaper to sort again than to move most of the torrents
+            self.values.update(changed)
+            self.entries = sorted([(value, torrent_id) for torrent_id, value in self.values.iteritems()])
+        else:
+            for torrent_id, value in changed.iteritems():
+                if torrent_id in self.values:
+                    self.remove(torrent_id)
+                self.values[torrent_id] = value
+                bisect.insort(self.entries, (value, torrent_id))
+        self.version = last_version
+
+    def remove(self, torrent_id):
+        """
+        Removes a torrent from the index.
+        """
+        entry = (self.values.pop(torrent_id), torrent_id)
+        i = bisect.bisect_left(self.entries, entry)
+        if i < len(self.entries) and self.entries[i] == entry:
+            del self.entries[i]
+        else:
+            # Values that do not compare equal to themselves, such as nan
+            self.entries = [e for e in self.entries if e[1] != torrent_id]
+
+    def get_page(self, torrent_ids=None, reverse=False, offset=0, limit=None):
+        """
+        Returns a window of the sorted torrent ids.
+
+        :param torrent_ids: only include these torrents, None for all of them
+        :type torrent_ids: set of str
+        :param reverse: if True, sort in descending order
+        :type reverse: bool
+        :param offset: the number of torrents to skip
+        :type offset: int
+        :param limit: the maximum number of torrents to return, None for all
+        :type limit: int
+
+        :returns: the torrent ids in the window
+        :rtype: list of str
+
+        """
+        entries = reversed(self.entries) if reverse else iter(self.entries)
+        if torrent_ids is not None:
+            entries = itertools.ifilter(lambda entry: entry[1] in torrent_ids, entries)
+        stop = None if limit is None else offset + limit
+        return [torrent_id for value, torrent_id in itertools.islice(entries, offset, stop)]
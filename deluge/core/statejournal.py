@@ -0,0 +1,294 @@
+#
+# statejournal.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+The StateJournal keeps the torrents.state file up to date without re-pickling
+every torrent on each save.
+
+Only the attributes that changed since the last save are appended to a journal
+file next to the state file.  On load the journal is replayed on top of the
+state file, and once the journal grows too big it is compacted by writing out a
+fresh state file and truncating the journal.
+
+Each snapshot has a generation, which is also written at the start of the
+journal.  A journal older than the snapshot was already compacted into it,
+which happens when the daemon stops between writing the snapshot and
+truncating the journal, and is not replayed.
+
+"""
+
+import os
+import copy
+import cPickle
+import shutil
+import logging
+
+log = logging.getLogger(__name__)
+
+# Journal record types
+JOURNAL_UPDATE = 1
+JOURNAL_REMOVE = 2
+JOURNAL_GENERATION = 3
+
+# Never compact before this many records have been written to the journal
+MIN_COMPACT_RECORDS = 1000
+
+class StateJournal(object):
+    """
+    Persists a list of state objects, keyed by their torrent_id, as a pickled
+    snapshot plus an append-only journal of per-torrent deltas.
+
+    :param state_dir: the directory the state files live in
+    :type state_dir: string
+    :param state_class: the class used to create new state objects when
+        replaying the journal, it must be callable without arguments
+    :type state_class: class
+    :param container_class: the class pickled as the snapshot, its instances
+        must have a `torrents` list attribute
+    :type container_class: class
+    :param filename: the name of the snapshot file
+    :type filename: string
+
+    """
+    def __init__(self, state_dir, state_class, container_class,
+                 filename="torrents.state"):
+        self.state_class = state_class
+        self.container_class = container_class
+        self.state_file = os.path.join(state_dir, filename)
+        self.journal_file = self.state_file + ".journal"
+
+        # The attributes of each torrent as last written to disk
+        # {torrent_id: {attr: value, ...}, ...}
+        self.saved = {}
+        # The number of records in the journal since the last compaction
+        self.journal_records = 0
+        # The generation of the snapshot, see compact
+        self.generation = 0
+
+    def replay(self, states, generation=0):
+        """
+        Applies the journal on top of the states loaded from the snapshot.
+        A partly written record at the end of the journal is cut off, so
+        the records saved next are not appended after it.
+
+        :param states: the state objects from the snapshot
+        :type states: list
+        :param generation: the generation of the snapshot
+        :type generation: int
+
+        :returns: the up to date state objects
+        :rtype: list
+
+        """
+        by_id = {}
+        order = []
+        for state in states:
+            if state.torrent_id not in by_id:
+                order.append(state.torrent_id)
+            by_id[state.torrent_id] = state
+
+        records = 0
+        # The end of the last good record, None if the journal ends cleanly
+        truncate_at = None
+        try:
+            journal = open(self.journal_file, "rb")
+        except IOError:
+            journal = None
+
+        if journal:
+            log.debug("Replaying torrent state journal.")
+            while True:
+                offset = journal.tell()
+                try:
+                    record_type, torrent_id, changes = cPickle.load(journal)
+                except EOFError:
+                    break
+                except Exception, e:
+                    # Most likely a partially written record from a crash, the
+                    # records before it are still good.
+                    log.warning("Stopped replaying state journal at a bad "
+                                "record: %s", e)
+                    truncate_at = offset
+                    break
+
+                if record_type == JOURNAL_GENERATION:
+                    if torrent_id < generation:
+                        log.debug("Skipping state journal already in the state file.")
+                        truncate_at = 0
+                        break
+                    continue
+
+                records += 1
+                if record_type == JOURNAL_REMOVE:
+                    by_id.pop(torrent_id, None)
+                elif record_type == JOURNAL_UPDATE:
+                    if torrent_id not in by_id:
+                        by_id[torrent_id] = self.state_class()
+                        order.append(torrent_id)
+                    by_id[torrent_id].__dict__.update(changes)
+            journal.close()
+
+        if truncate_at is not None:
+            try:
+                journal = open(self.journal_file, "r+b")
+                journal.truncate(truncate_at)
+                journal.close()
+            except IOError, e:
+                log.warning("Unable to truncate torrent state journal: %s", e)
+
+        states = [by_id[torrent_id] for torrent_id in order if torrent_id in by_id]
+        self.saved = dict((state.torrent_id, copy.deepcopy(state.__dict__))
+                          for state in states)
+        self.journal_records = records
+        self.generation = generation
+        log.debug("Replayed %s state journal records.", records)
+        return states
+
+    def save(self, states):
+        """
+        Writes the changes between `states` and what was last saved.  If the
+        journal has grown too big a new snapshot is written instead.
+
+        :param states: the current state objects of all the torrents
+        :type states: list
+
+        :returns: True if the state was saved
+        :rtype: bool
+
+        """
+        records = []
+        current = set()
+        for state in states:
+            current.add(state.torrent_id)
+            saved = self.saved.get(state.torrent_id)
+            if saved is None:
+                records.append((JOURNAL_UPDATE, state.torrent_id, state.__dict__))
+                continue
+
+            changes = {}
+            for key, value in state.__dict__.iteritems():
+                if key not in saved or saved[key] != value:
+                    changes[key] = value
+            if changes:
+                records.append((JOURNAL_UPDATE, state.torrent_id, changes))
+
+        for torrent_id in self.saved:
+            if torrent_id not in current:
+                records.append((JOURNAL_REMOVE, torrent_id, None))
+
+        if not records:
+            return True
+
+        if self.journal_records + len(records) > max(MIN_COMPACT_RECORDS, len(states)):
+            return self.compact(states)
+
+        try:
+            journal = open(self.journal_file, "ab")
+            journal.seek(0, os.SEEK_END)
+            if journal.tell() == 0:
+                cPickle.dump((JOURNAL_GENERATION, self.generation, None),
+                             journal, cPickle.HIGHEST_PROTOCOL)
+            for record in records:
+                cPickle.dump(record, journal, cPickle.HIGHEST_PROTOCOL)
+            journal.flush()
+            os.fsync(journal.fileno())
+            journal.close()
+        except IOError, e:
+            log.warning("Unable to write torrent state journal: %s", e)
+            return False
+
+        self.journal_records += len(records)
+        for record_type, torrent_id, changes in records:
+            if record_type == JOURNAL_REMOVE:
+                del self.saved[torrent_id]
+            else:
+                self.saved.setdefault(torrent_id, {}).update(copy.deepcopy(changes))
+
+        log.debug("Wrote %s records to the torrent state journal.", len(records))
+        return True
+
+    def compact(self, states):
+        """
+        Writes a full snapshot of `states`, with the next generation, and
+        truncates the journal.
+
+        :param states: the current state objects of all the torrents
+        :type states: list
+
+        :returns: True if the snapshot was written
+        :rtype: bool
+
+        """
+        container = self.container_class()
+        container.torrents = list(states)
+        container.journal_generation = self.generation + 1
+
+        try:
+            log.debug("Saving torrent state file.")
+            state_file = open(self.state_file + ".new", "wb")
+            cPickle.dump(container, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+            state_file.close()
+        except IOError, e:
+            log.warning("Unable to save state file: %s", e)
+            return False
+
+        # We have to move the 'torrents.state.new' file to 'torrents.state'
+        try:
+            shutil.move(self.state_file + ".new", self.state_file)
+        except IOError:
+            log.warning("Unable to save state file.")
+            return False
+
+        # The snapshot now holds everything in the journal.  Replaying the
+        # journal over it could revert newer values, a crash before the
+        # journal is truncated leaves it with an older generation so it is
+        # skipped.
+        self.generation += 1
+        self.saved = dict((state.torrent_id, copy.deepcopy(state.__dict__))
+                          for state in states)
+        try:
+            open(self.journal_file, "wb").close()
+        except IOError, e:
+            log.warning("Unable to truncate torrent state journal: %s", e)
+            # The records appended to the old journal would be skipped, so
+            # the next save compacts again
+            self.journal_records = max(MIN_COMPACT_RECORDS, len(states))
+            return True
+
+        self.journal_records = 0
+        return True
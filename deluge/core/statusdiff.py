@@ -0,0 +1,118 @@
+#
+# statusdiff.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+The StatusDiffTracker remembers what status was last sent to each session, so
+only the values that changed have to be sent when a diff is requested.
+
+Instead of keeping a copy of every status dict, it keeps a tuple of the keys
+and a tuple of compact tokens for the values.  Simple values are kept as they
+are, while lists, dicts and other values are kept as a digest of their repr.
+
+"""
+
+import hashlib
+
+# Types kept as they are, these are small and can not change after being sent
+SIMPLE_TYPES = (int, long, float, bool, str, unicode, type(None))
+
+# Stands in for the token of a key missing from the previous status
+_MISSING = object()
+
+def value_token(value):
+    """
+    Returns the token stored for a status value.
+    """
+    if type(value) in SIMPLE_TYPES:
+        return value
+    return hashlib.md5(repr(value)).digest()
+
+class StatusDiffTracker(object):
+    def __init__(self):
+        # {session_id: {torrent_id: (keys, tokens)}}
+        self.sessions = {}
+
+    def diff(self, session_id, torrent_id, status):
+        """
+        Returns the values of status that changed since the last status of
+        the torrent was passed for the session, and remembers this status.
+
+        :param session_id: the session the status is for
+        :type session_id: int
+        :param torrent_id: the torrent
+        :type torrent_id: string
+        :param status: the current status of the torrent
+        :type status: dict
+
+        :returns: the changed values, or status if it is the first one
+        :rtype: dict
+
+        """
+        keys = tuple(status)
+        tokens = tuple([value_token(status[key]) for key in keys])
+
+        torrents = self.sessions.setdefault(session_id, {})
+        prev = torrents.get(torrent_id)
+        torrents[torrent_id] = (keys, tokens)
+        if prev is None:
+            return status
+
+        prev_keys, prev_tokens = prev
+        if prev_keys != keys:
+            # A different set of keys, so compare key by key
+            prev_tokens = dict(zip(prev_keys, prev_tokens))
+            prev_tokens = [prev_tokens.get(key, _MISSING) for key in keys]
+
+        diff = {}
+        for key, token, prev_token in zip(keys, tokens, prev_tokens):
+            if token != prev_token:
+                diff[key] = status[key]
+        return diff
+
+    def remove_session(self, session_id):
+        """
+        Forgets the status sent to a session, called when it disconnects.
+        """
+        if session_id in self.sessions:
+            del self.sessions[session_id]
+
+    def remove_torrent(self, torrent_id):
+        """
+        Forgets the status of a torrent, called when it is removed.
+        """
+        for torrents in self.sessions.itervalues():
+            if torrent_id in torrents:
+                del torrents[torrent_id]
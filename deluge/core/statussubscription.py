@@ -0,0 +1,126 @@
+#
+# statussubscription.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+Status subscriptions let a client register a filter and a set of status keys
+once, after which the core pushes the values that changed every time fresh
+status is received from libtorrent.
+
+The changes are sent in a columnar layout.  Every torrent matching the filter
+is given an index that stays the same for as long as it matches, and for
+every key that changed a list of indexes and a list of values is sent::
+
+    {
+        "added": {torrent_id: index, ...},
+        "removed": [index, ...],
+        "columns": {key: [[index, ...], [value, ...]], ...}
+    }
+
+"""
+
+class StatusSubscription(object):
+    """
+    Keeps track of the values last sent for a subscription.
+
+    :param filter_dict: the filter selecting the torrents, as used by
+        :meth:`deluge.core.filtermanager.FilterManager.filter_torrent_ids`
+    :type filter_dict: dict
+    :param keys: the status keys subscribed to
+    :type keys: list
+
+    """
+    def __init__(self, filter_dict, keys):
+        self.filter_dict = filter_dict
+        self.keys = keys
+        # {torrent_id: index}
+        self.indexes = {}
+        self.next_index = 0
+        # {torrent_id: {key: value}}
+        self.values = {}
+        # The torrent status version of the last update
+        self.version = 0
+
+    def update(self, status_dict, torrent_ids=None, version=None):
+        """
+        Works out what changed since the last update.
+
+        :param status_dict: the status of the torrents matching the filter,
+            only those new to the subscription or changed since `version`
+            are needed if torrent_ids is passed
+        :type status_dict: {torrent_id: {key: value}}
+        :param torrent_ids: every torrent matching the filter, None if they
+            are all in status_dict
+        :type torrent_ids: list
+        :param version: the torrent status version the status is up to date with
+        :type version: int
+
+        :returns: the changes, in the layout described in the module
+            documentation, or None if nothing changed
+        :rtype: dict
+
+        """
+        added = {}
+        removed = []
+        columns = {}
+        if version is not None:
+            self.version = version
+
+        matching = status_dict if torrent_ids is None else set(torrent_ids)
+        for torrent_id in self.indexes.keys():
+            if torrent_id not in matching:
+                removed.append(self.indexes.pop(torrent_id))
+                del self.values[torrent_id]
+
+        for torrent_id, status in status_dict.iteritems():
+            if torrent_id not in self.indexes:
+                self.indexes[torrent_id] = added[torrent_id] = self.next_index
+                self.values[torrent_id] = {}
+                self.next_index += 1
+
+            index = self.indexes[torrent_id]
+            values = self.values[torrent_id]
+            for key, value in status.iteritems():
+                if key not in values or values[key] != value:
+                    values[key] = value
+                    if key not in columns:
+                        columns[key] = [[], []]
+                    columns[key][0].append(index)
+                    columns[key][1].append(value)
+
+        if not (added or removed or columns):
+            return None
+
+        return {"added": added, "removed": removed, "columns": columns}
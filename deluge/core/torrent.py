@@ -38,11 +38,12 @@
 import time
 import logging
 import re
+from functools import wraps
 from urllib import unquote
 from urlparse import urlparse
 
 from twisted.internet.defer import Deferred, DeferredList
-from twisted.internet.task import LoopingCall
+from twisted.internet.threads import deferToThread
 from deluge._libtorrent import lt
 
 import deluge.common
@@ -55,6 +56,118 @@
 
 log = logging.getLogger(__name__)
 
+# The status keys and the expressions producing their values, where t is the
+# Torrent, s its cached libtorrent status and o its options.
+# If you add a key here->add it to core.py STATUS_KEYS too.
+STATUS_FIELDS = {
+    "active_time":            "s.active_time",
+    "all_time_download":      "s.all_time_download",
+    "compact":                "o['compact_allocation']",
+    # Adjust status.distributed_copies to return a non-negative value
+    "distributed_copies":     "0.0 if s.distributed_copies < 0 else s.distributed_copies",
+    "download_payload_rate":  "s.download_payload_rate",
+    "file_priorities":        "o['file_priorities']",
+    "hash":                   "t.torrent_id",
+    "is_auto_managed":        "o['auto_managed']",
+    "is_finished":            "t.is_finished",
+    "max_connections":        "o['max_connections']",
+    "max_download_speed":     "o['max_download_speed']",
+    "max_upload_slots":       "o['max_upload_slots']",
+    "max_upload_speed":       "o['max_upload_speed']",
+    "message":                "t.statusmsg",
+    "move_on_completed_path": "o['move_completed_path']",
+    "move_on_completed":      "o['move_completed']",
+    "move_completed_path":    "o['move_completed_path']",
+    "move_completed":         "o['move_completed']",
+    "next_announce":          "s.next_announce.seconds",
+    "num_peers":              "s.num_peers - s.num_seeds",
+    "num_seeds":              "s.num_seeds",
+    "owner":                  "t.owner",
+    "paused":                 "s.paused",
+    "prioritize_first_last":  "o['prioritize_first_last_pieces']",
+    "sequential_download":    "o['sequential_download']",
+    "progress":               "s.progress * 100",
+    "shared":                 "o['shared']",
+    "remove_at_ratio":        "o['remove_at_ratio']",
+    "save_path":              "o['download_location']",
+    "seeding_time":           "s.seeding_time",
+    # Use -1.0 to signify infinity
+    "seeds_peers_ratio":      "-1.0 if s.num_incomplete == 0 else s.num_complete / float(s.num_incomplete)",
+    "seed_rank":              "s.seed_rank",
+    "state":                  "t.state",
+    "stop_at_ratio":          "o['stop_at_ratio']",
+    "stop_ratio":             "o['stop_ratio']",
+    "time_added":             "t.time_added",
+    "total_done":             "s.total_done",
+    "total_payload_download": "s.total_payload_download",
+    "total_payload_upload":   "s.total_payload_upload",
+    "total_peers":            "s.num_incomplete",
+    "total_seeds":            "s.num_complete",
+    "total_uploaded":         "s.all_time_upload",
+    "total_wanted":           "s.total_wanted",
+    "tracker":                "s.current_tracker",
+    "trackers":               "t.trackers",
+    "tracker_status":         "t.tracker_status",
+    "upload_payload_rate":    "s.upload_payload_rate",
+    "comment":                "decode_string(t.torrent_info.comment()) if t.has_metadata else u''",
+    "num_files":              "t.torrent_info.num_files() if t.has_metadata else 0",
+    "num_pieces":             "t.torrent_info.num_pieces() if t.has_metadata else 0",
+    "piece_length":           "t.torrent_info.piece_length() if t.has_metadata else 0",
+    "private":                "t.torrent_info.priv() if t.has_metadata else False",
+    "total_size":             "t.torrent_info.total_size() if t.has_metadata else 0",
+    "eta":                    "t.get_eta()",
+    # Adjust progress to be 0-100 value
+    "file_progress":          "t.get_file_progress()",
+    "files":                  "t.get_files()",
+    "is_seed":                "t.handle.is_seed()",
+    "peers":                  "t.get_peers()",
+    "queue":                  "t.handle.queue_position()",
+    "ratio":                  "t.get_ratio()",
+    "tracker_host":           "t.get_tracker_host()",
+    "last_seen_complete":     "t.get_last_seen_complete()",
+    "name":                   "t.get_name()",
+    "pieces":                 "t._get_pieces_info()",
+}
+
+# The compiled extractors {keys: function}
+_status_extractors = {}
+# Different key sets only come from the UIs, so this limit should not be
+# reached, it just stops the cache from growing without bounds
+MAX_STATUS_EXTRACTORS = 256
+
+def get_status_extractor(keys):
+    """
+    Returns a function that builds the status dictionary for the keys from a
+    Torrent, getting all the values in one call instead of calling a function
+    per key.  The functions are compiled once for every set of keys.
+
+    :param keys: the status keys
+    :type keys: tuple of str
+
+    :returns: a function taking a Torrent and returning its status dictionary
+    :rtype: function
+
+    :raises KeyError: if a key is not in STATUS_FIELDS
+
+    """
+    try:
+        return _status_extractors[keys]
+    except KeyError:
+        pass
+
+    items = ["%r: %s" % (key, STATUS_FIELDS[key]) for key in keys]
+    source = "def extract(t):\n" \
+             "    s = t.status\n" \
+             "    o = t.options\n" \
+             "    return {%s}\n" % ", ".join(items)
+    namespace = {"decode_string": decode_string}
+    exec compile(source, "<status extractor>", "exec") in namespace
+
+    if len(_status_extractors) >= MAX_STATUS_EXTRACTORS:
+        _status_extractors.clear()
+    _status_extractors[keys] = namespace["extract"]
+    return namespace["extract"]
+
 def sanitize_filepath(filepath, folder=False):
     """
     Returns a sanitized filepath to pass to libotorrent rename_file().
@@ -80,6 +193,31 @@ def clean_filename(filename):
     else:
         return newfilepath
 
+def remove_empty_folders(folder_full_path):
+    """
+    Recursively removes the empty folders in folder_full_path, and the
+    folder itself if it is empty.  This does blocking I/O, so it is run in
+    a thread by :meth:`Torrent.remove_empty_folders`.
+    """
+    try:
+        if not os.listdir(folder_full_path):
+            os.removedirs(folder_full_path)
+            log.debug("Removed Empty Folder %s", folder_full_path)
+        else:
+            for root, dirs, files in os.walk(folder_full_path, topdown=False):
+                for name in dirs:
+                    try:
+                        os.removedirs(os.path.join(root, name))
+                        log.debug("Removed Empty Folder %s", os.path.join(root, name))
+                    except OSError as (errno, strerror):
+                        from errno import ENOTEMPTY
+                        if errno == ENOTEMPTY:
+                            # Error raised if folder is not empty
+                            log.debug("%s", strerror)
+
+    except OSError as (errno, strerror):
+        log.debug("Cannot Remove Folder: %s (ErrNo %s)", strerror, errno)
+
 class TorrentOptions(dict):
     def __init__(self):
         config = ConfigManager("core.conf").config
@@ -106,9 +244,56 @@ def __init__(self):
         self["file_priorities"] = []
         self["mapped_files"] = {}
 
+def filter_field(name, default=None):
+    """
+    Creates a property for an attribute used by the FilterManager, which
+    calls the torrent's filter_index_hook with the torrent_id and the name
+    of the attribute when the value changes.
+    """
+    attr = "_" + name
+    def fget(self):
+        return getattr(self, attr, default)
+    def fset(self, value):
+        if getattr(self, attr, default) != value:
+            setattr(self, attr, value)
+            self.bump_version()
+            if self.filter_index_hook:
+                self.filter_index_hook(self.torrent_id, name)
+    return property(fget=fget, fset=fset)
+
+def changes_status(func):
+    """
+    Decorates the Torrent methods changing the status outside of libtorrent,
+    so the torrent gets a new status version.
+    """
+    @wraps(func)
+    def wrapper(self, *args, **kwargs):
+        ret = func(self, *args, **kwargs)
+        self.bump_version()
+        return ret
+    return wrapper
+
 class Torrent(object):
     """Torrent holds information about torrents added to the libtorrent session.
     """
+    # Set by the FilterManager, called when one of the attributes it uses
+    # changes
+    filter_index_hook = None
+
+    # The last status version given to a torrent.  The versions are shared by
+    # all the torrents, so a client can ask for the torrents that changed
+    # since the last version it has seen.
+    last_version = 0
+    # The version of the torrent's status, see bump_version
+    version = 0
+
+    state = filter_field("state")
+    owner = filter_field("owner")
+    tracker_host = filter_field("tracker_host")
+    tracker_status = filter_field("tracker_status", "")
+    # The name and files are searched by the keyword filter
+    has_metadata = filter_field("has_metadata", False)
+
     def __init__(self, handle, options, state=None, filename=None, magnet=None, owner=None):
         # Set the torrent_id for this torrent
         self.torrent_id = str(handle.info_hash())
@@ -120,13 +305,6 @@ def __init__(self, handle, options, state=None, filename=None, magnet=None, owne
         self.config = ConfigManager("core.conf")
         self.rpcserver = component.get("RPCServer")
 
-        # This dict holds previous status dicts returned for this torrent
-        # We use this to return dicts that only contain changes from the previous
-        # {session_id: status_dict, ...}
-        self.prev_status = {}
-        self.prev_status_cleanup_loop = LoopingCall(self._cleanup_prev_status)
-        self.prev_status_cleanup_loop.start(10)
-
         # Set the libtorrent handle
         self.handle = handle
 
@@ -155,7 +333,6 @@ def __init__(self, handle, options, state=None, filename=None, magnet=None, owne
             self.torrent_info = None
 
         self.has_metadata = self.handle.has_metadata()
-        self.status_funcs = None
 
         # Default total_uploaded to 0, this may be changed by the state
         self.total_uploaded = 0
@@ -226,7 +403,6 @@ def __init__(self, handle, options, state=None, filename=None, magnet=None, owne
         self.forcing_recheck_paused = False
 
         self.update_status(self.handle.status())
-        self._create_status_funcs()
 
         if log.isEnabledFor(logging.DEBUG):
             log.debug("Torrent object created.")
@@ -239,6 +415,7 @@ def on_metadata_received(self):
         self.write_torrentfile()
 
     ## Options methods ##
+    @changes_status
     def set_options(self, options):
         OPTIONS_FUNCS = {
             # Functions used for setting options
@@ -269,14 +446,17 @@ def get_options(self):
     def set_owner(self, account):
         self.owner = account
 
+    @changes_status
     def set_max_connections(self, max_connections):
         self.options["max_connections"] = int(max_connections)
         self.handle.set_max_connections(max_connections)
 
+    @changes_status
     def set_max_upload_slots(self, max_slots):
         self.options["max_upload_slots"] = int(max_slots)
         self.handle.set_max_uploads(max_slots)
 
+    @changes_status
     def set_max_upload_speed(self, m_up_speed):
         self.options["max_upload_speed"] = m_up_speed
         if m_up_speed < 0:
@@ -285,6 +465,7 @@ def set_max_upload_speed(self, m_up_speed):
             v = int(m_up_speed * 1024)
         self.handle.set_upload_limit(v)
 
+    @changes_status
     def set_max_download_speed(self, m_down_speed):
         self.options["max_download_speed"] = m_down_speed
         if m_down_speed < 0:
@@ -293,6 +474,7 @@ def set_max_download_speed(self, m_down_speed):
             v = int(m_down_speed * 1024)
         self.handle.set_download_limit(v)
 
+    @changes_status
     def set_prioritize_first_last(self, prioritize):
         self.options["prioritize_first_last_pieces"] = prioritize
         if not prioritize:
@@ -334,31 +516,39 @@ def set_prioritize_first_last(self, prioritize):
         self.handle.prioritize_pieces(priorities)
         return prioritized_pieces, priorities
 
+    @changes_status
     def set_sequential_download(self, set_sequencial):
         self.options["sequential_download"] = set_sequencial
         self.handle.set_sequential_download(set_sequencial)
 
+    @changes_status
     def set_auto_managed(self, auto_managed):
         self.options["auto_managed"] = auto_managed
         if not (self.handle.is_paused() and not self.handle.is_auto_managed()):
             self.handle.auto_managed(auto_managed)
             self.update_state()
 
+    @changes_status
     def set_stop_ratio(self, stop_ratio):
         self.options["stop_ratio"] = stop_ratio
 
+    @changes_status
     def set_stop_at_ratio(self, stop_at_ratio):
         self.options["stop_at_ratio"] = stop_at_ratio
 
+    @changes_status
     def set_remove_at_ratio(self, remove_at_ratio):
         self.options["remove_at_ratio"] = remove_at_ratio
 
+    @changes_status
     def set_move_completed(self, move_completed):
         self.options["move_completed"] = move_completed
 
+    @changes_status
     def set_move_completed_path(self, move_completed_path):
         self.options["move_completed_path"] = move_completed_path
 
+    @changes_status
     def set_file_priorities(self, file_priorities):
         if not self.has_metadata:
             return
@@ -395,6 +585,7 @@ def set_file_priorities(self, file_priorities):
         if self.options["prioritize_first_last_pieces"]:
             self.set_prioritize_first_last(self.options["prioritize_first_last_pieces"])
 
+    @changes_status
     def set_trackers(self, trackers):
         """Sets trackers"""
         if trackers == None:
@@ -433,6 +624,7 @@ def set_trackers(self, trackers):
 
     ### End Options methods ###
 
+    @changes_status
     def set_save_path(self, save_path):
         self.options["download_location"] = save_path
 
@@ -499,6 +691,7 @@ def set_state(self, state):
         self.state = state
         return
 
+    @changes_status
     def set_status_message(self, message):
         self.statusmsg = message
 
@@ -665,30 +858,14 @@ def get_status(self, keys, diff=False, update=False):
             self.update_status(self.handle.status())
 
         if not keys:
-            keys = self.status_funcs.keys()
+            keys = STATUS_FIELDS.keys()
 
-        status_dict = {}
-
-        for key in keys:
-            status_dict[key] = self.status_funcs[key]()
+        status_dict = get_status_extractor(tuple(keys))(self)
 
         if diff:
-            session_id = self.rpcserver.get_session_id()
-            if session_id in self.prev_status:
-                # We have a previous status dict, so lets make a diff
-                status_diff = {}
-                for key, value in status_dict.items():
-                    if key in self.prev_status[session_id]:
-                        if value != self.prev_status[session_id][key]:
-                            status_diff[key] = value
-                    else:
-                        status_diff[key] = value
-
-                self.prev_status[session_id] = status_dict
-                return status_diff
-
-            self.prev_status[session_id] = status_dict
-            return status_dict
+            # The TorrentManager keeps track of what was sent to each session
+            return component.get("TorrentManager").status_diff.diff(
+                self.rpcserver.get_session_id(), self.torrent_id, status_dict)
 
         return status_dict
 
@@ -701,77 +878,15 @@ def update_status(self, status):
 
         """
         self.status = status
+        self.bump_version()
 
-    def _create_status_funcs(self):
-        #if you add a key here->add it to core.py STATUS_KEYS too.
-        self.status_funcs = {
-            "active_time":            lambda: self.status.active_time,
-            "all_time_download":      lambda: self.status.all_time_download,
-            "compact":                lambda: self.options["compact_allocation"],
-            "distributed_copies":     lambda: 0.0 if self.status.distributed_copies < 0 else \
-                self.status.distributed_copies, # Adjust status.distributed_copies to return a non-negative value
-            "download_payload_rate":  lambda: self.status.download_payload_rate,
-            "file_priorities":        lambda: self.options["file_priorities"],
-            "hash":                   lambda: self.torrent_id,
-            "is_auto_managed":        lambda: self.options["auto_managed"],
-            "is_finished":            lambda: self.is_finished,
-            "max_connections":        lambda: self.options["max_connections"],
-            "max_download_speed":     lambda: self.options["max_download_speed"],
-            "max_upload_slots":       lambda: self.options["max_upload_slots"],
-            "max_upload_speed":       lambda: self.options["max_upload_speed"],
-            "message":                lambda: self.statusmsg,
-            "move_on_completed_path": lambda: self.options["move_completed_path"],
-            "move_on_completed":      lambda: self.options["move_completed"],
-            "move_completed_path":    lambda: self.options["move_completed_path"],
-            "move_completed":         lambda: self.options["move_completed"],
-            "next_announce":          lambda: self.status.next_announce.seconds,
-            "num_peers":              lambda: self.status.num_peers - self.status.num_seeds,
-            "num_seeds":              lambda: self.status.num_seeds,
-            "owner":                  lambda: self.owner,
-            "paused":                 lambda: self.status.paused,
-            "prioritize_first_last":  lambda: self.options["prioritize_first_last_pieces"],
-            "sequential_download":    lambda: self.options["sequential_download"],
-            "progress":               lambda: self.status.progress * 100,
-            "shared":                 lambda: self.options["shared"],
-            "remove_at_ratio":        lambda: self.options["remove_at_ratio"],
-            "save_path":              lambda: self.options["download_location"],
-            "seeding_time":           lambda: self.status.seeding_time,
-            "seeds_peers_ratio":      lambda: -1.0 if self.status.num_incomplete == 0 else \
-                self.status.num_complete / float(self.status.num_incomplete), # Use -1.0 to signify infinity
-            "seed_rank":              lambda: self.status.seed_rank,
-            "state":                  lambda: self.state,
-            "stop_at_ratio":          lambda: self.options["stop_at_ratio"],
-            "stop_ratio":             lambda: self.options["stop_ratio"],
-            "time_added":             lambda: self.time_added,
-            "total_done":             lambda: self.status.total_done,
-            "total_payload_download": lambda: self.status.total_payload_download,
-            "total_payload_upload":   lambda: self.status.total_payload_upload,
-            "total_peers":            lambda: self.status.num_incomplete,
-            "total_seeds":            lambda: self.status.num_complete,
-            "total_uploaded":         lambda: self.status.all_time_upload,
-            "total_wanted":           lambda: self.status.total_wanted,
-            "tracker":                lambda: self.status.current_tracker,
-            "trackers":               lambda: self.trackers,
-            "tracker_status":         lambda: self.tracker_status,
-            "upload_payload_rate":    lambda: self.status.upload_payload_rate,
-            "comment":                lambda: decode_string(self.torrent_info.comment()) if self.has_metadata else u"",
-            "num_files":              lambda: self.torrent_info.num_files() if self.has_metadata else 0,
-            "num_pieces":             lambda: self.torrent_info.num_pieces() if self.has_metadata else 0,
-            "piece_length":           lambda: self.torrent_info.piece_length() if self.has_metadata else 0,
-            "private":                lambda: self.torrent_info.priv() if self.has_metadata else False,
-            "total_size":             lambda: self.torrent_info.total_size() if self.has_metadata else 0,
-            "eta":                    self.get_eta,
-            "file_progress":          self.get_file_progress, # Adjust progress to be 0-100 value
-            "files":                  self.get_files,
-            "is_seed":                self.handle.is_seed,
-            "peers":                  self.get_peers,
-            "queue":                  self.handle.queue_position,
-            "ratio":                  self.get_ratio,
-            "tracker_host":           self.get_tracker_host,
-            "last_seen_complete":     self.get_last_seen_complete,
-            "name":                   self.get_name,
-            "pieces":                 self._get_pieces_info,
-            }
+    def bump_version(self):
+        """
+        Gives the torrent a new status version, called whenever its status
+        may have changed.
+        """
+        Torrent.last_version += 1
+        self.version = Torrent.last_version
 
     def get_name(self):
         if self.has_metadata:
@@ -1008,40 +1123,17 @@ def remove_empty_folders(self, folder):
         Recursively removes folders but only if they are empty.
         Cleans up after libtorrent folder renames.
 
+        The folders are removed in a thread, so a large folder tree doesn't
+        block the reactor.
+
+        :returns: A deferred which fires when the folders have been removed
+        :rtype: twisted.internet.defer.Deferred
         """
         info = self.get_status(['save_path'])
         # Regex removes leading slashes that causes join function to ignore save_path
         folder_full_path = os.path.join(info['save_path'], re.sub("^/*", "", folder))
         folder_full_path = os.path.normpath(folder_full_path)
-
-        try:
-            if not os.listdir(folder_full_path):
-                os.removedirs(folder_full_path)
-                log.debug("Removed Empty Folder %s", folder_full_path)
-            else:
-                for root, dirs, files in os.walk(folder_full_path, topdown=False):
-                    for name in dirs:
-                        try:
-                            os.removedirs(os.path.join(root, name))
-                            log.debug("Removed Empty Folder %s", os.path.join(root, name))
-                        except OSError as (errno, strerror):
-                            from errno import ENOTEMPTY
-                            if errno == ENOTEMPTY:
-                                # Error raised if folder is not empty
-                                log.debug("%s", strerror)
-
-        except OSError as (errno, strerror):
-            log.debug("Cannot Remove Folder: %s (ErrNo %s)", strerror, errno)
-
-    def _cleanup_prev_status(self):
-        """
-        This method gets called to check the validity of the keys in the prev_status
-        dict.  If the key is no longer valid, the dict will be deleted.
-
-        """
-        for key in self.prev_status.keys():
-            if not self.rpcserver.is_session_valid(key):
-                del self.prev_status[key]
+        return deferToThread(remove_empty_folders, folder_full_path)
 
     def calculate_last_seen_complete(self):
         if self._last_seen_complete+60 > time.time():
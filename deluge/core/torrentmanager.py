@@ -43,8 +43,9 @@
 import logging
 import time
 
-from twisted.internet.task import LoopingCall
+from twisted.internet.task import LoopingCall, cooperate
 from twisted.internet.defer import Deferred, DeferredList
+from twisted.internet.threads import deferToThread
 from twisted.internet import reactor
 
 from deluge._libtorrent import lt
@@ -54,13 +55,29 @@
 import deluge.component as component
 from deluge.configmanager import ConfigManager, get_config_dir
 from deluge.core.authmanager import AUTH_LEVEL_ADMIN
-from deluge.core.torrent import Torrent
+from deluge.core.torrent import Torrent, STATUS_FIELDS, MAX_STATUS_EXTRACTORS
 from deluge.core.torrent import TorrentOptions
+from deluge.core.statejournal import StateJournal
+from deluge.core.resumestore import ResumeDataStore
+from deluge.core.statussubscription import StatusSubscription
+from deluge.core.statusdiff import StatusDiffTracker
+from deluge.core.sortindex import SortIndex
 import deluge.core.oldstateupgrader
 from deluge.common import utf8_encoded, decode_string
 
 log = logging.getLogger(__name__)
 
+# The number of torrents added from the state in one reactor iteration
+LOAD_STATE_BATCH_SIZE = 100
+
+# How often, in seconds, libtorrent is asked for fresh status while there
+# are status subscriptions
+STATUS_SUBSCRIPTION_INTERVAL = 1
+
+# The number of sort keys the torrents are kept sorted on, each index holds
+# every torrent
+MAX_SORT_INDEXES = 16
+
 class TorrentState:
     def __init__(self,
             torrent_id=None,
@@ -156,13 +173,35 @@ def __init__(self):
         # The Deferreds will be completed when resume data has been saved.
         self.waiting_on_resume_data = {}
 
-        # Keeps track of resume data
-        self.resume_data = {}
+        # Keeps track of resume data, stored in shards in state/resume
+        self.resume_data = ResumeDataStore(
+            os.path.join(get_config_dir(), "state", "resume"))
+
+        # Writes out only the torrent states that changed since the last save
+        self.state_journal = StateJournal(os.path.join(get_config_dir(), "state"),
+                                          TorrentState, TorrentManagerState)
 
         self.torrents_status_requests = []
+        # The keys for the Torrent class and the plugins {keys: (torrent_keys, plugin_keys)}
+        self.separated_keys = {}
         self.status_dict = {}
         self.last_state_update_alert_ts = 0
 
+        # The status subscriptions of the sessions {session_id: StatusSubscription}
+        self.status_subscriptions = {}
+        self.status_subscription_timer = LoopingCall(self.session.post_torrent_updates)
+
+        # Keeps track of the status sent to the sessions for diffs
+        self.status_diff = StatusDiffTracker()
+
+        # The torrents sorted on the status keys asked for {key: SortIndex}
+        self.sort_indexes = {}
+
+        # The torrent states still waiting to be added by load_state
+        self.pending_states = []
+        self.load_state_task = None
+        self.load_progress = {"loaded": 0, "total": 0, "finished": False}
+
         # Register set functions
         self.config.register_set_function("max_connections_per_torrent",
             self.on_set_max_connections_per_torrent)
@@ -181,9 +220,9 @@ def __init__(self):
         self.alerts.register_handler("torrent_checked_alert",
             self.on_alert_torrent_checked)
         self.alerts.register_handler("tracker_reply_alert",
-            self.on_alert_tracker_reply)
+            self.on_alert_tracker_reply, batch=True)
         self.alerts.register_handler("tracker_announce_alert",
-            self.on_alert_tracker_announce)
+            self.on_alert_tracker_announce, batch=True)
         self.alerts.register_handler("tracker_warning_alert",
             self.on_alert_tracker_warning)
         self.alerts.register_handler("tracker_error_alert",
@@ -209,6 +248,10 @@ def __init__(self):
         self.alerts.register_handler("state_update_alert",
             self.on_alert_state_update)
 
+        # Register event handlers
+        component.get("EventManager").register_event_handler(
+            "ClientDisconnectedEvent", self.on_client_disconnected)
+
     def start(self):
         # Get the pluginmanager reference
         self.plugins = component.get("CorePluginManager")
@@ -225,13 +268,17 @@ def start(self):
         self.save_resume_data_timer = LoopingCall(self.save_resume_data)
         self.save_resume_data_timer.start(190, False)
         # Force update for all resume data a bit less frequently
-        self.save_all_resume_data_timer = LoopingCall(self.save_resume_data, self.torrents.keys())
+        self.save_all_resume_data_timer = LoopingCall(
+            lambda: self.save_resume_data(self.torrents.keys()))
         self.save_all_resume_data_timer.start(900, False)
 
-        if self.last_seen_complete_loop:
-            self.last_seen_complete_loop.start(60)
-
     def stop(self):
+        # Stop loading the torrents from the state, the ones not loaded yet
+        # are kept in the state file by save_state
+        if self.load_state_task:
+            self.load_state_task.stop()
+            self.load_state_task = None
+
         # Stop timers
         if self.save_state_timer.running:
             self.save_state_timer.stop()
@@ -242,16 +289,16 @@ def stop(self):
         if self.save_all_resume_data_timer.running:
             self.save_all_resume_data_timer.stop()
 
-        if self.last_seen_complete_loop:
+        if self.last_seen_complete_loop and self.last_seen_complete_loop.running:
             self.last_seen_complete_loop.stop()
 
+        if self.status_subscription_timer.running:
+            self.status_subscription_timer.stop()
+
         # Save state on shutdown
-        self.save_state()
+        self.save_state(compact=True)
 
         self.session.pause()
-        for key in self.torrents:
-            # Stop the status cleanup LoopingCall here
-            self.torrents[key].prev_status_cleanup_loop.stop()
 
         return self.save_resume_data(self.torrents.keys())
 
@@ -328,8 +375,15 @@ def legacy_delete_resume_data(self, torrent_id):
             log.warning("Unable to delete the fastresume file: %s", e)
 
     def add(self, torrent_info=None, state=None, options=None, save_state=True,
-            filedump=None, filename=None, magnet=None, resume_data=None, owner=None):
-        """Add a torrent to the manager and returns it's torrent_id"""
+            filedump=None, filename=None, magnet=None, resume_data=None, owner=None,
+            emit_event=True):
+        """
+        Add a torrent to the manager and returns it's torrent_id.
+
+        When adding from `state`, `torrent_info` may be given to avoid reading
+        the .torrent file from the state directory.  If `emit_event` is False
+        no TorrentAddedEvent is emitted.
+        """
         if owner is None:
             owner = component.get("RPCServer").get_session_user()
             if not owner:
@@ -349,9 +403,8 @@ def add(self, torrent_info=None, state=None, options=None, save_state=True,
                 # XXX: Probably should raise an exception here..
                 return
 
-        if torrent_info is None and state:
-            # We have no torrent_info so we need to add the torrent with information
-            # from the state object.
+        if state:
+            # We need to add the torrent with information from the state object.
 
             # Populate the options dict from state
             options = TorrentOptions()
@@ -373,9 +426,11 @@ def add(self, torrent_info=None, state=None, options=None, save_state=True,
             options["add_paused"] = state.paused
             options["shared"] = state.shared
 
-            ti = self.get_torrent_info_from_file(
-                    os.path.join(get_config_dir(),
-                                    "state", state.torrent_id + ".torrent"))
+            ti = torrent_info
+            if ti is None:
+                ti = self.get_torrent_info_from_file(
+                        os.path.join(get_config_dir(),
+                                        "state", state.torrent_id + ".torrent"))
             if ti:
                 add_torrent_params["ti"] = ti
             elif state.magnet:
@@ -538,9 +593,10 @@ def add(self, torrent_info=None, state=None, options=None, save_state=True,
 
         # Emit torrent_added signal
         from_state = state is not None
-        component.get("EventManager").emit(
-            TorrentAddedEvent(torrent.torrent_id, from_state)
-        )
+        if emit_event:
+            component.get("EventManager").emit(
+                TorrentAddedEvent(torrent.torrent_id, from_state)
+            )
 
         if log.isEnabledFor(logging.INFO):
             name_and_owner = torrent.get_status(["name", "owner"])
@@ -600,7 +656,7 @@ def remove(self, torrent_id, remove_data=False):
             return False
 
         # Remove fastresume data if it is exists
-        self.resume_data.pop(torrent_id, None)
+        self.resume_data.remove(torrent_id)
 
         # Remove the .torrent file in the state
         self.torrents[torrent_id].delete_torrentfile()
@@ -620,8 +676,8 @@ def remove(self, torrent_id, remove_data=False):
             except Exception, e:
                 log.warning("Unable to remove copy torrent file: %s", e)
 
-        # Stop the looping call
-        self.torrents[torrent_id].prev_status_cleanup_loop.stop()
+        # Forget the status sent to the sessions
+        self.status_diff.remove_torrent(torrent_id)
 
         # Remove from set if it wasn't finished
         if not self.torrents[torrent_id].is_finished:
@@ -658,6 +714,10 @@ def load_state(self):
         except (EOFError, IOError, Exception, cPickle.UnpicklingError), e:
             log.warning("Unable to load state file: %s", e)
 
+        # Apply the changes saved after the state file was written
+        state.torrents = self.state_journal.replay(
+            state.torrents, getattr(state, "journal_generation", 0))
+
         # Try to use an old state
         try:
             if len(state.torrents) > 0:
@@ -678,33 +738,112 @@ def load_state(self):
         # This speeds up startup loading the torrents by quite a lot for some reason (~40%)
         self.alerts.wait_on_handler = True
 
-        for torrent_state in state.torrents:
-            try:
-                self.add(state=torrent_state, save_state=False,
-                         resume_data=resume_data.get(torrent_state.torrent_id))
-            except AttributeError, e:
-                log.error("Torrent state file is either corrupt or incompatible! %s", e)
-                import traceback
-                traceback.print_exc()
-                break
+        self.pending_states = state.torrents
+        self.load_progress = {"loaded": 0, "total": len(state.torrents), "finished": False}
+        log.info("Loading %s torrents from the state..", len(state.torrents))
+
+        def on_load_finished(result):
+            self.load_state_task = None
+            self.alerts.wait_on_handler = False
+            # libtorrent holds the resume data now, so drop the shards read from disk
+            resume_data.clear_cache()
+            self.load_progress["finished"] = True
+            log.info("Finished loading %s torrents from the state.",
+                     self.load_progress["loaded"])
+
+            if lt.version_minor < 16:
+                log.debug("libtorrent version is lower than 0.16. Start looping "
+                          "callback to calculate last_seen_complete info.")
+                def calculate_last_seen_complete():
+                    for torrent in self.torrents.values():
+                        torrent.calculate_last_seen_complete()
+                self.last_seen_complete_loop = LoopingCall(
+                    calculate_last_seen_complete
+                )
+                self.last_seen_complete_loop.start(60)
+
+            component.get("EventManager").emit(SessionStartedEvent())
+
+        def on_load_stopped(failure):
+            log.warning("Stopped loading torrents from the state: %s", failure.getErrorMessage())
+            self.alerts.wait_on_handler = False
+
+        # Add the torrents in batches so that the daemon keeps serving
+        # RPC requests while loading
+        self.load_state_task = cooperate(self._load_state_batches(resume_data))
+        d = self.load_state_task.whenDone()
+        d.addCallbacks(on_load_finished, on_load_stopped)
+        return d
 
-        self.alerts.wait_on_handler = False
+    def _load_state_batches(self, resume_data):
+        """
+        Generator used by load_state to add the torrents in `pending_states`.
 
-        if lt.version_minor < 16:
-            log.debug("libtorrent version is lower than 0.16. Start looping "
-                      "callback to calculate last_seen_complete info.")
-            def calculate_last_seen_complete():
-                for torrent in self.torrents.values():
-                    torrent.calculate_last_seen_complete()
-            self.last_seen_complete_loop = LoopingCall(
-                calculate_last_seen_complete
-            )
+        The .torrent files of each batch are parsed in threads, then the batch
+        is added to the session and a single TorrentsAddedEvent is emitted.
+        """
+        def read_torrent_info(torrent_id):
+            return self.get_torrent_info_from_file(
+                os.path.join(get_config_dir(), "state", torrent_id + ".torrent"))
+
+        while self.pending_states:
+            batch = self.pending_states[:LOAD_STATE_BATCH_SIZE]
+            torrent_infos = []
+            d = DeferredList([deferToThread(read_torrent_info, s.torrent_id) for s in batch],
+                             consumeErrors=True)
+
+            def on_torrent_infos(result):
+                for torrent_state, (success, torrent_info) in zip(batch, result):
+                    if not success:
+                        log.warning("Unable to read the torrent file of %s: %s",
+                                    torrent_state.torrent_id, torrent_info.getErrorMessage())
+                        torrent_info = None
+                    torrent_infos.append(torrent_info)
+            d.addCallback(on_torrent_infos)
+            yield d
+
+            added = []
+            for torrent_state, torrent_info in zip(batch, torrent_infos):
+                try:
+                    torrent_id = self.add(state=torrent_state, torrent_info=torrent_info,
+                                          save_state=False, emit_event=False,
+                                          resume_data=resume_data.get(torrent_state.torrent_id))
+                except AttributeError, e:
+                    log.error("Torrent state file is either corrupt or incompatible! %s", e)
+                    import traceback
+                    traceback.print_exc()
+                    self.pending_states = []
+                    break
+                if torrent_id:
+                    added.append(torrent_id)
+            else:
+                self.pending_states = self.pending_states[len(batch):]
 
-        component.get("EventManager").emit(SessionStartedEvent())
+            self.load_progress["loaded"] += len(added)
+            if added:
+                component.get("EventManager").emit(TorrentsAddedEvent(added, True))
+            yield None
 
-    def save_state(self):
-        """Save the state of the TorrentManager to the torrents.state file"""
-        state = TorrentManagerState()
+    def get_load_progress(self):
+        """
+        Returns the progress of loading the torrents from the state.
+
+        :returns: {"loaded": int, "total": int, "finished": bool}
+        :rtype: dict
+
+        """
+        return dict(self.load_progress)
+
+    def save_state(self, compact=False):
+        """
+        Save the state of the TorrentManager to the torrents.state file.
+
+        Only the torrents whose state changed since the last save are written
+        to the state journal, unless `compact` is True in which case the whole
+        torrents.state file is rewritten.
+
+        """
+        torrent_states = []
         # Create the state for each Torrent and append to the list
         for torrent in self.torrents.values():
             paused = False
@@ -740,29 +879,16 @@ def save_state(self):
                 torrent.owner,
                 torrent.options["shared"]
             )
-            state.torrents.append(torrent_state)
+            torrent_states.append(torrent_state)
 
-        # Pickle the TorrentManagerState object
-        try:
-            log.debug("Saving torrent state file.")
-            state_file = open(os.path.join(get_config_dir(),
-                              "state", "torrents.state.new"), "wb")
-            cPickle.dump(state, state_file)
-            state_file.flush()
-            os.fsync(state_file.fileno())
-            state_file.close()
-        except IOError, e:
-            log.warning("Unable to save state file: %s", e)
-            return True
+        # Keep the torrents that load_state has not added yet
+        torrent_states.extend(s for s in self.pending_states
+                              if s.torrent_id not in self.torrents)
 
-        # We have to move the 'torrents.state.new' file to 'torrents.state'
-        try:
-            shutil.move(
-                os.path.join(get_config_dir(), "state", "torrents.state.new"),
-                os.path.join(get_config_dir(), "state", "torrents.state"))
-        except IOError:
-            log.warning("Unable to save state file.")
-            return True
+        if compact:
+            self.state_journal.compact(torrent_states)
+        else:
+            self.state_journal.save(torrent_states)
 
         # We return True so that the timer thread will continue
         return True
@@ -799,38 +925,45 @@ def on_all_resume_data_finished(result):
         return DeferredList(deferreds).addBoth(on_all_resume_data_finished)
 
     def load_resume_data_file(self):
+        """
+        Returns the resume data store.  The resume data of each torrent is read
+        from its shard when it is first asked for.
+
+        If there is an old torrents.fastresume file and no shards yet, its
+        contents are moved into the shards.  The old file is kept as
+        torrents.fastresume.bak for downgrading.
+        """
+        legacy_path = os.path.join(get_config_dir(), "state", "torrents.fastresume")
+        if self.resume_data.exists() or not os.path.isfile(legacy_path):
+            return self.resume_data
+
         resume_data = {}
         try:
             log.debug("Opening torrents fastresume file for load.")
-            fastresume_file = open(os.path.join(get_config_dir(), "state",
-                                                "torrents.fastresume"), "rb")
+            fastresume_file = open(legacy_path, "rb")
             resume_data = lt.bdecode(fastresume_file.read())
             fastresume_file.close()
         except (EOFError, IOError, Exception), e:
             log.warning("Unable to load fastresume file: %s", e)
 
         # If the libtorrent bdecode doesn't happen properly, it will return None
-        # so we need to make sure we return a {}
-        if resume_data is None:
-            return {}
+        if resume_data:
+            log.info("Moving %s torrents.fastresume entries to shards.", len(resume_data))
+            self.resume_data.update(resume_data)
+            if self.resume_data.save():
+                try:
+                    shutil.move(legacy_path, legacy_path + ".bak")
+                except (IOError, OSError), e:
+                    log.warning("Unable to rename old fastresume file: %s", e)
 
-        return resume_data
+        return self.resume_data
 
     def save_resume_data_file(self):
         """
-        Saves the resume data file with the contents of self.resume_data.
+        Saves the resume data shards that changed since the last save.
         """
-        path = os.path.join(get_config_dir(), "state", "torrents.fastresume")
-
-        try:
-            log.debug("Saving fastresume file: %s", path)
-            fastresume_file = open(path, "wb")
-            fastresume_file.write(lt.bencode(self.resume_data))
-            fastresume_file.flush()
-            os.fsync(fastresume_file.fileno())
-            fastresume_file.close()
-        except IOError:
-            log.warning("Error trying to save fastresume file")
+        log.debug("Saving fastresume shards.")
+        self.resume_data.save()
 
     def get_queue_position(self, torrent_id):
         """Get queue position of torrent"""
@@ -969,33 +1102,37 @@ def on_alert_torrent_checked(self, alert):
         # Set the torrent state
         torrent.update_state()
 
-    def on_alert_tracker_reply(self, alert):
-        if log.isEnabledFor(logging.DEBUG):
-            log.debug("on_alert_tracker_reply: %s", decode_string(alert.message()))
-        try:
-            torrent = self.torrents[str(alert.handle.info_hash())]
-        except:
-            return
+    def on_alert_tracker_reply(self, alerts):
+        # Handles the replies of an announce storm at once, only the last
+        # reply of each torrent matters
+        handles = {}
+        for alert in alerts:
+            if log.isEnabledFor(logging.DEBUG):
+                log.debug("on_alert_tracker_reply: %s", decode_string(alert.message()))
+            handles[str(alert.handle.info_hash())] = alert.handle
 
-        # Set the tracker status for the torrent
-        torrent.set_tracker_status(_("Announce OK"))
+        for torrent_id, handle in handles.iteritems():
+            torrent = self.torrents.get(torrent_id)
+            if torrent is None:
+                continue
 
-        # Check to see if we got any peer information from the tracker
-        if alert.handle.status().num_complete == -1 or \
-            alert.handle.status().num_incomplete == -1:
-            # We didn't get peer information, so lets send a scrape request
-            torrent.scrape_tracker()
+            # Set the tracker status for the torrent
+            torrent.set_tracker_status(_("Announce OK"))
 
-    def on_alert_tracker_announce(self, alert):
-        if log.isEnabledFor(logging.DEBUG):
-            log.debug("on_alert_tracker_announce")
-        try:
-            torrent = self.torrents[str(alert.handle.info_hash())]
-        except:
-            return
+            # Check to see if we got any peer information from the tracker
+            status = handle.status()
+            if status.num_complete == -1 or status.num_incomplete == -1:
+                # We didn't get peer information, so lets send a scrape request
+                torrent.scrape_tracker()
 
-        # Set the tracker status for the torrent
-        torrent.set_tracker_status(_("Announce Sent"))
+    def on_alert_tracker_announce(self, alerts):
+        if log.isEnabledFor(logging.DEBUG):
+            log.debug("on_alert_tracker_announce: %d alerts", len(alerts))
+        for torrent_id in set(str(alert.handle.info_hash()) for alert in alerts):
+            torrent = self.torrents.get(torrent_id)
+            if torrent is not None:
+                # Set the tracker status for the torrent
+                torrent.set_tracker_status(_("Announce Sent"))
 
     def on_alert_tracker_warning(self, alert):
         log.debug("on_alert_tracker_warning")
@@ -1087,6 +1224,7 @@ def on_alert_file_renamed(self, alert):
             torrent_id = str(alert.handle.info_hash())
         except:
             return
+        torrent.bump_version()
 
         # We need to see if this file index is in a waiting_on_folder dict
         for wait_on_folder in torrent.waiting_on_folder_rename:
@@ -1123,18 +1261,67 @@ def on_alert_file_completed(self, alert):
         component.get("EventManager").emit(
             TorrentFileCompletedEvent(torrent_id, alert.index))
 
+    def on_client_disconnected(self, session_id):
+        self.status_diff.remove_session(session_id)
+        self.unsubscribe_status(session_id)
+
+    def get_sorted_torrent_ids(self, sort_key, torrent_ids=None, reverse=False, offset=0, limit=None):
+        """
+        Returns a window of the torrent ids sorted on a status key.  An index
+        is kept for each sort key, only the torrents whose status changed
+        since the last call are moved within it.
+
+        :param sort_key: the status key to sort on, can be a plugin key
+        :type sort_key: str
+        :param torrent_ids: only include these torrents, None for all of them
+        :type torrent_ids: list of str
+        :param reverse: if True, sort in descending order
+        :type reverse: bool
+        :param offset: the number of torrents to skip
+        :type offset: int
+        :param limit: the maximum number of torrents to return, None for all
+        :type limit: int
+
+        :returns: the torrent ids in the window
+        :rtype: list of str
+
+        :raises DelugeError: if sort_key is not a status key
+
+        """
+        if sort_key in STATUS_FIELDS:
+            get_value = lambda torrent_id: self.torrents[torrent_id].get_status([sort_key])[sort_key]
+        elif sort_key in self.plugins.status_fields:
+            get_value = lambda torrent_id: self.plugins.get_status(torrent_id, [sort_key]).get(sort_key)
+        else:
+            raise DelugeError("Unknown status key: %s" % sort_key)
+
+        index = self.sort_indexes.get(sort_key)
+        if index is None:
+            if len(self.sort_indexes) >= MAX_SORT_INDEXES:
+                self.sort_indexes.clear()
+            index = self.sort_indexes[sort_key] = SortIndex(sort_key)
+        index.update(self.torrents, Torrent.last_version, get_value)
+
+        if torrent_ids is not None:
+            torrent_ids = set(torrent_ids)
+        return index.get_page(torrent_ids, reverse, offset, limit)
+
     def separate_keys(self, keys, torrent_ids):
         """Separates the input keys into keys for the Torrent class
         and keys for plugins.
         """
-        if self.torrents:
-            for torrent_id in torrent_ids:
-                if torrent_id in self.torrents:
-                    status_keys = self.torrents[torrent_id].status_funcs.keys()
-                    leftover_keys = list(set(keys) - set(status_keys))
-                    torrent_keys = list(set(keys) - set(leftover_keys))
-                    return torrent_keys, leftover_keys
-        return [], []
+        if not self.torrents:
+            return [], []
+
+        keys = tuple(keys)
+        if keys not in self.separated_keys:
+            if len(self.separated_keys) >= MAX_STATUS_EXTRACTORS:
+                self.separated_keys.clear()
+            self.separated_keys[keys] = (
+                tuple(key for key in keys if key in STATUS_FIELDS),
+                tuple(key for key in keys if key not in STATUS_FIELDS))
+        torrent_keys, plugin_keys = self.separated_keys[keys]
+        return list(torrent_keys), list(plugin_keys)
 
     def on_alert_state_update(self, alert):
         log.debug("on_status_notification: %s", alert.message())
@@ -1145,7 +1332,10 @@ def on_alert_state_update(self, alert):
             if torrent_id in self.torrents:
                 self.torrents[torrent_id].update_status(s)
 
-        self.handle_torrents_status_callback(self.torrents_status_requests.pop())
+        if self.torrents_status_requests:
+            self.handle_torrents_status_callback(self.torrents_status_requests.pop())
+
+        self.push_status_subscriptions()
 
     def handle_torrents_status_callback(self, status_request):
         """
@@ -1166,6 +1356,98 @@ def handle_torrents_status_callback(self, status_request):
         self.status_dict = status_dict
         d.callback((status_dict, plugin_keys))
 
+    def subscribe_status(self, session_id, filter_dict, keys):
+        """
+        Subscribes a session to the status of the torrents matching the
+        filter.  From now on the changed values are sent to the session in a
+        TorrentsStatusChangedEvent whenever fresh status is received.
+
+        :param session_id: the session subscribing
+        :type session_id: int
+        :param filter_dict: the filter selecting the torrents
+        :type filter_dict: dict
+        :param keys: the status keys to subscribe to
+        :type keys: list of str
+
+        :returns: the current values of the subscribed keys, in the layout
+            described in :mod:`deluge.core.statussubscription`
+        :rtype: dict
+
+        """
+        subscription = StatusSubscription(filter_dict, keys)
+        self.status_subscriptions[session_id] = subscription
+        if not self.status_subscription_timer.running:
+            self.status_subscription_timer.start(STATUS_SUBSCRIPTION_INTERVAL, False)
+
+        changes = subscription.update(*self.get_subscription_status(subscription))
+        return changes or {"added": {}, "removed": [], "columns": {}}
+
+    def unsubscribe_status(self, session_id):
+        """
+        Removes the status subscription of a session.
+
+        :param session_id: the session
+        :type session_id: int
+
+        """
+        if session_id in self.status_subscriptions:
+            del self.status_subscriptions[session_id]
+        if not self.status_subscriptions and self.status_subscription_timer.running:
+            self.status_subscription_timer.stop()
+
+    def get_subscription_status(self, subscription):
+        """
+        Returns the arguments of StatusSubscription.update: the status of the
+        torrents matching the subscription's filter that are new to it or
+        whose status version changed since its last update, the ids of all
+        the matching torrents and the current status version.
+
+        Plugin status keys are only sent again when the plugin gives the
+        torrent a new version, see :meth:`FilterManager.update_torrent`.
+        """
+        # Taken first, a change while building the status gives a higher version
+        last_version = Torrent.last_version
+        # filter_torrent_ids changes the filter_dict it is passed
+        torrent_ids = [torrent_id for torrent_id in component.get("FilterManager").filter_torrent_ids(
+            dict(subscription.filter_dict)) if torrent_id in self.torrents]
+        torrent_keys, plugin_keys = self.separate_keys(subscription.keys, torrent_ids)
+
+        status_dict = {}
+        for torrent_id in torrent_ids:
+            if self.torrents[torrent_id].version <= subscription.version and \
+                    torrent_id in subscription.indexes:
+                continue
+            status = {}
+            if torrent_keys:
+                status = self.torrents[torrent_id].get_status(torrent_keys)
+            if plugin_keys:
+                status.update(self.plugins.get_status(torrent_id, plugin_keys))
+            status_dict[torrent_id] = status
+        return status_dict, torrent_ids, last_version
+
+    def push_status_subscriptions(self):
+        """
+        Sends the values that changed to the subscribed sessions.
+        """
+        rpcserver = component.get("RPCServer")
+        for session_id, subscription in self.status_subscriptions.items():
+            if rpcserver.listen and not rpcserver.is_session_valid(session_id):
+                # The session has disconnected
+                self.unsubscribe_status(session_id)
+                continue
+
+            changes = subscription.update(*self.get_subscription_status(subscription))
+            if not changes:
+                continue
+
+            event = TorrentsStatusChangedEvent(changes)
+            if rpcserver.listen:
+                rpcserver.emit_event_for_session_id(session_id, event)
+            else:
+                # In classic mode the client's event handlers are registered
+                # with the EventManager
+                component.get("EventManager").emit(event)
+
     def torrents_status_update(self, torrent_ids, keys, diff=False):
         """
         returns status dict for the supplied torrent_ids async
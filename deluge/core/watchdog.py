@@ -0,0 +1,188 @@
+#
+# watchdog.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+The Watchdog reports the callbacks that block the reactor.
+
+The reactor calls :meth:`Watchdog.update` every :data:`WATCHDOG_INTERVAL`
+seconds.  A helper thread checks that it does, and when the reactor has not
+run it for longer than the threshold, it samples the stack of the reactor
+thread until the reactor runs again.  The report of the stall then holds the
+stacks sampled, and the Component update, alert handler or RPC method that
+was running.
+"""
+
+import sys
+import time
+import thread
+import threading
+import logging
+import traceback
+from collections import deque
+
+import deluge.component as component
+from deluge.core.rpcserver import DelugeRPCProtocol
+
+log = logging.getLogger(__name__)
+
+# The interval of the reactor heartbeat and of the samples taken in a stall
+WATCHDOG_INTERVAL = 0.1
+# The number of seconds the reactor can be blocked before it is reported
+WATCHDOG_THRESHOLD = 1.0
+# The number of stall reports kept
+WATCHDOG_REPORTS = 20
+# The number of distinct stacks kept in a report
+WATCHDOG_STACKS = 5
+
+class Watchdog(component.Component):
+    def __init__(self, threshold=WATCHDOG_THRESHOLD, interval=WATCHDOG_INTERVAL):
+        component.Component.__init__(self, "Watchdog", interval=interval)
+        self.threshold = threshold
+        self.interval = interval
+        self.reports = deque(maxlen=WATCHDOG_REPORTS)
+        self.last_update = None
+        # The report of the ongoing stall
+        self.stall = None
+        self.lock = threading.Lock()
+        self.stopped = threading.Event()
+        self.thread = None
+        self.reactor_thread = None
+
+    def start(self):
+        self.reactor_thread = thread.get_ident()
+        self.last_update = time.time()
+        self.stopped.clear()
+        self.thread = threading.Thread(target=self.watch, name="Watchdog")
+        self.thread.setDaemon(True)
+        self.thread.start()
+        log.info("Reporting reactor stalls of more than %.1fs", self.threshold)
+
+    def stop(self):
+        self.stopped.set()
+        self.thread.join()
+        self.thread = None
+
+    def update(self):
+        now = time.time()
+        self.lock.acquire()
+        try:
+            self.last_update = now
+            stall, self.stall = self.stall, None
+        finally:
+            self.lock.release()
+
+        if stall:
+            stall["duration"] = now - stall["time"]
+            stall["stacks"] = sorted(stall["stacks"].items(), key=lambda item: item[1],
+                                     reverse=True)[:WATCHDOG_STACKS]
+            self.reports.append(stall)
+            log.warning("The reactor was blocked for %.2fs in %s", stall["duration"],
+                        ", ".join(stall["activity"]) or "an unknown callback")
+            log.debug("Stack of the reactor thread:\n%s", stall["stacks"][0][0])
+
+    def watch(self):
+        """
+        Samples the stack of the reactor thread while it is blocked, runs in
+        the watchdog thread.
+        """
+        while True:
+            # wait only returns whether the event is set from Python 2.7
+            self.stopped.wait(self.interval)
+            if self.stopped.isSet():
+                break
+            self.lock.acquire()
+            try:
+                if time.time() - self.last_update < self.interval + self.threshold:
+                    continue
+                frame = sys._current_frames().get(self.reactor_thread)
+                if frame is None:
+                    continue
+                if self.stall is None:
+                    self.stall = {
+                        "time": self.last_update,
+                        "activity": get_activity(frame),
+                        "stacks": {}
+                    }
+                stack = "".join(traceback.format_stack(frame))
+                self.stall["stacks"][stack] = self.stall["stacks"].get(stack, 0) + 1
+            finally:
+                self.lock.release()
+            del frame
+
+    def get_reports(self):
+        """
+        Returns the reports of the last stalls of the reactor.
+
+        :returns: a list of dicts, with the "time" the stall started, its
+            "duration", the "activity" running and the "stacks" sampled as a
+            list of (stack, count), the most frequent first
+        :rtype: list
+
+        """
+        return list(self.reports)
+
+def get_activity(frame):
+    """
+    Returns what the reactor thread is running in the frame: the Component
+    updates, alert handlers and RPC methods, the innermost first.
+
+    :param frame: the current frame of the reactor thread
+    :type frame: frame
+
+    :returns: descriptions like "Component.update TorrentManager"
+    :rtype: list
+
+    """
+    handlers = {}
+    if "AlertManager" in component._ComponentRegistry.components:
+        for alert_type, alert_handlers in component.get("AlertManager").handlers.items():
+            for handler in list(alert_handlers):
+                code = getattr(getattr(handler, "im_func", handler), "func_code", None)
+                handlers[code] = "%s (%s)" % (getattr(handler, "__name__", handler), alert_type)
+
+    activity = []
+    while frame is not None:
+        code = frame.f_code
+        if code in handlers:
+            activity.append("alert handler %s" % handlers[code])
+        elif code.co_name in ("update", "dispatch"):
+            obj = frame.f_locals.get("self")
+            if code.co_name == "update" and isinstance(obj, component.Component):
+                activity.append("Component.update %s" % obj._component_name)
+            elif code.co_name == "dispatch" and isinstance(obj, DelugeRPCProtocol):
+                activity.append("RPC %s" % frame.f_locals.get("method"))
+        frame = frame.f_back
+    return activity
@@ -60,6 +60,10 @@ class DelugeEvent(object):
     :type name: string
     :prop args: a list of the attribute values
     :type args: list
+    :prop collapse_key: events with the same key supersede each other when
+        they are sent to the clients in a batch, None if the event must never
+        be dropped
+    :type collapse_key: tuple
 
     """
     __metaclass__ = DelugeEventMetaClass
@@ -72,8 +76,13 @@ def _get_args(self):
             return []
         return self._args
 
+    def _get_collapse_key(self):
+        # By default only identical events are collapsed
+        return (self.name, repr(self.args))
+
     name = property(fget=_get_name)
     args = property(fget=_get_args)
+    collapse_key = property(fget=_get_collapse_key)
 
 class TorrentAddedEvent(DelugeEvent):
     """
@@ -88,6 +97,20 @@ def __init__(self, torrent_id, from_state):
         """
         self._args = [torrent_id, from_state]
 
+class TorrentsAddedEvent(DelugeEvent):
+    """
+    Emitted when a batch of torrents has been added to the session, this is
+    used instead of a TorrentAddedEvent per torrent when loading the state.
+    """
+    def __init__(self, torrent_ids, from_state):
+        """
+        :param torrent_ids: the torrent_ids of the torrents that were added
+        :type torrent_ids: list of strings
+        :param from_state: were the torrents loaded from state? Or are they new torrents.
+        :type from_state: bool
+        """
+        self._args = [torrent_ids, from_state]
+
 class TorrentRemovedEvent(DelugeEvent):
     """
     Emitted when a torrent has been removed from the session.
@@ -123,6 +146,31 @@ def __init__(self, torrent_id, state):
         """
         self._args = [torrent_id, state]
 
+    def _get_collapse_key(self):
+        # Only the latest state of a torrent is of interest
+        return (self.name, self._args[0])
+
+    collapse_key = property(fget=_get_collapse_key)
+
+class TorrentsStatusChangedEvent(DelugeEvent):
+    """
+    Emitted to a session subscribed to the status of torrents when the
+    subscribed values change.
+    """
+    def __init__(self, changes):
+        """
+        :param changes: the changes in the layout described in
+            :mod:`deluge.core.statussubscription`
+        :type changes: dict
+        """
+        self._args = [changes]
+
+    def _get_collapse_key(self):
+        # Every event holds different changes, so they are never collapsed
+        return None
+
+    collapse_key = property(fget=_get_collapse_key)
+
 class TorrentQueueChangedEvent(DelugeEvent):
     """
     Emitted when the queue order has changed.
@@ -246,6 +294,17 @@ def __init__(self, key, value):
         """
         self._args = [key, value]
 
+class ClientDisconnectedEvent(DelugeEvent):
+    """
+    Emitted when a client disconnects from the daemon.
+    """
+    def __init__(self, session_id):
+        """
+        :param session_id: the session id of the client
+        :type session_id: int
+        """
+        self._args = [session_id]
+
 class PluginEnabledEvent(DelugeEvent):
     """
     Emitted when a plugin is enabled in the Core.
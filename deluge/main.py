@@ -181,6 +181,11 @@ def start_daemon():
         help="Rotate logfiles.", action="store_true", default=False)
     parser.add_option("--profile", dest="profile", action="store_true", default=False,
         help="Profiles the daemon")
+    parser.add_option("--watchdog", dest="watchdog", action="store_true", default=False,
+        help="Reports the callbacks blocking the daemon, see daemon.get_stall_reports")
+    parser.add_option("--watchdog-threshold", dest="watchdog_threshold", action="store",
+        type="float", metavar="SECONDS",
+        help="Reports the stalls longer than SECONDS, implies --watchdog (default: 1.0)")
 
     # Get the options and args from the OptionParser
     (options, args) = parser.parse_args()
@@ -116,7 +116,7 @@ def enable(self):
         component.get("EventManager").register_event_handler("TorrentRemovedEvent", self.post_torrent_remove)
 
         #register tree:
-        component.get("FilterManager").register_tree_field("label", self.init_filter_dict)
+        component.get("FilterManager").register_tree_field("label", self.init_filter_dict, tracked=True)
 
         log.debug("Label plugin enabled..")
 
@@ -205,6 +205,7 @@ def remove(self, label_id):
         del self.labels[label_id]
         self.clean_config()
         self.config.save()
+        component.get("FilterManager").update_tree_field("label")
 
     def _set_torrent_options(self, torrent_id, label_id):
         options = self.labels[label_id]
@@ -328,6 +329,7 @@ def set_torrent(self, torrent_id , label_id):
             self._set_torrent_options(torrent_id, label_id)
 
         self.config.save()
+        component.get("FilterManager").update_torrent(torrent_id)
 
     @export
     def get_config(self):
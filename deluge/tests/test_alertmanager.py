@@ -36,3 +36,70 @@ def handler(alert):
         self.am.register_handler("dummy_alert", handler)
         self.am.deregister_handler(handler)
         self.assertEquals(self.am.handlers["dummy_alert"], [])
+
+    def test_dispatch_alerts(self):
+        class dummy_alert(object):
+            pass
+        alerts = [dummy_alert(), dummy_alert()]
+        handled = []
+        batches = []
+
+        def handler(alert):
+            handled.append(alert)
+
+        def batch_handler(alerts):
+            batches.append(alerts)
+
+        def failing_handler(alert):
+            raise Exception("handler failed")
+
+        self.am.register_handler("dummy_alert", failing_handler)
+        self.am.register_handler("dummy_alert", handler)
+        self.am.register_handler("dummy_alert", batch_handler, batch=True)
+        self.am.queue_alerts(alerts)
+        self.am.dispatch_alerts()
+        self.assertEquals(handled, alerts)
+        self.assertEquals(batches, [alerts])
+        self.assertFalse(self.am.pending_alerts)
+
+        self.am.deregister_handler(batch_handler)
+        self.assertFalse(self.am.batch_handlers)
+
+    def test_dispatch_alerts_order(self):
+        class reply_alert(object):
+            pass
+        class announce_alert(object):
+            pass
+        alerts = [reply_alert(), announce_alert(), reply_alert(), reply_alert()]
+        handled = []
+        batches = []
+
+        def handler(alert):
+            handled.append(alert)
+
+        self.am.register_handler("reply_alert", lambda alerts: batches.append(alerts), batch=True)
+        self.am.register_handler("reply_alert", handler)
+        self.am.register_handler("announce_alert", handler)
+        self.am.queue_alerts(alerts)
+
+        # The alerts are dispatched in the order they arrived, one per pass
+        # with no time budget left
+        self.am.dispatch_alerts(budget=-1)
+        self.assertEquals(handled, [])
+        self.assertEquals(batches, [alerts[:1]])
+        self.am.dispatch_call.cancel()
+        self.am.dispatch_alerts()
+        self.assertEquals(handled, alerts)
+        self.assertEquals(batches, [alerts[:1], alerts[2:]])
+
+    def test_wakeup_mode(self):
+        self.am.set_wakeup_mode("wait")
+        self.assertTrue(self.am.alert_thread)
+        self.assertFalse(self.am._component_timer.running)
+
+        self.am.set_wakeup_mode("poll")
+        self.assertEquals(self.am.alert_thread, None)
+        self.assertTrue(self.am._component_timer.running)
+
+        self.am.set_wakeup_mode("unknown")
+        self.assertEquals(self.am.wakeup_mode, "poll")
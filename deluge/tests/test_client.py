@@ -1,12 +1,15 @@
 
 import common
 
-from twisted.internet import defer
+from twisted.internet import defer, reactor
 from twisted.trial import unittest
 
+import deluge.component as component
 from deluge import error
 from deluge.core.authmanager import AUTH_LEVEL_ADMIN
-from deluge.ui.client import client, Client, DaemonSSLProxy
+from deluge.core.rpcserver import RPCServer, export
+from deluge.core.rpcserver import DelugeRPCProtocol as ServerProtocol
+from deluge.ui.client import client, Client, DaemonSSLProxy, DelugeRPCProtocol
 
 
 class NoVersionSendingDaemonSSLProxy(DaemonSSLProxy):
@@ -150,3 +153,149 @@ def on_failure(failure):
 
         d.addErrback(on_failure)
         return d
+
+class FakeFactory(object):
+    def __init__(self, daemon):
+        self.daemon = daemon
+        self.event_handlers = {}
+
+class FakeAddress(object):
+    host = "127.0.0.1"
+    port = 58846
+
+class FakeTransport(object):
+    def getPeer(self):
+        return FakeAddress()
+
+class RequestBatchingTestCase(unittest.TestCase):
+    def setUp(self):
+        self.daemon = DaemonSSLProxy()
+        self.daemon.connect_deferred = defer.Deferred()
+        self.protocol = DelugeRPCProtocol()
+        self.protocol.factory = FakeFactory(self.daemon)
+        self.protocol.transport = FakeTransport()
+        self.protocol.connectionMade()
+        self.messages = []
+        self.protocol.transfer_message = self.messages.append
+
+    def test_calls_sent_together(self):
+        self.daemon.call("core.get_session_state")
+        self.daemon.call("core.get_free_space", "/tmp")
+        self.assertEquals(self.messages, [])
+
+        d = defer.Deferred()
+        def check():
+            self.assertEquals(self.messages, [(
+                (0, "core.get_session_state", (), {}),
+                (1, "core.get_free_space", ("/tmp",), {}))])
+            d.callback(None)
+        reactor.callLater(0, check)
+        return d
+
+    def test_force_call(self):
+        self.daemon.call("core.get_session_state")
+        self.daemon.force_call()
+        self.assertEquals(len(self.messages), 1)
+        self.daemon.call("core.get_free_space")
+        self.daemon.force_call()
+        self.assertEquals(len(self.messages), 2)
+        self.assertEquals(self.messages[1], ((1, "core.get_free_space", (), {}),))
+
+    def test_stream(self):
+        parts = []
+        d1 = self.daemon.call("core.get_torrents_status_stream", {}, [])
+        d2 = self.daemon.stream("core.get_torrents_status_stream", parts.append, {}, [])
+        self.daemon.force_call()
+        self.protocol.message_received((5, 0, (1, 2)))
+        self.protocol.message_received((5, 1, (1, 2)))
+        self.protocol.message_received((1, 0, (3,)))
+        self.protocol.message_received((1, 1, ()))
+        d1.addCallback(self.assertEquals, [1, 2, 3])
+        d2.addCallback(lambda result: self.assertEquals(parts, [(1, 2)]))
+        return defer.DeferredList([d1, d2], fireOnOneErrback=True)
+
+class OldAuthManager(component.Component):
+    def __init__(self):
+        component.Component.__init__(self, "AuthManager")
+
+    def authorize(self, username, password):
+        return AUTH_LEVEL_ADMIN
+
+class OldDaemon(object):
+    def __init__(self, rpcserver):
+        self.rpcserver = rpcserver
+
+    @export()
+    def get_method_list(self):
+        return self.rpcserver.get_method_list()
+
+class NewDaemon(OldDaemon):
+    @export()
+    def set_compression(self, level=-1):
+        return self.rpcserver.set_compression(self.rpcserver.get_session_id(), level)
+
+    @export()
+    def set_streaming(self, enabled=True):
+        self.rpcserver.set_streaming(self.rpcserver.get_session_id(), enabled)
+
+class FakeServerTransport(FakeTransport):
+    sessionno = 1
+
+class LoginTestCase(unittest.TestCase):
+    """
+    Logs in with a DaemonSSLProxy talking directly to the protocol of an
+    RPCServer, whose AuthManager.authorize takes no keyword arguments.
+    """
+    def setUp(self):
+        self.rpcserver = RPCServer(listen=False)
+        OldAuthManager()
+        self.server = ServerProtocol()
+        self.server.factory = self.rpcserver.factory
+        self.server.transport = FakeServerTransport()
+        self.server.streams = {}
+        self.server.sendData = self.send_to_client
+
+        self.daemon = DaemonSSLProxy()
+        self.daemon.connect_deferred = defer.Deferred()
+        self.protocol = DelugeRPCProtocol()
+        self.protocol.factory = FakeFactory(self.daemon)
+        self.protocol.transport = FakeTransport()
+        self.protocol.connectionMade()
+        self.protocol.transfer_message = self.send_to_server
+        self.calls = []
+
+    def tearDown(self):
+        component._ComponentRegistry.components = {}
+
+    def send_to_server(self, request):
+        for call in request:
+            self.calls.append(call[1])
+            self.server.dispatch(*call)
+
+    def send_to_client(self, data):
+        self.protocol.message_received(data)
+        return 0, 0
+
+    def test_login_old_daemon(self):
+        self.rpcserver.register_object(OldDaemon(self.rpcserver), "daemon")
+
+        def on_login(result):
+            self.assertEquals(result, AUTH_LEVEL_ADMIN)
+            self.assertEquals(self.calls, ["daemon.login", "daemon.get_method_list"])
+            self.assertFalse(self.server.streaming)
+            self.assertEquals(self.server.compression, None)
+            self.assertEquals(self.protocol.compression, None)
+        return self.daemon.authenticate("user", "password").addCallback(on_login)
+
+    def test_login_new_daemon(self):
+        self.rpcserver.register_object(NewDaemon(self.rpcserver), "daemon")
+
+        def on_login(result):
+            self.assertEquals(result, AUTH_LEVEL_ADMIN)
+            self.assertEquals(self.calls, ["daemon.login", "daemon.get_method_list",
+                                           "daemon.set_compression", "daemon.set_streaming"])
+            self.assertTrue(self.server.streaming)
+            # Messages on the loopback interface are not compressed
+            self.assertEquals(self.server.compression[0], 0)
+            self.assertEquals(self.protocol.compression[0], 0)
+        return self.daemon.authenticate("user", "password").addCallback(on_login)
@@ -16,6 +16,7 @@
 import warnings
 rpath = common.rpath
 
+from deluge.common import AUTH_LEVEL_NORMAL
 from deluge.core.rpcserver import RPCServer
 from deluge.core.core import Core
 warnings.filterwarnings("ignore", category=RuntimeWarning)
@@ -160,6 +161,50 @@ def test_remove_torrent(self):
         self.assertTrue(ret)
         self.assertEquals(len(self.core.get_session_state()), 0)
 
+    def call_as_user(self, method, *args):
+        # The session is only the user's while the RPC is dispatched, another
+        # client's RPC may come before the Deferred fires
+        self.rpcserver.get_session_auth_level = lambda: AUTH_LEVEL_NORMAL
+        self.rpcserver.get_session_user = lambda: "someone"
+        try:
+            return method(*args)
+        finally:
+            del self.rpcserver.get_session_auth_level
+            del self.rpcserver.get_session_user
+
+    def test_get_torrents_page(self):
+        filename = os.path.join(os.path.dirname(__file__), "test.torrent")
+        import base64
+        torrent_id = self.core.add_torrent_file(filename, base64.encodestring(open(filename).read()), {})
+
+        def on_admin_page(result):
+            self.assertEquals(result[:2], (1, [torrent_id]))
+            self.assertEquals(result[2].keys(), [torrent_id])
+            # The torrents of other users are neither counted nor sent
+            return self.call_as_user(self.core.get_torrents_page, {}, ["name"], "name")
+
+        d = self.core.get_torrents_page({}, ["name"], "name")
+        d.addCallback(on_admin_page)
+        d.addCallback(self.assertEquals, (0, [], {}))
+        return d
+
+    def test_get_torrents_status_since(self):
+        filename = os.path.join(os.path.dirname(__file__), "test.torrent")
+        import base64
+        torrent_id = self.core.add_torrent_file(filename, base64.encodestring(open(filename).read()), {})
+
+        def on_admin_status(result):
+            self.assertEquals(result[1].keys(), [torrent_id])
+            return self.call_as_user(self.core.get_torrents_status_since, 0, ["name"])
+
+        def on_user_status(result):
+            self.assertEquals(result[1], {})
+
+        d = self.core.get_torrents_status_since(0, ["name"])
+        d.addCallback(on_admin_status)
+        d.addCallback(on_user_status)
+        return d
+
     def test_get_session_status(self):
         status = self.core.get_session_status(["upload_rate", "download_rate"])
         self.assertEquals(type(status), dict)
@@ -0,0 +1,173 @@
+from twisted.trial import unittest
+
+import common
+
+import deluge.component as component
+from deluge.core.eventmanager import EventManager
+from deluge.core.filtermanager import FilterManager
+from deluge.core.rpcserver import RPCServer
+from deluge.event import TorrentAddedEvent, TorrentRemovedEvent
+
+class FakeTorrent(object):
+    filter_index_hook = None
+    version = 0
+
+    def __init__(self, torrent_id, **status):
+        self.torrent_id = torrent_id
+        self.status = {"state": "Downloading", "tracker_host": "example.com",
+                       "owner": "localclient", "tracker_status": "",
+                       "download_payload_rate": 0, "upload_payload_rate": 0}
+        self.status.update(status)
+        self.state = self.status["state"]
+        self.tracker_status = self.status["tracker_status"]
+        self.filename = torrent_id + ".torrent"
+        self.trackers = [{"url": "http://%s/announce" % self.status["tracker_host"]}]
+        self.name = u"Torrent " + torrent_id.upper()
+        self.files = [{"path": u"%s/file.iso" % torrent_id}]
+
+    def get_name(self):
+        return self.name
+
+    def get_files(self):
+        return self.files
+
+    def set(self, key, value):
+        self.status[key] = value
+        if self.filter_index_hook:
+            self.filter_index_hook(self.torrent_id, key)
+
+    def get_status(self, keys):
+        return dict((key, self.status.get(key)) for key in keys)
+
+    def bump_version(self):
+        self.version += 1
+
+class FakeTorrentManager(object):
+    def __init__(self):
+        self.torrents = {}
+
+    def __getitem__(self, torrent_id):
+        return self.torrents[torrent_id]
+
+    def get_torrent_list(self):
+        return self.torrents.keys()
+
+    def separate_keys(self, keys, torrent_ids):
+        return list(keys), []
+
+class FakeCore(object):
+    def __init__(self):
+        self.torrentmanager = FakeTorrentManager()
+
+    def create_torrent_status(self, torrent_id, torrent_keys, plugin_keys):
+        try:
+            return self.torrentmanager[torrent_id].get_status(torrent_keys)
+        except KeyError:
+            return {}
+
+class FilterManagerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rpcserver = RPCServer(listen=False)
+        self.eventmanager = EventManager()
+        self.core = FakeCore()
+        self.filtermanager = FilterManager(self.core)
+        self.add(FakeTorrent("a"))
+        self.add(FakeTorrent("b", state="Seeding", tracker_host="other.org"))
+        self.add(FakeTorrent("c", state="Paused", tracker_status="other.org: Error: timed out"))
+
+    def tearDown(self):
+        component._ComponentRegistry.components = {}
+
+    def add(self, torrent):
+        self.core.torrentmanager.torrents[torrent.torrent_id] = torrent
+        self.eventmanager.emit(TorrentAddedEvent(torrent.torrent_id, False))
+
+    def filter(self, filter_dict):
+        return sorted(self.filtermanager.filter_torrent_ids(filter_dict))
+
+    def test_filter(self):
+        self.assertEquals(self.filter({"state": "Seeding"}), ["b"])
+        self.assertEquals(self.filter({"state": ["Seeding", "Paused"]}), ["b", "c"])
+        self.assertEquals(self.filter({"tracker_host": "example.com"}), ["a", "c"])
+        self.assertEquals(self.filter({"tracker_host": "Error"}), ["c"])
+        self.assertEquals(self.filter({"tracker_host": "example.com", "state": "Paused"}), ["c"])
+        self.assertEquals(self.filter({"id": ["a", "b"], "tracker_host": "example.com"}), ["a"])
+        self.assertEquals(self.filter({"state": "Queued"}), [])
+
+    def test_filter_changed(self):
+        self.core.torrentmanager["a"].set("state", "Seeding")
+        self.assertEquals(self.filter({"state": "Seeding"}), ["a", "b"])
+        self.assertEquals(self.filter({"state": "Downloading"}), [])
+
+        del self.core.torrentmanager.torrents["b"]
+        self.eventmanager.emit(TorrentRemovedEvent("b"))
+        self.assertEquals(self.filter({"state": "Seeding"}), ["a"])
+
+    def test_filter_keyword(self):
+        self.assertEquals(self.filter({"keyword": "b.iso"}), [])
+        self.assertEquals(self.filter({"keyword": "file.iso"}), ["a", "b", "c"])
+        self.assertEquals(self.filter({"keyword": "other.org"}), ["b", "c"])
+        # state and tracker_status are not indexed but still searched
+        self.assertEquals(self.filter({"keyword": "paused"}), ["c"])
+        self.assertEquals(self.filter({"keyword": "timed out"}), ["c"])
+        self.assertEquals(self.filter({"keyword": "torrent,b/"}), ["b"])
+
+        torrent = self.core.torrentmanager["a"]
+        torrent.files = [{"path": u"a/renamed.iso"}]
+        self.filtermanager.on_torrent_renamed("a", 0, "renamed.iso")
+        self.assertEquals(self.filter({"keyword": "renamed"}), ["a"])
+
+    def test_filter_name(self):
+        self.assertEquals(self.filter({"name": "torrent b"}), ["b"])
+        self.assertEquals(self.filter({"name": "Torrent B::match"}), ["b"])
+        self.assertEquals(self.filter({"name": "torrent b::match"}), [])
+        self.assertEquals(self.filter({"name": "T"}), ["a", "b", "c"])
+
+        self.add(FakeTorrent("d"))
+        self.assertEquals(self.filter({"name": "torrent d"}), ["d"])
+        del self.core.torrentmanager.torrents["d"]
+        self.eventmanager.emit(TorrentRemovedEvent("d"))
+        self.assertEquals(self.filter({"name": "torrent d"}), [])
+
+    def test_filter_tree(self):
+        tree = self.filtermanager.get_filter_tree()
+        self.assertEquals(dict(tree["tracker_host"]),
+                          {"All": 3, "Error": 1, "example.com": 2, "other.org": 1})
+        self.assertEquals(dict(tree["owner"]), {"": 0, "localclient": 3})
+        state = dict(tree["state"])
+        self.assertEquals(state["All"], 3)
+        self.assertEquals(state["Downloading"], 1)
+        self.assertEquals(state["Seeding"], 1)
+        self.assertEquals(state["Queued"], 0)
+
+    def test_update_tree_field(self):
+        # A plugin field, like the label
+        self.core.torrentmanager["a"].status["label"] = "linux"
+        self.core.torrentmanager["b"].status["label"] = "other"
+        self.filtermanager.register_tree_field("label", tracked=True)
+        self.assertEquals(self.filter({"label": "linux"}), ["a"])
+        versions = dict((torrent_id, torrent.version) for torrent_id, torrent
+                        in self.core.torrentmanager.torrents.iteritems())
+
+        # The label is removed from its torrents
+        self.core.torrentmanager["a"].status["label"] = ""
+        self.filtermanager.update_tree_field("label")
+        self.assertEquals(self.filter({"label": "linux"}), [])
+        self.assertEquals(self.filter({"label": ""}), ["a"])
+        # Only the torrent whose value changed has a new status version
+        self.assertTrue(self.core.torrentmanager["a"].version > versions["a"])
+        self.assertEquals(self.core.torrentmanager["b"].version, versions["b"])
+        self.assertEquals(self.core.torrentmanager["c"].version, versions["c"])
+
+    def test_untracked_tree_field(self):
+        self.core.torrentmanager["a"].status["color"] = "red"
+        self.filtermanager.register_tree_field("color")
+        self.assertEquals(dict(self.filtermanager.get_filter_tree()["color"]), {"red": 1, None: 2})
+
+        # The plugin doesn't report the change, it is still seen
+        self.core.torrentmanager["b"].status["color"] = "red"
+        self.assertEquals(dict(self.filtermanager.get_filter_tree()["color"]), {"red": 2, None: 1})
+        self.assertEquals(self.filter({"color": "red"}), ["a", "b"])
+
+        self.filtermanager.deregister_tree_field("color")
+        self.assertFalse("color" in self.filtermanager.get_filter_tree())
@@ -0,0 +1,30 @@
+from twisted.trial import unittest
+
+from deluge.core.keywordindex import KeywordIndex
+
+class KeywordIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = KeywordIndex()
+        self.index.add("a", u"Ubuntu Desktop", [u"ubuntu-9.04-desktop-i386.iso"])
+        self.index.add("b", u"Debian", [u"debian/debian-6.0-amd64.iso", u"debian/README"])
+
+    def test_search(self):
+        self.assertEquals(self.index.search(u"desktop"), set(["a"]))
+        self.assertEquals(self.index.search(u".iso"), set(["a", "b"]))
+        self.assertEquals(self.index.search(u"readme"), set(["b"]))
+        self.assertEquals(self.index.search(u"i3"), set(["a"]))
+        self.assertEquals(self.index.search(u"fedora"), set())
+
+    def test_search_name(self):
+        self.assertEquals(self.index.search_name(u"DEBIAN"), set(["b"]))
+        self.assertEquals(self.index.search_name(u"DEBIAN", match_case=True), set())
+        # The files are not part of the name
+        self.assertEquals(self.index.search_name(u"readme"), set())
+
+    def test_remove(self):
+        self.index.remove("b")
+        self.assertEquals(self.index.search(u".iso"), set(["a"]))
+        self.assertFalse([gram for gram, ids in self.index.grams.items() if "b" in ids])
+        # Adding again replaces what was indexed
+        self.index.add("a", u"Ubuntu Server", [])
+        self.assertEquals(self.index.search(u"desktop"), set())
@@ -0,0 +1,112 @@
+import random
+import time
+
+from twisted.trial import unittest
+
+import deluge.rencode as rencode
+
+try:
+    import deluge._rencode as _rencode
+except ImportError:
+    _rencode = None
+
+STATES = ["Downloading", "Seeding", "Paused", "Checking", "Queued", "Error"]
+TRACKERS = ["tracker.example.com", "openbittorrent.com", "publicbt.com", ""]
+
+def make_torrents_status(count, seed=0):
+    """
+    Returns a reply of core.get_torrents_status for count torrents, with the
+    keys the torrent view asks for.
+    """
+    rand = random.Random(seed)
+    status = {}
+    for i in xrange(count):
+        torrent_id = "%040x" % rand.getrandbits(160)
+        status[torrent_id] = {
+            "queue": i,
+            "name": u"Some.Torrent.Name.%d.\xe9t\xe9.1080p.x264" % i,
+            "total_wanted": rand.randint(0, 2 ** 40),
+            "state": rand.choice(STATES),
+            "progress": rand.random() * 100,
+            "num_seeds": rand.randint(0, 50),
+            "total_seeds": rand.randint(0, 5000),
+            "num_peers": rand.randint(0, 50),
+            "total_peers": rand.randint(0, 5000),
+            "download_payload_rate": rand.random() * 2 ** 20,
+            "upload_payload_rate": rand.random() * 2 ** 18,
+            "eta": rand.randint(0, 10 ** 6),
+            "ratio": rand.random() * 5,
+            "distributed_copies": rand.random() * 10,
+            "is_auto_managed": rand.random() > 0.5,
+            "time_added": 1330000000.0 + i,
+            "tracker_host": rand.choice(TRACKERS),
+            "save_path": u"/home/user/Downloads",
+            "label": "",
+            "owner": "localclient",
+            "files": [{"index": j, "path": u"dir/file_%d.mkv" % j, "size": rand.randint(0, 2 ** 32),
+                       "offset": j * 2 ** 32} for j in xrange(rand.randint(1, 5))],
+            "file_progress": [rand.random() for j in xrange(5)],
+            "peers": [],
+            "message": "OK",
+        }
+    return status
+
+class NativeRencodeTestCase(unittest.TestCase):
+
+    if _rencode is None:
+        skip = "deluge._rencode is not built"
+
+    def test_same_output(self):
+        values = [
+            None, True, False, 0, 43, 44, -1, -32, -33, 127, -129, 2 ** 15, 2 ** 31,
+            -2 ** 31 - 1, 2 ** 63, -2 ** 63 - 1, 10 ** 62, 1L, 1.1, -0.6, "", "a" * 63,
+            "a" * 64, u"\xe9t\xe9", (), [1, [2, (3,)]], range(100), {}, {"a": {}},
+            dict(zip(range(30), range(30))), make_torrents_status(50)
+        ]
+        for value in values:
+            for float_bits in (32, 64):
+                data = rencode.dumps(value, float_bits)
+                self.assertEquals(_rencode.dumps(value, float_bits), data)
+                for decode_utf8 in (False, True):
+                    self.assertEquals(_rencode.loads(data, decode_utf8),
+                                      rencode.loads(data, decode_utf8))
+
+    def test_errors(self):
+        self.assertRaises(ValueError, _rencode.dumps, 10 ** 64)
+        self.assertRaises(ValueError, _rencode.dumps, 1, 16)
+        self.assertRaises(KeyError, _rencode.dumps, object())
+        data = rencode.dumps(make_torrents_status(5))
+        for i in xrange(len(data)):
+            self.assertRaises(ValueError, _rencode.loads, data[:i])
+        self.assertRaises(ValueError, _rencode.loads, data + "\x00")
+        self.assertRaises(ValueError, _rencode.loads, "=012\x7f")
+        self.assertRaises(ValueError, _rencode.loads, "\x7f")
+        self.assertRaises(UnicodeDecodeError, _rencode.loads, "\x81\xff", True)
+
+    # Remove underscore to enable the benchmark, or run it directly:
+    # tests $ trial test_rencode.NativeRencodeTestCase._test_benchmark
+    def _test_benchmark(self):
+        """
+        Compares the pure and native rencode with get_torrents_status replies
+        for 100 to 5000 torrents.
+
+        """
+        def measure(func, *args):
+            start = time.time()
+            for i in xrange(5):
+                func(*args)
+            return (time.time() - start) / 5
+
+        print
+        print "%8s %10s %21s %21s %21s" % ("torrents", "bytes", "dumps pure/native",
+                                           "loads pure/native", "loads utf8 pure/native")
+        for count in (100, 1000, 5000):
+            status = make_torrents_status(count)
+            data = rencode.dumps(status)
+            times = []
+            for func, args in ((rencode.dumps, (status,)), (_rencode.dumps, (status,)),
+                               (rencode.loads, (data,)), (_rencode.loads, (data,)),
+                               (rencode.loads, (data, True)), (_rencode.loads, (data, True))):
+                times.append(measure(func, *args) * 1000)
+            print "%8d %10d %9.1fms/%7.1fms %9.1fms/%7.1fms %9.1fms/%7.1fms" % (
+                (count, len(data)) + tuple(times))
@@ -0,0 +1,53 @@
+from twisted.trial import unittest
+
+import os
+
+import common
+
+from deluge.core.resumestore import ResumeDataStore
+
+class ResumeDataStoreTestCase(unittest.TestCase):
+    def setUp(self):
+        self.path = os.path.join(common.set_tmp_config_dir(), "resume")
+        self.store = ResumeDataStore(self.path)
+
+    def test_save_and_load(self):
+        self.store["ab01"] = "d4:infoe"
+        self.store["cd02"] = "d4:datae"
+        self.assertTrue(self.store.save())
+        self.assertEquals(["ab.fastresume", "cd.fastresume"], sorted(os.listdir(self.path)))
+
+        store = ResumeDataStore(self.path)
+        self.assertEquals("d4:infoe", store.get("ab01"))
+        self.assertEquals("d4:datae", store["cd02"])
+        self.assertEquals(None, store.get("ef03"))
+        self.assertRaises(KeyError, store.__getitem__, "ef03")
+
+    def test_only_dirty_shards_written(self):
+        self.store["ab01"] = "1"
+        self.store["cd02"] = "2"
+        self.store.save()
+        os.utime(os.path.join(self.path, "cd.fastresume"), (0, 0))
+
+        self.store["ab03"] = "3"
+        self.store.save()
+        self.assertEquals(0, os.stat(os.path.join(self.path, "cd.fastresume")).st_mtime)
+
+        store = ResumeDataStore(self.path)
+        self.assertEquals("1", store.get("ab01"))
+        self.assertEquals("3", store.get("ab03"))
+
+    def test_remove(self):
+        self.store.update({"ab01": "1", "ab02": "2"})
+        self.store.save()
+        self.store.remove("ab01")
+        self.assertFalse("ab01" in self.store)
+        self.store.save()
+
+        store = ResumeDataStore(self.path)
+        self.assertEquals(None, store.get("ab01"))
+        self.assertEquals("2", store.get("ab02"))
+
+        store.remove("ab02")
+        store.save()
+        self.assertEquals([], os.listdir(self.path))
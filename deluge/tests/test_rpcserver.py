@@ -0,0 +1,201 @@
+import sys
+import threading
+import zlib
+
+from twisted.internet import defer
+from twisted.trial import unittest
+
+import common
+
+import deluge.rencode as rencode
+import deluge.component as component
+from deluge.core.rpcserver import RPCServer, DelugeRPCProtocol, RPC_EVENT, RPC_EVENT_BATCH
+from deluge.core.rpcserver import RPC_RESPONSE, RPC_RESPONSE_PART
+from deluge.error import DelugeError
+from deluge.event import TorrentStateChangedEvent, TorrentRemovedEvent
+from deluge.transfer import MESSAGE_HEADER_SIZE, FLAG_COMPRESSED
+
+class FakeProtocol(object):
+    def __init__(self):
+        self.messages = []
+        self.frames = []
+        self.compression = None
+        self.calls = 0
+
+    def get_bytes_sent(self):
+        return 100
+
+    def get_bytes_recv(self):
+        return 50
+
+    def sendFrame(self, frame):
+        self.frames.append(frame)
+        payload = frame[MESSAGE_HEADER_SIZE:]
+        if ord(frame[0]) & FLAG_COMPRESSED:
+            payload = zlib.decompress(payload)
+        self.messages.append(rencode.loads(payload))
+
+class RPCServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rpcserver = RPCServer(listen=False)
+        self.rpcserver.event_batch_window = 0.01
+        self.sessions = {}
+        for session_id in (1, 2):
+            self.sessions[session_id] = FakeProtocol()
+            self.rpcserver.factory.session_protocols[session_id] = self.sessions[session_id]
+            self.rpcserver.factory.interested_events[session_id] = [
+                "TorrentStateChangedEvent", "TorrentRemovedEvent"]
+
+    def tearDown(self):
+        if self.rpcserver.event_batch_timer:
+            self.rpcserver.event_batch_timer.cancel()
+        component._ComponentRegistry.components = {}
+
+    def test_emit_event(self):
+        self.rpcserver.emit_event(TorrentRemovedEvent("abc"))
+        for protocol in self.sessions.values():
+            self.assertEquals(protocol.messages, [(RPC_EVENT, "TorrentRemovedEvent", ("abc",))])
+
+    def test_emit_event_compression(self):
+        self.sessions[1].compression = (0, 0)
+        self.rpcserver.emit_event(TorrentRemovedEvent("abc"))
+        for protocol in self.sessions.values():
+            self.assertEquals(protocol.messages, [(RPC_EVENT, "TorrentRemovedEvent", ("abc",))])
+        self.assertFalse(ord(self.sessions[1].frames[0][0]) & FLAG_COMPRESSED)
+        self.assertEquals(self.sessions[2].frames[0][0], "D")
+
+    def test_emit_event_batched(self):
+        self.rpcserver.set_event_batching(1, True)
+        self.rpcserver.emit_event(TorrentStateChangedEvent("abc", "Checking"))
+        self.rpcserver.emit_event(TorrentStateChangedEvent("def", "Checking"))
+        self.rpcserver.emit_event(TorrentStateChangedEvent("abc", "Seeding"))
+        self.rpcserver.emit_event(TorrentRemovedEvent("def"))
+
+        # The session that didn't ask for batches gets every event straight away
+        self.assertEquals(len(self.sessions[2].messages), 4)
+        self.assertEquals(self.sessions[1].messages, [])
+
+        self.rpcserver.send_event_batch()
+        # rencode turns the lists into tuples
+        self.assertEquals(self.sessions[1].messages, [(RPC_EVENT_BATCH, (
+            ("TorrentStateChangedEvent", ("def", "Checking")),
+            ("TorrentStateChangedEvent", ("abc", "Seeding")),
+            ("TorrentRemovedEvent", ("def",))))])
+        self.assertFalse(self.rpcserver.event_batch)
+
+    def test_get_rpc_stats(self):
+        self.rpcserver.factory.authorized_sessions[1] = (10, "localclient")
+        self.rpcserver.factory.authorized_sessions[2] = 0
+        self.sessions[1].calls = 3
+        started = self.rpcserver.stats.call_started("core.get_torrents_status")
+        self.rpcserver.stats.call_finished("core.get_torrents_status", started, 1000, 200)
+
+        stats = self.rpcserver.get_rpc_stats()
+        method = stats["methods"]["core.get_torrents_status"]
+        self.assertEquals(method["calls"], 1)
+        self.assertEquals(method["sent_bytes"], 200)
+        self.assertEquals(stats["sessions"], {
+            1: {"username": "localclient", "calls": 3, "bytes_sent": 100, "bytes_received": 50},
+            2: {"username": "", "calls": 0, "bytes_sent": 100, "bytes_received": 50}})
+        self.assertEquals(stats["threads"]["methods"], {})
+
+class StreamTestCase(unittest.TestCase):
+    def setUp(self):
+        self.protocol = DelugeRPCProtocol()
+        self.protocol.streams = {}
+        self.messages = []
+        self.errors = []
+        self.protocol.sendData = self.send_data
+
+    def send_data(self, data):
+        self.messages.append(data)
+        return 10, 5
+
+    def send_error(self):
+        self.errors.append(sys.exc_info()[1])
+
+    def test_stream(self):
+        self.protocol.streaming = True
+        finished = []
+        self.protocol.sendStream(1, iter(range(250)), self.send_error,
+                                 lambda *args: finished.append(args))
+
+        def on_done(result):
+            self.assertEquals(self.messages, [
+                (RPC_RESPONSE_PART, 1, range(100)),
+                (RPC_RESPONSE_PART, 1, range(100, 200)),
+                (RPC_RESPONSE, 1, range(200, 250))])
+            self.assertFalse(self.protocol.streams)
+            self.assertEquals(finished, [([30, 15],)])
+        return self.protocol.streams[1].whenDone().addCallback(on_done)
+
+    def test_stream_not_streaming(self):
+        # Clients that didn't ask for streams get a single response
+        self.protocol.sendStream(1, iter(range(250)), self.send_error)
+
+        def on_done(result):
+            self.assertEquals(self.messages, [(RPC_RESPONSE, 1, range(250))])
+        return self.protocol.streams[1].whenDone().addCallback(on_done)
+
+    def test_stream_error(self):
+        def items():
+            for i in range(150):
+                yield i
+            raise DelugeError("failed")
+
+        self.protocol.streaming = True
+        self.protocol.sendStream(1, items(), self.send_error)
+
+        def on_done(result):
+            self.assertEquals(self.messages, [(RPC_RESPONSE_PART, 1, range(100))])
+            self.assertEquals(len(self.errors), 1)
+            self.assertTrue(isinstance(self.errors[0], DelugeError))
+        return self.protocol.streams[1].whenDone().addCallback(on_done)
+
+    def test_stream_stopped(self):
+        self.protocol.streaming = True
+        finished = []
+        self.protocol.sendStream(1, iter(range(250)), self.send_error,
+                                 lambda *args: finished.append(args))
+        stream = self.protocol.streams[1]
+        stream.stop()
+
+        # A stopped stream still finishes the call
+        self.assertEquals(finished, [([0, 0], True)])
+        self.assertFalse(self.protocol.streams)
+
+class ThreadedMethodTestCase(unittest.TestCase):
+    def setUp(self):
+        self.rpcserver = RPCServer(listen=False)
+
+    def tearDown(self):
+        self.rpcserver.stop()
+        component._ComponentRegistry.components = {}
+
+    def test_run_threaded(self):
+        main_thread = threading.currentThread()
+        # Keeps the first call running until the second one is queued
+        release = threading.Event()
+
+        def blocking(value):
+            self.assertNotEquals(threading.currentThread(), main_thread)
+            release.wait(5)
+            return value * 2
+
+        d1 = self.rpcserver.run_threaded("test.blocking", blocking, (1,), {}, 1)
+        d2 = self.rpcserver.run_threaded("test.blocking", blocking, (), {"value": 2}, 1)
+        stats = self.rpcserver.get_thread_stats()["methods"]["test.blocking"]
+        self.assertEquals(stats, {"queued": 1, "max_queued": 1, "running": 1, "calls": 0})
+        release.set()
+
+        def on_done(result):
+            self.assertEquals(result, [(True, 2), (True, 4)])
+            stats = self.rpcserver.get_thread_stats()["methods"]["test.blocking"]
+            self.assertEquals(stats, {"queued": 0, "max_queued": 1, "running": 0, "calls": 2})
+        return defer.DeferredList([d1, d2]).addCallback(on_done)
+
+    def test_run_threaded_error(self):
+        def failing():
+            raise DelugeError("failed")
+        d = self.rpcserver.run_threaded("test.failing", failing, (), {})
+        return self.assertFailure(d, DelugeError)
@@ -0,0 +1,57 @@
+import time
+
+from twisted.trial import unittest
+
+from deluge.core.rpcstats import RPCStats, percentile
+
+class PercentileTestCase(unittest.TestCase):
+    def test_percentile(self):
+        values = range(1, 101)
+        self.assertEquals(percentile(values, 50), 50)
+        self.assertEquals(percentile(values, 95), 95)
+        self.assertEquals(percentile(values, 99), 99)
+        self.assertEquals(percentile(values, 100), 100)
+        self.assertEquals(percentile([3], 50), 3)
+        self.assertEquals(percentile([1, 2], 0), 1)
+        self.assertEquals(percentile([], 50), 0)
+
+class RPCStatsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.stats = RPCStats(window=60, max_samples=10)
+
+    def test_call(self):
+        started = self.stats.call_started("core.get_session_state")
+        stats = self.stats.get_stats()
+        self.assertEquals(stats["window"], 60)
+        self.assertEquals(stats["methods"]["core.get_session_state"]["in_flight"], 1)
+        self.assertEquals(stats["methods"]["core.get_session_state"]["window_calls"], 0)
+
+        self.stats.call_finished("core.get_session_state", started - 0.5, 300, 100)
+        started = self.stats.call_started("core.get_session_state")
+        self.stats.call_finished("core.get_session_state", started, error=True)
+        method = self.stats.get_stats()["methods"]["core.get_session_state"]
+        self.assertEquals(method["calls"], 2)
+        self.assertEquals(method["errors"], 1)
+        self.assertEquals(method["in_flight"], 0)
+        self.assertEquals(method["window_calls"], 2)
+        self.assertTrue(method["p50"] < 0.5)
+        self.assertTrue(method["p99"] >= 0.5)
+        self.assertEquals(method["payload_bytes"], 300)
+        self.assertEquals(method["sent_bytes"], 100)
+
+    def test_window(self):
+        for i in range(15):
+            self.stats.call_finished("daemon.info", self.stats.call_started("daemon.info"))
+        method = self.stats.get_stats()["methods"]["daemon.info"]
+        self.assertEquals(method["calls"], 15)
+        self.assertEquals(method["window_calls"], 10)
+
+        # Samples older than the window are dropped
+        samples = self.stats.methods["daemon.info"].samples
+        for i in range(5):
+            sample = samples.popleft()
+            samples.append((time.time() - 61,) + sample[1:])
+        samples.rotate(5)
+        method = self.stats.get_stats()["methods"]["daemon.info"]
+        self.assertEquals(method["calls"], 15)
+        self.assertEquals(method["window_calls"], 5)
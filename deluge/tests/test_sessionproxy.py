@@ -10,10 +10,28 @@ def __init__(self):
 
     def reset(self):
         self.torrents = {}
-        self.torrents["a"] = {"key1": 1, "key2": 2, "key3": 3}
-        self.torrents["b"] = {"key1": 1, "key2": 2, "key3": 3}
-        self.torrents["c"] = {"key1": 1, "key2": 2, "key3": 3}
-        self.prev_status = {}
+        self.torrents["a"] = {"key1": 1, "key2": 2, "key3": 3, "state": "Seeding", "owner": "user"}
+        self.torrents["b"] = {"key1": 1, "key2": 2, "key3": 3, "state": "Downloading", "owner": "user"}
+        self.torrents["c"] = {"key1": 1, "key2": 2, "key3": 3, "state": "Paused", "owner": "other"}
+        self.torrents["a"]["label"] = "linux"
+        self.torrents["b"]["label"] = "linux"
+        self.torrents["c"]["label"] = ""
+        self.version = 3
+        self.versions = {"a": 1, "b": 2, "c": 3}
+        # The torrents sent by the last get_torrents_status_since call
+        self.sent = []
+
+    def set_status(self, torrent_id, key, value):
+        self.torrents[torrent_id][key] = value
+        self.version += 1
+        self.versions[torrent_id] = self.version
+
+    def remove_label(self, label):
+        # Like the Label plugin, the torrents get a new status version through
+        # FilterManager.update_tree_field
+        for torrent_id, status in self.torrents.items():
+            if status["label"] == label:
+                self.set_status(torrent_id, "label", "")
 
     def get_session_state(self):
         return maybeDeferred(self.torrents.keys)
@@ -21,58 +39,41 @@ def get_session_state(self):
     def get_torrent_status(self, torrent_id, keys, diff=False):
         if not keys:
             keys = self.torrents[torrent_id].keys()
+        ret = {}
+        for key in keys:
+            ret[key] = self.torrents[torrent_id][key]
+        return succeed(ret)
 
-        if not diff:
-            ret = {}
-            for key in keys:
-                ret[key] = self.torrents[torrent_id][key]
-
-            return succeed(ret)
-
-        else:
-            ret = {}
-            if torrent_id in self.prev_status:
-                for key in keys:
-                    if self.prev_status[torrent_id][key] != self.torrents[torrent_id][key]:
-                        ret[key] = self.torrents[torrent_id][key]
-            else:
-                ret = self.torrents[torrent_id]
-            self.prev_status[torrent_id] = dict(self.torrents[torrent_id])
-            return succeed(ret)
-
-    def get_torrents_status(self, filter_dict, keys, diff=False):
-        if not filter_dict:
-            filter_dict["id"] = self.torrents.keys()
+    def get_torrents_status_since(self, version, keys):
         if not keys:
             keys = self.torrents["a"].keys()
-        if not diff:
-            if "id" in filter_dict:
-                torrents = filter_dict["id"]
-                ret = {}
-                for torrent in torrents:
-                    ret[torrent] = {}
-                    for key in keys:
-                        ret[torrent][key] = self.torrents[torrent][key]
-                return succeed(ret)
-        else:
-            if "id" in filter_dict:
-                torrents = filter_dict["id"]
-                ret = {}
-                for torrent in torrents:
-                    ret[torrent] = {}
-                    if torrent in self.prev_status:
-                        for key in self.prev_status[torrent]:
-                            if self.prev_status[torrent][key] != self.torrents[torrent][key]:
-                                ret[torrent][key] = self.torrents[torrent][key]
-                    else:
-                        ret[torrent] = dict(self.torrents[torrent])
-
-                    self.prev_status[torrent] = dict(self.torrents[torrent])
-                return succeed(ret)
+        ret = {}
+        for torrent_id, status in self.torrents.items():
+            if self.versions[torrent_id] > version:
+                ret[torrent_id] = dict((key, status[key]) for key in keys if key in status)
+        self.sent = sorted(ret)
+        return succeed((self.version, ret))
+
+    def get_torrents_status(self, filter_dict, keys, diff=False):
+        ret = {}
+        for torrent_id, status in self.torrents.items():
+            if "key1" in filter_dict and status["key1"] not in filter_dict["key1"]:
+                continue
+            ret[torrent_id] = dict((key, status[key]) for key in keys or status)
+        self.sent = sorted(ret)
+        return succeed(ret)
+
+class Daemon(object):
+    def __init__(self):
+        self.methods = ["core.get_torrents_status_since"]
+
+    def get_method_list(self):
+        return succeed(self.methods)
 
 class Client(object):
     def __init__(self):
         self.core = Core()
+        self.daemon = Daemon()
 
     def __noop__(self, *args, **kwargs):
         return None
@@ -86,6 +87,7 @@ class SessionProxyTestCase(unittest.TestCase):
     def setUp(self):
         self.sp = deluge.ui.sessionproxy.SessionProxy()
         client.core.reset()
+        client.daemon.__init__()
         d = self.sp.start()
         return d
 
@@ -93,7 +95,7 @@ def tearDown(self):
         return component.deregister(self.sp)
 
     def test_startup(self):
-        self.assertEquals(client.core.torrents["a"], self.sp.torrents["a"][1])
+        self.assertEquals(sorted(self.sp.torrents), ["a", "b", "c"])
 
     def test_get_torrent_status_no_change(self):
         d = self.sp.get_torrent_status("a", [])
@@ -101,13 +103,16 @@ def test_get_torrent_status_no_change(self):
         return d
 
     def test_get_torrent_status_change_with_cache(self):
-        client.core.torrents["a"]["key1"] = 2
-        d = self.sp.get_torrent_status("a", ["key1"])
+        def on_status(result):
+            client.core.set_status("a", "key1", 2)
+            return self.sp.get_torrent_status("a", ["key1"])
+        d = self.sp.get_torrents_status({}, ["key1"])
+        d.addCallback(on_status)
         d.addCallback(self.assertEquals, {"key1": 1})
         return d
 
     def test_get_torrent_status_change_without_cache(self):
-        client.core.torrents["a"]["key1"] = 2
+        client.core.set_status("a", "key1", 2)
         time.sleep(self.sp.cache_time + 0.1)
         d = self.sp.get_torrent_status("a", [])
         d.addCallback(self.assertEquals, client.core.torrents["a"])
@@ -116,7 +121,7 @@ def test_get_torrent_status_change_without_cache(self):
     def test_get_torrent_status_key_not_updated(self):
         time.sleep(self.sp.cache_time + 0.1)
         self.sp.get_torrent_status("a", ["key1"])
-        client.core.torrents["a"]["key2"] = 99
+        client.core.set_status("a", "key2", 99)
         d = self.sp.get_torrent_status("a", ["key2"])
         d.addCallback(self.assertEquals, {"key2": 99})
         return d
@@ -124,7 +129,122 @@ def test_get_torrent_status_key_not_updated(self):
     def test_get_torrents_status_key_not_updated(self):
         time.sleep(self.sp.cache_time + 0.1)
         self.sp.get_torrents_status({"id": ["a"]}, ["key1"])
-        client.core.torrents["a"]["key2"] = 99
+        client.core.set_status("a", "key2", 99)
         d = self.sp.get_torrents_status({"id": ["a"]}, ["key2"])
         d.addCallback(self.assertEquals, {"a": {"key2": 99}})
         return d
+
+    def test_get_torrents_status_changed_only(self):
+        def on_status(result):
+            self.assertEquals(client.core.sent, ["a", "b", "c"])
+            client.core.set_status("b", "key1", 5)
+            self.sp.last_update = 0.0
+            return self.sp.get_torrents_status({}, ["key1"])
+
+        def on_update(result):
+            self.assertEquals(client.core.sent, ["b"])
+            self.assertEquals(result, {"a": {"key1": 1}, "b": {"key1": 5}, "c": {"key1": 1}})
+
+        d = self.sp.get_torrents_status({}, ["key1"])
+        d.addCallback(on_status)
+        d.addCallback(on_update)
+        return d
+
+    def test_get_torrents_status_filtered(self):
+        def on_status(result):
+            self.assertEquals(result, {"a": {"key1": 1}, "b": {"key1": 1}})
+            return self.sp.get_torrents_status({"state": ["Seeding", "Paused"]}, ["key1"])
+
+        def on_state(result):
+            self.assertEquals(sorted(result), ["a", "c"])
+            # The core answers the filters it doesn't cache
+            return self.sp.get_torrents_status({"key1": [1]}, ["key2"])
+
+        d = self.sp.get_torrents_status({"owner": "user"}, ["key1"])
+        d.addCallback(on_status)
+        d.addCallback(on_state)
+        d.addCallback(self.assertEquals, {"a": {"key2": 2}, "b": {"key2": 2}, "c": {"key2": 2}})
+        return d
+
+    def test_create_status_dict_reused(self):
+        def on_status(result):
+            # The same query gets the same status dicts
+            again = self.sp.get_torrents_status({}, ["key1", "key2"], shared=True)
+            again.addCallback(on_again, result)
+            return again
+
+        def on_again(result, first):
+            for torrent_id in result:
+                self.assertTrue(result[torrent_id] is first[torrent_id])
+            client.core.set_status("b", "key2", 7)
+            self.sp.last_update = 0.0
+            return self.sp.get_torrents_status({}, ["key1", "key2"], shared=True).addCallback(on_update, result)
+
+        def on_update(result, previous):
+            self.assertTrue(result["a"] is previous["a"])
+            self.assertEquals(result["b"], {"key1": 1, "key2": 7})
+            self.assertEquals(previous["b"], {"key1": 1, "key2": 2})
+
+        d = self.sp.get_torrents_status({}, ["key1", "key2"], shared=True)
+        d.addCallback(on_status)
+        return d
+
+    def test_get_torrents_status_copies(self):
+        def on_status(result):
+            result["a"]["key1"] = 99
+            del result["b"]["key1"]
+            return self.sp.get_torrents_status({}, ["key1"])
+
+        def on_again(result):
+            self.assertEquals(result, {"a": {"key1": 1}, "b": {"key1": 1}, "c": {"key1": 1}})
+            result["a"]["key1"] = 99
+            return self.sp.get_torrent_status("a", ["key1"])
+
+        d = self.sp.get_torrents_status({}, ["key1"])
+        d.addCallback(on_status)
+        d.addCallback(on_again)
+        d.addCallback(self.assertEquals, {"key1": 1})
+        return d
+
+    def test_get_torrents_status_old_core(self):
+        client.daemon.methods = []
+        self.sp.stop()
+
+        def on_start(result):
+            self.assertFalse(self.sp.status_since)
+            return self.sp.get_torrents_status({}, ["key1"])
+
+        def on_status(result):
+            self.assertEquals(result, {"a": {"key1": 1}, "b": {"key1": 1}, "c": {"key1": 1}})
+            client.core.set_status("b", "key1", 5)
+            del client.core.torrents["c"]
+            self.sp.last_update = 0.0
+            return self.sp.get_torrents_status({}, ["key1"])
+
+        def on_update(result):
+            # Every torrent is sent again, so the removed one is dropped
+            self.assertEquals(client.core.sent, ["a", "b"])
+            self.assertEquals(result, {"a": {"key1": 1}, "b": {"key1": 5}})
+
+        d = self.sp.start()
+        d.addCallback(on_start)
+        d.addCallback(on_status)
+        d.addCallback(on_update)
+        return d
+
+    def test_get_torrents_status_label_removed(self):
+        def on_status(result):
+            self.assertEquals(sorted(result), ["a", "b"])
+            client.core.remove_label("linux")
+            self.sp.last_update = 0.0
+            return self.sp.get_torrents_status({"label": "linux"}, ["key1"])
+
+        def on_removed(result):
+            self.assertEquals(result, {})
+            return self.sp.get_torrents_status({"label": ""}, ["label"])
+
+        d = self.sp.get_torrents_status({"label": "linux"}, ["key1"])
+        d.addCallback(on_status)
+        d.addCallback(on_removed)
+        d.addCallback(self.assertEquals, {"a": {"label": ""}, "b": {"label": ""}, "c": {"label": ""}})
+        return d
@@ -0,0 +1,67 @@
+from twisted.trial import unittest
+
+from deluge.core.sortindex import SortIndex
+
+class FakeTorrent(object):
+    def __init__(self, version, value):
+        self.version = version
+        self.value = value
+
+class SortIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.torrents = {}
+        self.index = SortIndex("name")
+        self.reads = []
+
+    def get_value(self, torrent_id):
+        self.reads.append(torrent_id)
+        return self.torrents[torrent_id].value
+
+    def set_torrent(self, torrent_id, value):
+        version = max([t.version for t in self.torrents.values()] + [0]) + 1
+        self.torrents[torrent_id] = FakeTorrent(version, value)
+
+    def update(self):
+        self.reads = []
+        self.index.update(self.torrents, max([t.version for t in self.torrents.values()] + [0]),
+                          self.get_value)
+
+    def test_get_page(self):
+        for torrent_id, value in zip("abcde", [3, 1, 4, 1, 5]):
+            self.set_torrent(torrent_id, value)
+        self.update()
+
+        self.assertEquals(self.index.get_page(), ["b", "d", "a", "c", "e"])
+        self.assertEquals(self.index.get_page(reverse=True), ["e", "c", "a", "d", "b"])
+        self.assertEquals(self.index.get_page(offset=1, limit=2), ["d", "a"])
+        self.assertEquals(self.index.get_page(offset=4, limit=2), ["e"])
+        self.assertEquals(self.index.get_page(set("ace"), True, 1, 1), ["c"])
+
+    def test_update(self):
+        for i in xrange(100):
+            self.set_torrent("%03d" % i, i)
+        self.update()
+        self.assertEquals(len(self.reads), 100)
+
+        # Only the changed torrents are read again
+        self.update()
+        self.assertEquals(self.reads, [])
+
+        self.set_torrent("010", 1000)
+        self.set_torrent("020", -1)
+        self.set_torrent("new", 50.5)
+        del self.torrents["030"]
+        self.update()
+        self.assertEquals(sorted(self.reads), ["010", "020", "new"])
+
+        expected = sorted(self.torrents, key=lambda torrent_id: self.torrents[torrent_id].value)
+        self.assertEquals(self.index.get_page(), expected)
+        self.assertEquals(self.index.get_page(limit=3), ["020", "000", "001"])
+        self.assertEquals(self.index.get_page(reverse=True, limit=1), ["010"])
+
+    def test_remove_nan(self):
+        self.set_torrent("a", float("nan"))
+        self.set_torrent("b", 1.0)
+        self.update()
+        self.index.remove("a")
+        self.assertEquals(self.index.get_page(), ["b"])
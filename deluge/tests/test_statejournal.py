@@ -0,0 +1,108 @@
+from twisted.trial import unittest
+
+import os
+import cPickle
+
+import common
+
+from deluge.core.statejournal import StateJournal
+
+class State(object):
+    def __init__(self, torrent_id=None, total_uploaded=0, trackers=None):
+        self.torrent_id = torrent_id
+        self.total_uploaded = total_uploaded
+        self.trackers = trackers
+
+class StateContainer(object):
+    def __init__(self):
+        self.torrents = []
+
+class StateJournalTestCase(unittest.TestCase):
+    def setUp(self):
+        self.state_dir = common.set_tmp_config_dir()
+
+    def new_journal(self):
+        return StateJournal(self.state_dir, State, StateContainer)
+
+    def load(self):
+        journal = self.new_journal()
+        try:
+            snapshot = cPickle.load(open(journal.state_file, "rb"))
+        except IOError:
+            snapshot = StateContainer()
+        return journal, journal.replay(snapshot.torrents,
+                                       getattr(snapshot, "journal_generation", 0))
+
+    def test_replay_updates_and_removes(self):
+        journal = self.new_journal()
+        journal.replay([])
+        states = [State("a", 1, [{"url": "http://a"}]), State("b", 2)]
+        journal.save(states)
+        states[0].total_uploaded = 10
+        journal.save(states)
+        journal.save(states[:1])
+
+        journal, loaded = self.load()
+        self.assertEquals(["a"], [s.torrent_id for s in loaded])
+        self.assertEquals(10, loaded[0].total_uploaded)
+        self.assertEquals([{"url": "http://a"}], loaded[0].trackers)
+        self.assertEquals(4, journal.journal_records)
+
+    def test_only_changes_are_written(self):
+        journal = self.new_journal()
+        journal.replay([])
+        states = [State("a", 1), State("b", 2)]
+        journal.save(states)
+        size = os.path.getsize(journal.journal_file)
+        journal.save(states)
+        self.assertEquals(size, os.path.getsize(journal.journal_file))
+        self.assertEquals(2, journal.journal_records)
+
+    def test_compact(self):
+        journal = self.new_journal()
+        journal.replay([])
+        states = [State("a", 1), State("b", 2)]
+        journal.save(states)
+        states[1].total_uploaded = 5
+        journal.compact(states)
+        self.assertEquals(0, os.path.getsize(journal.journal_file))
+
+        journal, loaded = self.load()
+        self.assertEquals(["a", "b"], [s.torrent_id for s in loaded])
+        self.assertEquals(5, loaded[1].total_uploaded)
+
+    def test_truncated_record(self):
+        journal = self.new_journal()
+        journal.replay([])
+        journal.save([State("a", 1)])
+        journal.save([State("a", 1), State("b", 2)])
+        data = open(journal.journal_file, "rb").read()
+        open(journal.journal_file, "wb").write(data[:-3])
+
+        journal, loaded = self.load()
+        self.assertEquals(["a"], [s.torrent_id for s in loaded])
+
+        # The records saved next are not lost behind the bad one
+        journal.save([State("a", 1), State("c", 3)])
+        journal, loaded = self.load()
+        self.assertEquals(["a", "c"], [s.torrent_id for s in loaded])
+
+    def test_stale_journal(self):
+        journal = self.new_journal()
+        journal.replay([])
+        states = [State("a", 1)]
+        journal.save(states)
+        data = open(journal.journal_file, "rb").read()
+        states[0].total_uploaded = 5
+        journal.compact(states)
+
+        # As if the daemon stopped before the journal was truncated
+        open(journal.journal_file, "wb").write(data)
+        journal, loaded = self.load()
+        self.assertEquals(5, loaded[0].total_uploaded)
+        self.assertEquals(0, os.path.getsize(journal.journal_file))
+
+        loaded[0].total_uploaded = 6
+        journal.save(loaded)
+        journal, loaded = self.load()
+        self.assertEquals(6, loaded[0].total_uploaded)
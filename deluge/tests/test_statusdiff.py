@@ -0,0 +1,33 @@
+from twisted.trial import unittest
+
+from deluge.core.statusdiff import StatusDiffTracker
+
+class StatusDiffTrackerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.tracker = StatusDiffTracker()
+
+    def test_diff(self):
+        status = {"name": "a", "progress": 0.0, "files": [{"path": "a"}]}
+        self.assertEquals(self.tracker.diff(1, "abc", status), status)
+        self.assertEquals(self.tracker.diff(1, "abc", dict(status)), {})
+        self.assertEquals(self.tracker.diff(1, "abc", {
+            "name": "a", "progress": 10.0, "files": [{"path": "b"}]}),
+            {"progress": 10.0, "files": [{"path": "b"}]})
+
+        # Other sessions have their own previous status
+        self.assertEquals(self.tracker.diff(2, "abc", status), status)
+
+    def test_diff_other_keys(self):
+        self.tracker.diff(1, "abc", {"name": "a", "progress": 0.0})
+        self.assertEquals(self.tracker.diff(1, "abc", {"progress": 0.0, "state": "Seeding"}),
+                          {"state": "Seeding"})
+
+    def test_remove(self):
+        status = {"name": "a"}
+        self.tracker.diff(1, "abc", status)
+        self.tracker.diff(2, "abc", status)
+        self.tracker.remove_session(1)
+        self.assertEquals(self.tracker.diff(1, "abc", status), status)
+        self.tracker.remove_torrent("abc")
+        self.assertEquals(self.tracker.diff(1, "abc", status), status)
+        self.assertEquals(self.tracker.diff(2, "abc", status), status)
@@ -0,0 +1,63 @@
+from twisted.trial import unittest
+
+from deluge.core.statussubscription import StatusSubscription
+
+class StatusSubscriptionTestCase(unittest.TestCase):
+    def setUp(self):
+        self.subscription = StatusSubscription({}, ["name", "progress"])
+
+    def test_first_update(self):
+        changes = self.subscription.update({
+            "abc": {"name": "a", "progress": 0.0},
+        })
+        self.assertEquals(changes["added"], {"abc": 0})
+        self.assertEquals(changes["removed"], [])
+        self.assertEquals(changes["columns"], {
+            "name": [[0], ["a"]],
+            "progress": [[0], [0.0]]
+        })
+
+    def test_only_changes(self):
+        self.subscription.update({
+            "abc": {"name": "a", "progress": 0.0},
+            "def": {"name": "d", "progress": 0.0},
+        })
+        self.assertEquals(self.subscription.update({
+            "abc": {"name": "a", "progress": 0.0},
+            "def": {"name": "d", "progress": 0.0},
+        }), None)
+
+        index = self.subscription.indexes["def"]
+        changes = self.subscription.update({
+            "abc": {"name": "a", "progress": 0.0},
+            "def": {"name": "d", "progress": 50.0},
+        })
+        self.assertEquals(changes, {
+            "added": {},
+            "removed": [],
+            "columns": {"progress": [[index], [50.0]]}
+        })
+
+    def test_added_and_removed(self):
+        self.subscription.update({"abc": {"name": "a", "progress": 0.0}})
+        changes = self.subscription.update({"def": {"name": "d", "progress": 0.0}})
+        self.assertEquals(changes["removed"], [0])
+        # Indexes are not reused, so a client never mixes up two torrents
+        self.assertEquals(changes["added"], {"def": 1})
+        self.assertEquals(changes["columns"]["name"], [[1], ["d"]])
+
+    def test_changed_torrents_only(self):
+        self.subscription.update({
+            "abc": {"name": "a", "progress": 0.0},
+            "def": {"name": "d", "progress": 0.0},
+        }, ["abc", "def"], 5)
+        self.assertEquals(self.subscription.version, 5)
+
+        # Only the changed torrents are passed, the others still match
+        changes = self.subscription.update({"def": {"name": "d", "progress": 50.0}}, ["abc", "def"], 6)
+        self.assertEquals(changes, {
+            "added": {},
+            "removed": [],
+            "columns": {"progress": [[1], [50.0]]}
+        })
+        self.assertEquals(self.subscription.update({}, ["def"], 7)["removed"], [0])
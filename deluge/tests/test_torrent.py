@@ -47,9 +47,6 @@ def setUp(self):
         return component.start()
 
     def tearDown(self):
-        if self.torrent:
-            self.torrent.prev_status_cleanup_loop.stop()
-
         def on_shutdown(result):
             component._ComponentRegistry.components = {}
         return component.shutdown().addCallback(on_shutdown)
@@ -125,3 +122,23 @@ def test_set_prioritize_first_last_false(self):
             self.assertEquals(priorities[i], 1)
 
         #self.print_priority_list(priorities)
+
+    def test_get_status(self):
+        atp = self.get_torrent_atp("test.torrent")
+        handle = self.session.add_torrent(atp)
+        self.torrent = Torrent(handle, {})
+
+        status = self.torrent.get_status(["name", "progress", "hash"])
+        self.assertEquals(status, {
+            "name": self.torrent.get_name(),
+            "progress": handle.status().progress * 100,
+            "hash": self.torrent.torrent_id
+        })
+        # An unknown key raises a KeyError, as it did before the extractors
+        self.assertRaises(KeyError, self.torrent.get_status, ["name", "not_a_key"])
+        # All the keys are returned when none are given
+        self.assertEquals(sorted(self.torrent.get_status([]).keys()),
+                          sorted(deluge.core.torrent.STATUS_FIELDS.keys()))
+        # The extractor is only compiled once for the same keys
+        self.assertTrue(deluge.core.torrent.get_status_extractor(("name", "hash")) is
+                        deluge.core.torrent.get_status_extractor(("name", "hash")))
@@ -35,9 +35,12 @@
 
 from twisted.trial import unittest
 
-from deluge.transfer import DelugeTransferProtocol
+from deluge.transfer import DelugeTransferProtocol, encode_message, MESSAGE_HEADER_SIZE
+from deluge.transfer import FLAG_COMPRESSED, is_loopback
 
 import base64
+import os
+import time
 
 import deluge.rencode as rencode
 
@@ -49,6 +52,7 @@ def __init__(self):
         self.messages_out = []
         self.messages_in = []
         self.packet_count = 0
+        self.connection_lost = False
 
     def write(self, message):
         """
@@ -57,6 +61,12 @@ def write(self, message):
         """
         self.messages_out.append(message)
 
+    def loseConnection(self):
+        """
+        This simulates the loseConnection method of the self.transport in DelugeTransferProtocol.
+        """
+        self.connection_lost = True
+
     def message_received(self, message):
         """
         This method overrides message_received is DelugeTransferProtocol and is
@@ -97,11 +107,8 @@ def dataReceived_old_protocol(self, data):
             print "Current data:", len(data)
 
             if self._message_length == 0:
-                # handle_new_message uses _buffer so set data to _buffer.
-                self._buffer = data
-                self._handle_new_message()
-                data = self._buffer
-                self._buffer = None
+                self._handle_new_message(data[:MESSAGE_HEADER_SIZE])
+                data = data[MESSAGE_HEADER_SIZE:]
                 self.packet_count = 1
                 print "New message of length:", self._message_length
 
@@ -164,6 +171,64 @@ def test_send_one_message(self):
         base64_encoded = base64.b64encode(messages)
         self.assertEquals(base64_encoded, self.msg1_expected_compressed_base64)
 
+    def test_send_encoded_frame(self):
+        """
+        Encode one message once and send it with transfer_frame, which is what
+        the RPCServer does when emitting an event to several clients.
+
+        """
+        frame = encode_message(self.msg1)
+        self.assertEquals(base64.b64encode(frame), self.msg1_expected_compressed_base64)
+
+        other = TransferTestClass()
+        self.transfer.transfer_frame(frame)
+        other.transfer_frame(frame)
+        self.assertEquals(self.transfer.get_messages_out_joined(), frame)
+        self.assertEquals(other.get_messages_out_joined(), frame)
+        self.assertEquals(self.transfer.get_bytes_sent(), len(frame))
+
+    def test_send_uncompressed_message(self):
+        """
+        Once compression is negotiated, messages below the threshold and all
+        messages with a level of 0 are sent without the compressed flag.
+
+        """
+        self.transfer.set_compression(6, 1024)
+        self.transfer.transfer_message(self.msg1)
+        frame = self.transfer.get_messages_out_joined()
+        self.assertFalse(ord(frame[0]) & FLAG_COMPRESSED)
+        self.assertEquals(frame[0], "@")
+        self.assertEquals(frame[MESSAGE_HEADER_SIZE:], rencode.dumps(self.msg1))
+
+        # Above the threshold the message is compressed like before
+        self.transfer.set_compression(6, 10)
+        self.assertEquals(base64.b64encode(encode_message(self.msg1, self.transfer.compression)),
+                          self.msg1_expected_compressed_base64)
+
+        self.transfer.set_compression(0)
+        frame = encode_message((1, "x" * 4096), self.transfer.compression)
+        self.assertEquals(len(frame), MESSAGE_HEADER_SIZE + len(rencode.dumps((1, "x" * 4096))))
+
+    def test_receive_uncompressed_message(self):
+        """
+        Receive compressed and uncompressed messages on the same connection.
+
+        """
+        self.transfer.dataReceived(encode_message(self.msg1, (0, 0)) +
+                                   encode_message(self.msg2) +
+                                   encode_message(self.msg1, (9, 0)))
+        messages = self.transfer.get_messages_in()
+        self.assertEquals(len(messages), 3)
+        self.assertEquals(rencode.dumps(self.msg1), rencode.dumps(messages[0]))
+        self.assertEquals(rencode.dumps(self.msg2), rencode.dumps(messages[1]))
+        self.assertEquals(rencode.dumps(self.msg1), rencode.dumps(messages[2]))
+
+    def test_is_loopback(self):
+        for host in ("127.0.0.1", "127.1.2.3", "localhost", "::1"):
+            self.assertTrue(is_loopback(host))
+        for host in ("192.168.0.1", "example.com", "::ffff:10.0.0.1"):
+            self.assertFalse(is_loopback(host))
+
     def test_receive_one_message(self):
         """
         Receive one message and test that it has been sent to the
@@ -323,6 +388,58 @@ def test_receive_middle_of_header(self):
         self.assertEquals(rencode.dumps(self.msg2), rencode.dumps(message2))
 
 
+    def test_receive_big_message_in_parts(self):
+        """
+        Receive a message of a few MB in small parts, as a big status reply
+        arrives from the network.
+
+        """
+        message = (1, 2, os.urandom(2 * 1024 * 1024).encode("hex"))
+        frame = encode_message(message)
+        for d in self.receive_parts_helper(frame, 4096):
+            if self.transfer.get_bytes_recv() < len(frame):
+                self.assertEquals(len(self.transfer.get_messages_in()), 0)
+        self.assertEquals(len(self.transfer.get_messages_in()), 1)
+        self.assertTrue(self.transfer.get_messages_in()[0] == message)
+        self.assertEquals(len(self.transfer._buffer), 0)
+
+    def test_receive_too_big_message(self):
+        """
+        A header announcing a payload larger than max_message_size closes
+        the connection instead of buffering the data.
+
+        """
+        self.transfer.max_message_size = 1024
+        frame = encode_message((1, 2, os.urandom(2048)))
+        self.transfer.dataReceived(frame[:100])
+        self.assertTrue(self.transfer.connection_lost)
+        self.assertEquals(len(self.transfer.get_messages_in()), 0)
+        self.assertEquals(self.transfer._message_length, 0)
+        self.assertEquals(len(self.transfer._buffer), 0)
+
+    # Remove underscore to enable the benchmark, or run it directly:
+    # tests $ trial test_transfer.DelugeTransferProtocolTestCase._test_receive_throughput
+    def _test_receive_throughput(self):
+        """
+        Measures how fast frames of 1 to 50 MB are received in small parts.
+
+        """
+        print
+        for size in (1, 5, 10, 25, 50):
+            frame = encode_message(os.urandom(size * 1024 * 1024))
+            transfer = TransferTestClass()
+            # Keep the benchmark to the buffering, not the decoding
+            transfer._handle_complete_message = transfer.messages_in.append
+            packet_size = 16 * 1024
+            parts = [frame[i:i + packet_size] for i in xrange(0, len(frame), packet_size)]
+            start = time.time()
+            for part in parts:
+                transfer.dataReceived(part)
+            elapsed = time.time() - start
+            self.assertEquals(len(transfer.messages_in), 1)
+            print "%2d MB frame in %d parts: %.3fs (%.1f MB/s)" % (
+                size, len(parts), elapsed, size / max(elapsed, 0.000001))
+
     # Needs file containing big data structure e.g. like thetorrent list as it is transfered by the daemon
     #def test_simulate_big_transfer(self):
     #    filename = "../deluge.torrentlist"
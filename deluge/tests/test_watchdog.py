@@ -0,0 +1,39 @@
+import time
+
+from twisted.internet import defer, reactor, task
+from twisted.trial import unittest
+
+import deluge.component as component
+from deluge.core.watchdog import Watchdog
+
+class BlockingComponent(component.Component):
+    def __init__(self):
+        component.Component.__init__(self, "BlockingComponent")
+
+    def update(self):
+        time.sleep(0.4)
+
+class WatchdogTestCase(unittest.TestCase):
+    def setUp(self):
+        self.watchdog = Watchdog(threshold=0.1, interval=0.02)
+        return component.start(["Watchdog"])
+
+    def tearDown(self):
+        def on_shutdown(result):
+            component._ComponentRegistry.components = {}
+        return component.shutdown().addCallback(on_shutdown)
+
+    @defer.inlineCallbacks
+    def test_stall(self):
+        self.assertEquals(self.watchdog.get_reports(), [])
+        # Let the watchdog see the reactor run
+        yield task.deferLater(reactor, 0.1, lambda: None)
+        self.assertEquals(self.watchdog.get_reports(), [])
+
+        BlockingComponent().update()
+        yield task.deferLater(reactor, 0.1, lambda: None)
+        reports = self.watchdog.get_reports()
+        self.assertEquals(len(reports), 1)
+        self.assertTrue(reports[0]["duration"] >= 0.4)
+        self.assertEquals(reports[0]["activity"], ["Component.update BlockingComponent"])
+        self.assertTrue("time.sleep(0.4)" in reports[0]["stacks"][0][0])
@@ -0,0 +1,81 @@
+from twisted.trial import unittest
+
+import deluge.component as component
+import deluge.ui.web.json_api as json_api
+from deluge.ui.web.json_api import JSON, WebApi, diff_torrents_status
+
+import common
+
+class FakeAuth(component.Component):
+    def __init__(self):
+        component.Component.__init__(self, "Auth")
+        self.session_data = {}
+
+    def get_session_data(self, session_id):
+        return self.session_data.setdefault(session_id, {})
+
+def make_ui_info(torrents, filters=None):
+    return {"torrents": torrents, "removed": [], "filters": filters or {"state": [["All", len(torrents)]]},
+            "revision": None, "since": None}
+
+class WebApiTestCase(unittest.TestCase):
+    def setUp(self):
+        common.set_tmp_config_dir()
+        self.auth = FakeAuth()
+        JSON()
+        self.web = WebApi()
+
+    def tearDown(self):
+        component._ComponentRegistry.components = {}
+
+    def test_diff_torrents_status(self):
+        same = {"name": "same", "progress": 1.0}
+        old = {"a": same, "b": {"name": "b", "progress": 0.5}, "c": {"name": "c"}}
+        new = {"a": same, "b": {"name": "b", "progress": 0.6}, "d": {"name": "d"}}
+        self.assertEquals(diff_torrents_status(old, new), (
+            {"b": {"progress": 0.6}, "d": {"name": "d"}}, ["c"]))
+
+        # An unchanged status that is not the same dict is not sent again
+        self.assertEquals(diff_torrents_status(old, dict(old, b=dict(old["b"]))), ({}, []))
+
+    def test_diff_ui_info(self):
+        keys = ["name", "progress"]
+        ui_info = make_ui_info({"a": {"name": "a", "progress": 0.0}})
+        self.web._diff_ui_info("session", ui_info, keys, {}, None)
+        first = ui_info["revision"]
+        self.assertEquals(ui_info["since"], None)
+        self.assertEquals(ui_info["torrents"], {"a": {"name": "a", "progress": 0.0}})
+
+        ui_info = make_ui_info({"a": {"name": "a", "progress": 0.5}, "b": {"name": "b", "progress": 0.0}})
+        self.web._diff_ui_info("session", ui_info, keys, {}, first)
+        second = ui_info["revision"]
+        self.assertEquals(ui_info["since"], first)
+        self.assertEquals(ui_info["torrents"], {"a": {"progress": 0.5}, "b": {"name": "b", "progress": 0.0}})
+        self.assertEquals(ui_info["removed"], [])
+        self.assertEquals(ui_info["filters"], {"state": [["All", 2]]})
+
+        ui_info = make_ui_info({"b": {"name": "b", "progress": 0.0}}, {"state": [["All", 2]]})
+        self.web._diff_ui_info("session", ui_info, keys, {}, second)
+        self.assertEquals(ui_info["torrents"], {})
+        self.assertEquals(ui_info["removed"], ["a"])
+        self.assertEquals(ui_info["filters"], None)
+
+        # A revision already used, for other filters or from another session
+        # gets the full information
+        for session_id, filter_dict, revision in (("session", {}, second),
+                                                  ("session", {"state": "Seeding"}, ui_info["revision"]),
+                                                  ("other", {}, first)):
+            ui_info = make_ui_info({"b": {"name": "b", "progress": 0.0}})
+            self.web._diff_ui_info(session_id, ui_info, keys, filter_dict, revision)
+            self.assertEquals(ui_info["since"], None)
+            self.assertEquals(ui_info["torrents"], {"b": {"name": "b", "progress": 0.0}})
+
+    def test_diff_ui_info_revisions(self):
+        revisions = []
+        for i in xrange(json_api.UI_REVISIONS + 1):
+            ui_info = make_ui_info({})
+            self.web._diff_ui_info("session", ui_info, [], {}, None)
+            revisions.append(ui_info["revision"])
+
+        # Only the latest revisions of the session are kept
+        self.assertEquals(sorted(self.auth.session_data["session"]["ui_revisions"]), revisions[1:])
@@ -0,0 +1,185 @@
+import struct
+
+from twisted.internet import defer, protocol, reactor
+from twisted.trial import unittest
+from twisted.web import resource, server
+
+import deluge.component as component
+import deluge.ui.web.json_api
+from deluge.ui.web.json_api import EventQueue
+from deluge.ui.web.websocket import WebSocket, accept_key, decode_frame, encode_frame
+from deluge.ui.web.websocket import OPCODE_CLOSE, OPCODE_TEXT
+from deluge.common import json
+
+class FakeClient(object):
+    def __init__(self):
+        self.handlers = {}
+
+    def register_event_handler(self, event, handler):
+        self.handlers[event] = handler
+
+    def deregister_event_handler(self, event, handler):
+        del self.handlers[event]
+
+class FakeAuth(component.Component):
+    def __init__(self):
+        component.Component.__init__(self, "Auth")
+
+    def check_request(self, request, method=None, level=None):
+        request.session_id = "session"
+
+class FakeJSON(component.Component):
+    def __init__(self):
+        component.Component.__init__(self, "JSON")
+
+    def _handle_request(self, request):
+        request.json = json.loads(request.json)
+        return request.json["id"], defer.succeed(request.json["params"][0] * 2), None
+
+class FakeWeb(component.Component):
+    def __init__(self):
+        component.Component.__init__(self, "Web")
+        self.event_queue = EventQueue()
+
+def mask_frame(opcode, payload):
+    mask = [1, 2, 3, 4]
+    return struct.pack("!BB", 0x80 | opcode, 0x80 | len(payload)) + \
+        "".join(chr(m) for m in mask) + \
+        "".join(chr(ord(c) ^ mask[i % 4]) for i, c in enumerate(payload))
+
+class WebSocketClient(protocol.Protocol):
+    def __init__(self):
+        self.data = ""
+        self.waiting = None
+
+    def dataReceived(self, data):
+        self.data += data
+        if self.waiting:
+            d, self.waiting = self.waiting, None
+            d.callback(None)
+
+    def wait(self):
+        self.waiting = defer.Deferred()
+        return self.waiting
+
+    def read_message(self):
+        # The frames sent by the server are not masked
+        length = ord(self.data[1])
+        message = json.loads(self.data[2:2 + length])
+        self.data = self.data[2 + length:]
+        return message
+
+class EventQueueTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = deluge.ui.web.json_api.client
+        deluge.ui.web.json_api.client = FakeClient()
+        self.queue = EventQueue()
+
+    def tearDown(self):
+        deluge.ui.web.json_api.client = self.client
+
+    def test_get_events_on_arrival(self):
+        self.queue.add_listener("listener", "TorrentAddedEvent")
+        d = self.queue.get_events("listener")
+        self.assertFalse(d.called)
+        deluge.ui.web.json_api.client.handlers["TorrentAddedEvent"]("abc", False)
+        self.assertEquals(d.result, [("TorrentAddedEvent", ("abc", False))])
+
+        deluge.ui.web.json_api.client.handlers["TorrentAddedEvent"]("def", False)
+        self.assertEquals(self.queue.get_events("listener"), [("TorrentAddedEvent", ("def", False))])
+
+    def test_remove_listener(self):
+        self.queue.add_listener("listener", "TorrentAddedEvent")
+        self.queue.add_listener("listener", "TorrentRemovedEvent")
+        deluge.ui.web.json_api.client.handlers["TorrentAddedEvent"]("abc", False)
+        self.queue.remove_listener("listener", "TorrentAddedEvent")
+        self.assertEquals(self.queue.get_listener_events("listener"), ["TorrentRemovedEvent"])
+        # The pending events are dropped with the last event of the listener
+        self.queue.remove_listener("listener", "TorrentRemovedEvent")
+        self.assertEquals(self.queue.get_listener_events("listener"), [])
+        self.assertFalse(isinstance(self.queue.get_events("listener", timeout=None), list))
+
+    def test_get_events_timeout(self):
+        self.queue.add_listener("listener", "TorrentAddedEvent")
+        d = self.queue.get_events("listener", timeout=0.01)
+        d.addCallback(self.assertEquals, None)
+        return d
+
+class WebSocketTestCase(unittest.TestCase):
+    def setUp(self):
+        self.client = deluge.ui.web.json_api.client
+        deluge.ui.web.json_api.client = FakeClient()
+        FakeAuth()
+        FakeJSON()
+        self.web = FakeWeb()
+        root = resource.Resource()
+        root.putChild("websocket", WebSocket())
+        self.port = reactor.listenTCP(0, server.Site(root), interface="127.0.0.1")
+
+    def tearDown(self):
+        deluge.ui.web.json_api.client = self.client
+        component._ComponentRegistry.components = {}
+        return self.port.stopListening()
+
+    def test_frames(self):
+        self.assertEquals(accept_key("dGhlIHNhbXBsZSBub25jZQ=="), "s3pPLMBiTxaQ9kYGzzhZRbK+xOo=")
+        frame = mask_frame(OPCODE_TEXT, "hello")
+        self.assertEquals(decode_frame(frame), (True, OPCODE_TEXT, "hello", len(frame)))
+        self.assertEquals(decode_frame(frame[:-1]), None)
+        self.assertRaises(ValueError, decode_frame, encode_frame(OPCODE_TEXT, "hello"))
+        self.assertEquals(len(encode_frame(OPCODE_TEXT, "x" * 70000)), 70010)
+
+    @defer.inlineCallbacks
+    def test_websocket(self):
+        self.web.event_queue.add_listener("session", "TorrentAddedEvent")
+        self.protocol = yield protocol.ClientCreator(reactor, WebSocketClient).connectTCP(
+            "127.0.0.1", self.port.getHost().port)
+        self.protocol.transport.write("\r\n".join([
+            "GET /websocket HTTP/1.1",
+            "Host: localhost",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==",
+            "Sec-WebSocket-Version: 13",
+            "", ""]) + mask_frame(OPCODE_TEXT, json.dumps({"method": "web.double", "params": [21], "id": 1})))
+
+        while "\r\n\r\n" not in self.protocol.data or len(self.protocol.data.split("\r\n\r\n", 1)[1]) < 2:
+            yield self.protocol.wait()
+        headers, self.protocol.data = self.protocol.data.split("\r\n\r\n", 1)
+        self.assertTrue(headers.startswith("HTTP/1.1 101"))
+        self.assertTrue("Sec-WebSocket-Accept: s3pPLMBiTxaQ9kYGzzhZRbK+xOo=" in headers)
+        self.assertEquals(self.protocol.read_message(), {"id": 1, "result": 42, "error": None})
+
+        # The events are pushed as they arrive
+        deluge.ui.web.json_api.client.handlers["TorrentAddedEvent"]("abc", False)
+        yield self.protocol.wait()
+        self.assertEquals(self.protocol.read_message(), {
+            "method": "events", "params": [[["TorrentAddedEvent", ["abc", False]]]], "id": None})
+        # The socket has its own listener, the session still gets the events
+        self.assertEquals(self.web.event_queue.get_events("session"), [("TorrentAddedEvent", ("abc", False))])
+
+        # Once closed, the connection no longer takes the events
+        self.protocol.transport.write(mask_frame(OPCODE_CLOSE, struct.pack("!H", 1000)))
+        yield self.protocol.wait()
+        deluge.ui.web.json_api.client.handlers["TorrentAddedEvent"]("def", False)
+        self.assertEquals(self.web.event_queue.get_events("session"), [("TorrentAddedEvent", ("def", False))])
+        self.assertEquals(self.web.event_queue.get_listener_events("session"), ["TorrentAddedEvent"])
+
+    @defer.inlineCallbacks
+    def test_cross_origin(self):
+        self.protocol = yield protocol.ClientCreator(reactor, WebSocketClient).connectTCP(
+            "127.0.0.1", self.port.getHost().port)
+        self.protocol.transport.write("\r\n".join([
+            "GET /websocket HTTP/1.1",
+            "Host: localhost:8112",
+            "Origin: http://example.com",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Sec-WebSocket-Key: dGhlIHNhbXBsZSBub25jZQ==",
+            "Sec-WebSocket-Version: 13",
+            "", ""]))
+
+        while "\r\n" not in self.protocol.data:
+            yield self.protocol.wait()
+        self.assertTrue(self.protocol.data.startswith("HTTP/1.1 403"))
+        self.protocol.transport.loseConnection()
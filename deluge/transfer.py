@@ -34,19 +34,98 @@
 #
 #
 
+# Use the fastest rencode available, the native one built with deluge gives
+# the same output as the pure python deluge.rencode
 try:
-    import rencode
+    import deluge._rencode as rencode
 except ImportError:
-    import deluge.rencode as rencode
+    try:
+        import rencode
+    except ImportError:
+        import deluge.rencode as rencode
 
 import zlib
 import struct
+from collections import deque
 
 from twisted.internet.protocol import Protocol
 
 from deluge.log import LOG as log
 
 MESSAGE_HEADER_SIZE = 5
+# The largest payload accepted, anything bigger is treated as a broken stream
+MAX_MESSAGE_SIZE = 256 * 1024 * 1024
+
+# The first byte of the header.  The flag bit is set when the payload is zlib
+# compressed, which makes the header of a compressed message "D", the only
+# header older versions know about.
+MESSAGE_MAGIC = 0x40
+FLAG_COMPRESSED = 0x04
+
+# The default compression settings once the peer accepts uncompressed messages
+COMPRESSION_LEVEL = 6
+COMPRESSION_THRESHOLD = 512
+
+LOOPBACK_HOSTS = ("localhost", "::1", "::ffff:127.0.0.1")
+
+def is_loopback(host):
+    """
+    Checks if the host is a loopback address.
+
+    :param host: the host name or ip address
+    :type host: string
+
+    :returns: True if the host is a loopback address
+    :rtype: bool
+
+    """
+    return host in LOOPBACK_HOSTS or host.startswith("127.")
+
+def encode_message(data, compression=None):
+    """
+    Serializes and compresses the data, and prepends the message header.
+
+    The header contains the flags and the length of the payload as a signed
+    integer.
+
+    :param data: data in a data structure serializable by rencode.
+    :param compression: a (level, threshold) tuple, payloads smaller than
+        threshold bytes are not compressed and a level of 0 disables the
+        compression.  If None, the payload is always compressed with the
+        default level, which is the only thing older peers understand.
+    :type compression: tuple
+
+    :returns: the message as it is sent on the wire
+    :rtype: str
+
+    """
+    return encode_payload(rencode.dumps(data), compression)
+
+def encode_payload(payload, compression=None):
+    """
+    Compresses the data serialized with rencode, and prepends the message
+    header.  See :func:`encode_message`.
+
+    :param payload: the serialized data
+    :type payload: str
+    :param compression: the compression, see :func:`encode_message`
+    :type compression: tuple
+
+    :returns: the message as it is sent on the wire
+    :rtype: str
+
+    """
+    flags = MESSAGE_MAGIC
+    if compression is None:
+        payload = zlib.compress(payload)
+        flags |= FLAG_COMPRESSED
+    else:
+        level, threshold = compression
+        if level and len(payload) >= threshold:
+            payload = zlib.compress(payload, level)
+            flags |= FLAG_COMPRESSED
+    # Store length as a signed integer (using 4 bytes). "!" denotes network byte order.
+    return struct.pack("!Bi", flags, len(payload)) + payload
 
 class DelugeTransferProtocol(Protocol):
     """
@@ -55,9 +134,17 @@ class DelugeTransferProtocol(Protocol):
     the length of the data to be transfered (payload).
 
     """
+    max_message_size = MAX_MESSAGE_SIZE
+    # The compression settings used for the messages sent, see encode_message
+    compression = None
+
     def __init__(self):
-        self._buffer = ""
+        # The received chunks not handled yet, the first one starting at _offset
+        self._buffer = deque()
+        self._buffer_length = 0
+        self._offset = 0
         self._message_length = 0
+        self._message_compressed = True
         self._bytes_received = 0
         self._bytes_sent = 0
 
@@ -66,20 +153,56 @@ def transfer_message(self, data):
         Transfer the data.
 
         The data will be serialized and compressed before being sent.
-        First a header is sent - containing the length of the compressed payload
+        First a header is sent - containing the flags and the length of the payload
         to come as a signed integer. After the header, the payload is transfered.
 
         :param data: data to be transfered in a data structure serializable by rencode.
 
+        :returns: the size of the serialized data and of the message sent
+        :rtype: tuple
+
         """
-        compressed = zlib.compress(rencode.dumps(data))
-        size_data = len(compressed)
-        # Store length as a signed integer (using 4 bytes). "!" denotes network byte order.
-        payload_len = struct.pack("!i", size_data)
-        header = "D" + payload_len
-        self._bytes_sent += len(header) + len(compressed)
-        self.transport.write(header)
-        self.transport.write(compressed)
+        payload = rencode.dumps(data)
+        frame = encode_payload(payload, self.compression)
+        self.transfer_frame(frame)
+        return len(payload), len(frame)
+
+    def set_compression(self, level=COMPRESSION_LEVEL, threshold=COMPRESSION_THRESHOLD):
+        """
+        Sets how the messages sent are compressed.  This may only be used
+        once the peer is known to accept uncompressed messages, ie. after it
+        was negotiated at login.
+
+        :param level: the zlib compression level, 0 disables the compression
+        :type level: int
+        :param threshold: messages smaller than this are not compressed
+        :type threshold: int
+
+        """
+        self.compression = (level, threshold)
+
+    def is_loopback(self):
+        """
+        Checks if the peer is connected through the loopback interface.
+
+        :returns: True if the peer is on this machine
+        :rtype: bool
+
+        """
+        return is_loopback(self.transport.getPeer().host)
+
+    def transfer_frame(self, frame):
+        """
+        Transfer a message that has already been encoded with :func:`encode_message`.
+
+        This allows the same message to be sent to several clients while only
+        serializing and compressing it once.
+
+        :param frame: the header and payload as returned by :func:`encode_message`.
+
+        """
+        self._bytes_sent += len(frame)
+        self.transport.write(frame)
 
     def dataReceived(self, data):
         """
@@ -89,58 +212,102 @@ def dataReceived(self, data):
                      a messsage.
 
         Global variables:
-            _buffer         - contains the data received
+            _buffer         - contains the chunks of data received
             _message_length - the length of the payload of the current message.
 
+        The chunks are only joined once a complete header or payload has
+        arrived, so a large message received in many parts is not copied
+        again for every part.
+
         """
-        self._buffer += data
+        self._buffer.append(data)
+        self._buffer_length += len(data)
         self._bytes_received += len(data)
 
-        while len(self._buffer) >= MESSAGE_HEADER_SIZE:
+        while True:
             if self._message_length == 0:
-                self._handle_new_message()
+                if self._buffer_length < MESSAGE_HEADER_SIZE:
+                    break
+                if not self._handle_new_message(self._read_buffer(MESSAGE_HEADER_SIZE)):
+                    break
             # We have a complete packet
-            if len(self._buffer) >= self._message_length:
-                self._handle_complete_message(self._buffer[:self._message_length])
-                # Remove message data from buffer
-                self._buffer = self._buffer[self._message_length:]
-                self._message_length = 0
-            else:
+            if self._buffer_length < self._message_length:
                 break
+            message = self._read_buffer(self._message_length)
+            self._message_length = 0
+            self._handle_complete_message(message)
 
-    def _handle_new_message(self):
+    def _read_buffer(self, size):
+        """
+        Removes size bytes from the start of the buffer and returns them.
+        """
+        chunks = []
+        needed = size
+        while needed:
+            chunk = self._buffer[0]
+            available = len(chunk) - self._offset
+            if available <= needed:
+                chunks.append(chunk[self._offset:] if self._offset else chunk)
+                self._buffer.popleft()
+                self._offset = 0
+                needed -= available
+            else:
+                chunks.append(chunk[self._offset:self._offset + needed])
+                self._offset += needed
+                needed = 0
+        self._buffer_length -= size
+        return chunks[0] if len(chunks) == 1 else "".join(chunks)
+
+    def _clear_buffer(self):
+        self._buffer.clear()
+        self._buffer_length = 0
+        self._offset = 0
+        self._message_length = 0
+
+    def _handle_new_message(self, header):
         """
         Handle the start of a new message. This method is called only when the
-        beginning of the buffer contains data from a new message (i.e. the header).
+        header of a new message has been received.
+
+        :param header: the MESSAGE_HEADER_SIZE bytes of the header
+
+        :returns: False if the header is invalid, the buffer is cleared then
+        :rtype: bool
 
         """
         try:
-            # Read the first bytes of the message (MESSAGE_HEADER_SIZE bytes)
-            header = self._buffer[:MESSAGE_HEADER_SIZE]
-            payload_len = header[1:MESSAGE_HEADER_SIZE]
-            if header[0] != 'D':
-                raise Exception("Invalid header format. First byte is %d" % ord(header[0]))
-            # Extract the length stored as a signed integer (using 4 bytes)
-            self._message_length = struct.unpack("!i", payload_len)[0]
+            flags, self._message_length = struct.unpack("!Bi", header)
+            if flags & ~FLAG_COMPRESSED != MESSAGE_MAGIC:
+                raise Exception("Invalid header format. First byte is %d" % flags)
+            self._message_compressed = bool(flags & FLAG_COMPRESSED)
             if self._message_length < 0:
                 raise Exception("Message length is negative: %d" % self._message_length)
-            # Remove the header from the buffer
-            self._buffer = self._buffer[MESSAGE_HEADER_SIZE:]
         except Exception, e:
             log.warn("Error occured when parsing message header: %s." % str(e))
             log.warn("This version of Deluge cannot communicate with the sender of this data.")
-            self._message_length = 0
-            self._buffer = ""
+            self._clear_buffer()
+            return False
+
+        if self._message_length > self.max_message_size:
+            log.error("Message of %d bytes is larger than the maximum of %d bytes, "
+                      "closing the connection.", self._message_length, self.max_message_size)
+            self._clear_buffer()
+            self.transport.loseConnection()
+            return False
+        return True
 
     def _handle_complete_message(self, data):
         """
         Handles a complete message as it is transfered on the network.
 
-        :param data: a zlib compressed string encoded with rencode.
+        :param data: a string encoded with rencode, zlib compressed if the
+            header has the compressed flag.
 
         """
         try:
-            self.message_received(rencode.loads(zlib.decompress(data), decode_utf8=True))
+            if self._message_compressed:
+                data = zlib.decompress(data)
+            self.message_received(rencode.loads(data, decode_utf8=True))
         except Exception, e:
             log.warn("Failed to decompress (%d bytes) and load serialized data "\
                      "with rencode: %s" % (len(data), str(e)))
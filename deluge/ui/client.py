@@ -35,6 +35,7 @@
 #
 
 import logging
+from collections import Iterator
 from twisted.internet.protocol import ClientFactory
 from twisted.internet import reactor, ssl, defer
 import sys
@@ -43,11 +44,13 @@
 import deluge.common
 from deluge import error
 from deluge.event import known_events
-from deluge.transfer import DelugeTransferProtocol
+from deluge.transfer import DelugeTransferProtocol, COMPRESSION_LEVEL
 
 RPC_RESPONSE = 1
 RPC_ERROR = 2
 RPC_EVENT = 3
+RPC_EVENT_BATCH = 4
+RPC_RESPONSE_PART = 5
 
 log = logging.getLogger(__name__)
 
@@ -65,6 +68,10 @@ class DelugeRPCRequest(object):
     method = None
     args = None
     kwargs = None
+    # Called with each part of a streamed response
+    part_handler = None
+    # The parts received so far when there is no part_handler
+    parts = None
 
     def __repr__(self):
         """
@@ -101,6 +108,10 @@ class DelugeRPCProtocol(DelugeTransferProtocol):
 
     def connectionMade(self):
         self.__rpc_requests = {}
+        # The requests waiting to be sent together at the end of this
+        # reactor iteration
+        self.__pending_requests = []
+        self.__flush_call = None
         # Set the protocol in the daemon so it can send data
         self.factory.daemon.protocol = self
         # Get the address of the daemon that we've connected to
@@ -121,6 +132,13 @@ def message_received(self, request):
         if type(request) is not tuple:
             log.debug("Received invalid message: type is not tuple")
             return
+
+        if request and request[0] == RPC_EVENT_BATCH:
+            # A batch of RPCEvents, handle them in the order they were emitted
+            for event, args in request[1]:
+                self.__handle_event(event, args)
+            return
+
         if len(request) < 3:
             log.debug("Received invalid message: number of items in "
                       "response is %s", len(request))
@@ -129,24 +147,28 @@ def message_received(self, request):
         message_type = request[0]
 
         if message_type == RPC_EVENT:
-            event = request[1]
-            #log.debug("Received RPCEvent: %s", event)
-            # A RPCEvent was received from the daemon so run any handlers
-            # associated with it.
-            if event in self.factory.event_handlers:
-                for handler in self.factory.event_handlers[event]:
-                    reactor.callLater(0, handler, *request[2])
+            self.__handle_event(request[1], request[2])
             return
 
         request_id = request[1]
 
+        if message_type == RPC_RESPONSE_PART:
+            self.__handle_part(self.__rpc_requests[request_id], request[2])
+            return
+
         # We get the Deferred object for this request_id to either run the
         # callbacks or the errbacks dependent on the response from the daemon.
         d = self.factory.daemon.pop_deferred(request_id)
 
         if message_type == RPC_RESPONSE:
-            # Run the callbacks registered with this Deferred object
-            d.callback(request[2])
+            r = self.__rpc_requests[request_id]
+            if r.part_handler or r.parts is not None:
+                # The last part of a streamed response
+                self.__handle_part(r, request[2])
+                d.callback(r.parts)
+            else:
+                # Run the callbacks registered with this Deferred object
+                d.callback(request[2])
         elif message_type == RPC_ERROR:
             # Recreate exception and errback'it
             exception_cls = getattr(error, request[2])
@@ -183,9 +205,33 @@ def message_received(self, request):
             d.errback(exception)
         del self.__rpc_requests[request_id]
 
+    def __handle_part(self, request, part):
+        if request.part_handler:
+            if part:
+                request.part_handler(part)
+        elif request.parts is None:
+            request.parts = list(part)
+        else:
+            request.parts.extend(part)
+
+    def __handle_event(self, event, args):
+        #log.debug("Received RPCEvent: %s", event)
+        # A RPCEvent was received from the daemon so run any handlers
+        # associated with it.
+        if event in self.factory.event_handlers:
+            for handler in self.factory.event_handlers[event]:
+                reactor.callLater(0, handler, *args)
+
+    def connectionLost(self, reason):
+        if self.__flush_call and self.__flush_call.active():
+            self.__flush_call.cancel()
+        self.__flush_call = None
+
     def send_request(self, request):
         """
-        Sends a RPCRequest to the server.
+        Sends a RPCRequest to the server.  The requests made during the same
+        reactor iteration are sent together in one message, see
+        :meth:`flush_requests`.
 
         :param request: RPCRequest
 
@@ -196,8 +242,29 @@ def send_request(self, request):
             # out the error for debugging purposes.
             self.__rpc_requests[request.request_id] = request
             #log.debug("Sending RPCRequest %s: %s", request.request_id, request)
-            # Send the request in a tuple because multiple requests can be sent at once
-            self.transfer_message((request.format_message(),))
+            self.__pending_requests.append(request.format_message())
+            if self.__flush_call is None:
+                self.__flush_call = reactor.callLater(0, self.flush_requests)
+        except Exception, e:
+            log.warn("Error occured when sending message:" + str(e))
+
+    def flush_requests(self):
+        """
+        Sends the pending requests to the server.  This is called at the end
+        of the reactor iteration the requests were made in, or earlier to
+        have them sent right away.
+        """
+        if self.__flush_call and self.__flush_call.active():
+            self.__flush_call.cancel()
+        self.__flush_call = None
+        if not self.__pending_requests:
+            return
+
+        requests = tuple(self.__pending_requests)
+        self.__pending_requests = []
+        try:
+            # The server handles the requests of a message in order
+            self.transfer_message(requests)
         except Exception, e:
             log.warn("Error occured when sending message:" + str(e))
 
@@ -258,6 +325,10 @@ def __init__(self, event_handlers=None):
         self.auth_levels_mapping = None
         self.auth_levels_mapping_reverse = None
 
+        self.event_batching = False
+        # The compression level asked for at login, -1 lets the daemon choose
+        self.compression_level = -1
+
     def connect(self, host, port):
         """
         Connects to a daemon at host:port
@@ -286,6 +357,8 @@ def connect(self, host, port):
     def disconnect(self):
         log.debug("sslproxy.disconnect()")
         self.disconnect_deferred = defer.Deferred()
+        # Don't lose the requests made just before disconnecting
+        self.force_call()
         self.__connector.disconnect()
         return self.disconnect_deferred
 
@@ -301,6 +374,24 @@ def call(self, method, *args, **kwargs):
         :return: a twisted.Deferred object that will be activated when a RPCResponse
             or RPCError is received from the daemon
 
+        """
+        return self.stream(method, None, *args, **kwargs)
+
+    def stream(self, method, part_handler, *args, **kwargs):
+        """
+        Makes a RPCRequest to a method returning an iterator, and has the
+        items passed to part_handler as the parts of the response arrive.
+
+        :params method: str, the method to call in the form of 'component.method'
+        :params part_handler: the function called with each list of items
+            received, if None the items are collected and the Deferred fires
+            with all of them
+        :params args: the arguments to call the remote method with
+        :params kwargs: the keyword arguments to call the remote method with
+
+        :return: a twisted.Deferred object that will be activated when the
+            last part or a RPCError is received from the daemon
+
         """
         # Create the DelugeRPCRequest to pass to protocol.send_request()
         request = DelugeRPCRequest()
@@ -308,6 +399,7 @@ def call(self, method, *args, **kwargs):
         request.method = method
         request.args = args
         request.kwargs = kwargs
+        request.part_handler = part_handler
         # Send the request to the server
         self.protocol.send_request(request)
         # Create a Deferred object to return and add a default errback to print
@@ -323,6 +415,13 @@ def call(self, method, *args, **kwargs):
 
         return d
 
+    def force_call(self):
+        """
+        Sends the requests waiting for the end of this reactor iteration now.
+        """
+        if self.protocol and self.connected:
+            self.protocol.flush_requests()
+
     def pop_deferred(self, request_id):
         """
         Pops a Deferred object.  This is generally called once we receive the
@@ -370,6 +469,23 @@ def deregister_event_handler(self, event, handler):
         if event in self.__factory.event_handlers and handler in self.__factory.event_handlers[event]:
             self.__factory.event_handlers[event].remove(handler)
 
+    def set_event_batching(self, enabled):
+        """
+        Sets whether the daemon should send the events in batches.
+
+        :param enabled: True to receive the events in batches
+        :type enabled: bool
+
+        """
+        self.event_batching = enabled
+        if self.username is not None:
+            self.__request_event_batching()
+
+    def __request_event_batching(self):
+        def on_fail(reason):
+            log.debug("Daemon does not support event batching: %s", reason.value)
+        self.call("daemon.set_event_batching", self.event_batching).addErrback(on_fail)
+
     def __on_connect(self, result):
         log.debug("__on_connect called")
 
@@ -411,7 +527,40 @@ def __on_login(self, result, username):
                 self.__on_auth_levels_mappings
             )
 
-        self.login_deferred.callback(result)
+        if self.event_batching:
+            self.__request_event_batching()
+
+        # Older daemons do not answer unknown methods, so the compression and
+        # streaming are only asked for if the daemon has the methods
+        def on_negotiated(negotiated):
+            self.login_deferred.callback(result)
+
+        d = self.call("daemon.get_method_list")
+        d.addCallback(self.__on_get_method_list)
+        d.addErrback(self.__on_get_method_list_fail)
+        d.addCallback(on_negotiated)
+
+    def __on_get_method_list(self, methods):
+        deferreds = []
+        if "daemon.set_compression" in methods:
+            d = self.call("daemon.set_compression", self.compression_level)
+            deferreds.append(d.addCallback(self.__on_set_compression))
+        if "daemon.set_streaming" in methods:
+            deferreds.append(self.call("daemon.set_streaming", True))
+        return defer.DeferredList(deferreds, consumeErrors=True)
+
+    def __on_get_method_list_fail(self, reason):
+        log.debug("Unable to get the daemon's methods: %s", reason.value)
+
+    def __on_set_compression(self, result):
+        # The daemon negotiates compression, so it is able to receive
+        # uncompressed messages
+        if self.protocol.is_loopback():
+            self.protocol.set_compression(0)
+        elif self.compression_level < 0:
+            self.protocol.set_compression(COMPRESSION_LEVEL)
+        else:
+            self.protocol.set_compression(self.compression_level)
 
     def __on_login_fail(self, result):
         log.debug("_on_login_fail(): %s", result.value)
@@ -475,7 +624,22 @@ def call(self, method, *args, **kwargs):
         else:
             return defer.maybeDeferred(
                 m, *copy.deepcopy(args), **copy.deepcopy(kwargs)
-            )
+            ).addCallback(self.__collect_stream)
+
+    def stream(self, method, part_handler, *args, **kwargs):
+        def on_result(result):
+            if part_handler:
+                if result:
+                    part_handler(result)
+                return None
+            return result
+        return self.call(method, *args, **kwargs).addCallback(on_result)
+
+    def __collect_stream(self, result):
+        # Streamed responses are returned in one go in classic mode
+        if isinstance(result, Iterator):
+            return list(result)
+        return result
 
     def register_event_handler(self, event, handler):
         """
@@ -503,6 +667,14 @@ def deregister_event_handler(self, event, handler):
         """
         self.__daemon.core.eventmanager.deregister_event_handler(event, handler)
 
+    def set_event_batching(self, enabled):
+        # The event handlers are called directly in classic mode
+        pass
+
+    def force_call(self):
+        # The calls are made directly in classic mode
+        pass
+
 class DottedObject(object):
     """
     This is used for dotted name calls to client
@@ -536,6 +708,7 @@ def __init__(self):
         self._daemon_proxy = None
         self.disconnect_callback = None
         self.__started_in_classic = False
+        self.__event_batching = False
 
     def connect(self, host="127.0.0.1", port=58846, username="", password="",
                 skip_authentication=False):
@@ -553,6 +726,7 @@ def connect(self, host="127.0.0.1", port=58846, username="", password="",
 
         self._daemon_proxy = DaemonSSLProxy(dict(self.__event_handlers))
         self._daemon_proxy.set_disconnect_callback(self.__on_disconnect)
+        self._daemon_proxy.set_event_batching(self.__event_batching)
 
         d = self._daemon_proxy.connect(host, port)
 
@@ -712,9 +886,46 @@ def deregister_event_handler(self, event, handler):
         if self._daemon_proxy:
             self._daemon_proxy.deregister_event_handler(event, handler)
 
+    def set_event_batching(self, enabled):
+        """
+        Sets whether the daemon should hold back the events for a short time
+        and send them in batches, with superseded events dropped.  The event
+        handlers are still called once per event.
+
+        :param enabled: bool, True to receive the events in batches
+
+        """
+        self.__event_batching = enabled
+        if self._daemon_proxy:
+            self._daemon_proxy.set_event_batching(enabled)
+
+    def stream(self, method, part_handler, *args, **kwargs):
+        """
+        Calls a daemon method returning an iterator, and has the items passed
+        to part_handler as they are received, so a large response doesn't
+        have to be held in memory all at once.
+
+        :param method: str, the method to call in the form of 'component.method'
+        :param part_handler: the function called with each list of items
+        :param args: the arguments to call the remote method with
+        :param kwargs: the keyword arguments to call the remote method with
+
+        :returns: a Deferred fired once the last part has been received
+
+        """
+        return self._daemon_proxy.stream(method, part_handler, *args, **kwargs)
+
     def force_call(self, block=False):
-        # no-op for now.. we'll see if we need this in the future
-        pass
+        """
+        Sends the calls made during this reactor iteration to the daemon right
+        away instead of at the end of the iteration, when they are sent
+        together in one message.
+
+        :param block: unused, kept for compatibility
+
+        """
+        if self._daemon_proxy:
+            self._daemon_proxy.force_call()
 
     def __getattr__(self, method):
         return DottedObject(self._daemon_proxy, method)
@@ -0,0 +1,89 @@
+#
+# rpcstats.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+from optparse import make_option
+from deluge.ui.console.main import BaseCommand
+from deluge.ui.client import client
+import deluge.common
+import deluge.component as component
+
+class Command(BaseCommand):
+    """Shows the call statistics of the daemon's RPC methods"""
+    option_list = BaseCommand.option_list + (
+            make_option('-s', '--sort', default='p95', dest='sort',
+                        help='Sort the methods by calls, p50, p95, p99 or sent (default p95)'),
+            make_option('-n', '--number', type='int', default=20, dest='number',
+                        help='Show this many methods (default 20)'),
+    )
+
+    usage = "Usage: rpcstats [-s <calls|p50|p95|p99|sent>] [-n <number>]"
+    def handle(self, *args, **options):
+        self.console = component.get("ConsoleUI")
+
+        sort_key = {"sent": "sent_bytes"}.get(options["sort"], options["sort"])
+        if sort_key not in ("calls", "p50", "p95", "p99", "sent_bytes"):
+            self.console.write("{!error!}Unknown sort key: %s" % options["sort"])
+            return
+
+        def on_rpc_stats(stats):
+            self.console.set_batch_write(True)
+            self.console.write("{!info!}Calls in the last %d seconds:" % stats["window"])
+            self.console.write("{!info!}%-40s %8s %6s %6s %9s %9s %9s %10s %10s" % (
+                "Method", "Calls", "Errors", "Active", "p50", "p95", "p99", "Payload", "Sent"))
+            methods = sorted(stats["methods"].items(), key=lambda item: item[1][sort_key], reverse=True)
+            for name, method in methods[:options["number"]]:
+                self.console.write("{!input!}%-40s %8d %6d %6d %8.1fms %8.1fms %8.1fms %10s %10s" % (
+                    name, method["window_calls"], method["errors"], method["in_flight"],
+                    method["p50"] * 1000, method["p95"] * 1000, method["p99"] * 1000,
+                    deluge.common.fsize(method["payload_bytes"]),
+                    deluge.common.fsize(method["sent_bytes"])))
+
+            self.console.write(" ")
+            self.console.write("{!info!}Sessions:")
+            for session_id, session in sorted(stats["sessions"].items()):
+                self.console.write("{!input!}%5s %-20s %8d calls, %10s sent, %10s received" % (
+                    session_id, session["username"], session["calls"],
+                    deluge.common.fsize(session["bytes_sent"]),
+                    deluge.common.fsize(session["bytes_received"])))
+
+            for name, method in sorted(stats["threads"]["methods"].items()):
+                self.console.write("{!info!}Threaded %s: {!input!}%d running, %d queued (max %d)" % (
+                    name, method["running"], method["queued"], method["max_queued"]))
+            self.console.set_batch_write(False)
+
+        d = client.daemon.get_rpc_stats()
+        d.addCallback(on_rpc_stats)
+        return d
@@ -221,6 +221,7 @@ def on_torrents_status(torrents):
 
         # Register some event handlers to keep the torrent list up-to-date
         client.register_event_handler("TorrentAddedEvent", self.on_torrent_added_event)
+        client.register_event_handler("TorrentsAddedEvent", self.on_torrents_added_event)
         client.register_event_handler("TorrentRemovedEvent", self.on_torrent_removed_event)
 
     def update(self):
@@ -981,6 +982,12 @@ def on_torrent_status(status):
             self.torrents.append((event, status["name"]))
         client.core.get_torrent_status(event, ["name"]).addCallback(on_torrent_status)
 
+    def on_torrents_added_event(self, torrent_ids, from_state):
+        def on_torrents_status(status):
+            for torrent_id, torrent_status in status.items():
+                self.torrents.append((torrent_id, torrent_status["name"]))
+        client.core.get_torrents_status({"id": torrent_ids}, ["name"]).addCallback(on_torrents_status)
+
     def on_torrent_removed_event(self, event):
         for index, (tid, name) in enumerate(self.torrents):
             if event == tid:
@@ -434,6 +434,7 @@ def __init__(self):
 
         client.register_event_handler("TorrentStateChangedEvent", self.on_torrentstatechanged_event)
         client.register_event_handler("TorrentAddedEvent", self.on_torrentadded_event)
+        client.register_event_handler("TorrentsAddedEvent", self.on_torrentsadded_event)
         client.register_event_handler("TorrentRemovedEvent", self.on_torrentremoved_event)
         client.register_event_handler("SessionPausedEvent", self.on_sessionpaused_event)
         client.register_event_handler("SessionResumedEvent", self.on_sessionresumed_event)
@@ -757,6 +758,12 @@ def on_torrentadded_event(self, torrent_id, from_state):
         self.add_row(torrent_id)
         self.mark_dirty(torrent_id)
 
+    def on_torrentsadded_event(self, torrent_ids, from_state):
+        torrent_id_column = self.columns["torrent_id"].column_indices[0]
+        existing = set(row[torrent_id_column] for row in self.liststore)
+        self.add_rows([t for t in torrent_ids if t not in existing])
+        self.update()
+
     def on_torrentremoved_event(self, torrent_id):
         self.remove_row(torrent_id)
 
@@ -34,7 +34,7 @@
 #
 
 import logging
-from twisted.internet.defer import maybeDeferred, succeed
+from twisted.internet.defer import Deferred, succeed
 
 import deluge.component as component
 from deluge.ui.client import client
@@ -42,13 +42,37 @@
 
 log = logging.getLogger(__name__)
 
+# The filters evaluated against the cached status, with the status keys they
+# need.  Other filters are passed on to the core.
+CACHED_FILTERS = {
+    "id": [],
+    "state": ["state"],
+    "tracker_host": ["tracker_host"],
+    "owner": ["owner"],
+    "label": ["label"]
+}
+# The keys needed by the special *Active* state filter
+ACTIVE_KEYS = ["download_payload_rate", "upload_payload_rate"]
+# The number of key sets the status dicts are kept for
+MAX_PROJECTIONS = 32
+
+def covers(cached_keys, keys):
+    """
+    Returns True if the keys are all in cached_keys, where None stands for
+    all the keys.
+    """
+    return cached_keys is None or (keys is not None and keys <= cached_keys)
+
 class SessionProxy(component.Component):
     """
     The SessionProxy component is used to cache session information client-side
     to reduce the number of RPCs needed to provide a rich user interface.
 
-    It will query the Core for only changes in the status of the torrents
-    and will try to satisfy client requests from the cache.
+    The core gives every torrent a status version that changes when its status
+    may have changed, so a refresh only fetches the torrents changed since the
+    last one.  Older cores without the status versions send the status of
+    every torrent instead.  The state, tracker_host, owner, label and id
+    filters are evaluated against the cache.
 
     """
     def __init__(self):
@@ -59,32 +83,66 @@ def __init__(self):
         # This is how long data will be valid before re-fetching from the core
         self.cache_time = 1.5
 
-        # Hold the torrents' status.. {torrent_id: [time, {status_dict}], ...}
+        # Hold the torrents' status.. {torrent_id: {status_dict}, ...}
         self.torrents = {}
 
-        # Holds the time of the last key update.. {torrent_id: {key1, time, ...}, ...}
-        self.cache_times = {}
+        # The keys kept for every torrent, None for all of them, the status
+        # version they are up to date with and when they were fetched
+        self.keys = set()
+        self.version = 0
+        self.last_update = 0.0
+        # The Deferreds waiting for the running update, None if none is running
+        self.update_waiting = None
+
+        # The keys of single torrents fetched beyond self.keys and when they
+        # were.. {torrent_id: [time, keys], ...}
+        self.extra_keys = {}
+
+        # The status dicts shared by create_status_dict for each list of keys,
+        # reused until the torrent's status changes.. {keys: {torrent_id: {status_dict}}, ...}
+        self.projections = {}
+
+        # Whether the core has get_torrents_status_since, older cores only
+        # send the status of every torrent
+        self.status_since = False
 
     def start(self):
         client.register_event_handler("TorrentStateChangedEvent", self.on_torrent_state_changed)
         client.register_event_handler("TorrentRemovedEvent", self.on_torrent_removed)
         client.register_event_handler("TorrentAddedEvent", self.on_torrent_added)
+        client.register_event_handler("TorrentsAddedEvent", self.on_torrents_added)
 
         def on_get_session_state(torrent_ids):
             for torrent_id in torrent_ids:
                 # Let's at least store the torrent ids with empty statuses
                 # so that upcoming queries or status updates don't throw errors.
-                self.torrents.setdefault(torrent_id, [time.time(), {}])
-                self.cache_times.setdefault(torrent_id, {})
-        return client.core.get_session_state().addCallback(on_get_session_state)
+                self.torrents.setdefault(torrent_id, {})
+
+        def on_get_method_list(methods):
+            self.status_since = "core.get_torrents_status_since" in methods
+
+        def on_get_method_list_fail(reason):
+            log.debug("Unable to get the daemon's methods: %s", reason.value)
+            self.status_since = False
+
+        d = client.daemon.get_method_list()
+        d.addCallbacks(on_get_method_list, on_get_method_list_fail)
+        d.addCallback(lambda result: client.core.get_session_state())
+        return d.addCallback(on_get_session_state)
 
     def stop(self):
         client.deregister_event_handler("TorrentStateChangedEvent", self.on_torrent_state_changed)
         client.deregister_event_handler("TorrentRemovedEvent", self.on_torrent_removed)
         client.deregister_event_handler("TorrentAddedEvent", self.on_torrent_added)
+        client.deregister_event_handler("TorrentsAddedEvent", self.on_torrents_added)
         self.torrents = {}
+        self.extra_keys = {}
+        self.projections = {}
+        self.keys = set()
+        self.version = 0
+        self.last_update = 0.0
 
-    def create_status_dict(self, torrent_ids, keys):
+    def create_status_dict(self, torrent_ids, keys, shared=False):
         """
         Creates a status dict from the cache.
 
@@ -92,26 +150,128 @@ def create_status_dict(self, torrent_ids, keys):
         :type torrent_ids: list of strings
         :param keys: the status keys
         :type keys: list of strings
+        :param shared: if True, the status dicts of the torrents are shared by
+            the calls asking for the same keys until the torrent's status
+            changes, so they must not be modified
+        :type shared: bool
 
         :returns: a dict with the status information for the *torrent_ids*
         :rtype: dict
 
         """
+        if not shared:
+            sd = {}
+            for torrent_id in torrent_ids:
+                try:
+                    cached = self.torrents[torrent_id]
+                except KeyError:
+                    continue
+                if keys:
+                    sd[torrent_id] = dict([(key, cached[key]) for key in keys if key in cached])
+                else:
+                    sd[torrent_id] = dict(cached)
+            return sd
+
+        keys = tuple(keys) if keys else None
+        projection = self.projections.get(keys)
+        if projection is None:
+            if len(self.projections) >= MAX_PROJECTIONS:
+                self.projections.clear()
+            projection = self.projections[keys] = {}
+
         sd = {}
         for torrent_id in torrent_ids:
-            try:
+            status = projection.get(torrent_id)
+            if status is None:
+                try:
+                    cached = self.torrents[torrent_id]
+                except KeyError:
+                    continue
                 if keys:
-                    sd[torrent_id] = dict([
-                        (x, y) for x, y in self.torrents[torrent_id][1].iteritems()
-                        if x in keys
-                    ])
+                    status = dict([(key, cached[key]) for key in keys if key in cached])
                 else:
-                    sd[torrent_id] = dict(self.torrents[torrent_id][1])
-            except KeyError:
-                continue
+                    status = dict(cached)
+                projection[torrent_id] = status
+            sd[torrent_id] = status
 
         return sd
 
+    def status_changed(self, torrent_id):
+        """
+        Drops the status dicts of the torrent built by create_status_dict,
+        called when its cached status changes.
+        """
+        for projection in self.projections.itervalues():
+            projection.pop(torrent_id, None)
+
+    def update_cache(self, keys):
+        """
+        Makes sure the cache holds fresh values of the keys for every torrent.
+        Only the torrents whose status version changed are fetched, unless
+        keys not cached yet are asked for.
+
+        :param keys: the status keys, None for all of them
+        :type keys: set
+
+        :returns: a Deferred fired once the cache is up to date
+        :rtype: Deferred
+
+        """
+        if covers(self.keys, keys) and time.time() - self.last_update < self.cache_time:
+            return succeed(None)
+
+        if self.update_waiting is not None:
+            # Check again once the running update is done
+            d = Deferred()
+            self.update_waiting.append(d)
+            return d.addCallback(lambda result: self.update_cache(keys))
+
+        if not self.status_since:
+            # The core can't tell the changed torrents apart
+            since = 0
+            if keys is not None and self.keys is not None:
+                keys = keys | self.keys
+            else:
+                keys = None
+        elif covers(self.keys, keys):
+            since = self.version
+            keys = self.keys
+        else:
+            # Fetch every torrent with the new keys
+            since = 0
+            if keys is not None:
+                keys = keys | self.keys
+
+        def on_status(result):
+            version, status_dict = result
+            if not since:
+                # A full update, so the torrents not sent are gone
+                for torrent_id in self.torrents.keys():
+                    if torrent_id not in status_dict:
+                        self.on_torrent_removed(torrent_id)
+            for torrent_id, status in status_dict.iteritems():
+                self.torrents.setdefault(torrent_id, {}).update(status)
+                self.status_changed(torrent_id)
+            self.keys = keys
+            self.version = version
+            self.last_update = time.time()
+
+        def on_done(result):
+            waiting, self.update_waiting = self.update_waiting, None
+            for d in waiting:
+                d.callback(None)
+            return result
+
+        self.update_waiting = []
+        if self.status_since:
+            d = client.core.get_torrents_status_since(since, sorted(keys or []))
+        else:
+            d = client.core.get_torrents_status({}, sorted(keys or []))
+            d.addCallback(lambda status_dict: (0, status_dict))
+        d.addCallback(on_status)
+        d.addBoth(on_done)
+        return d
+
     def get_torrent_status(self, torrent_id, keys):
         """
         Get a status dict for one torrent.
@@ -125,140 +285,136 @@ def get_torrent_status(self, torrent_id, keys):
         :rtype: dict
 
         """
-        if torrent_id in self.torrents:
-            # Keep track of keys we need to request from the core
-            keys_to_get = []
-            if not keys:
-                keys = self.torrents[torrent_id][1].keys()
-
-            for key in keys:
-                if time.time() - self.cache_times[torrent_id].get(key, 0.0) > self.cache_time:
-                    keys_to_get.append(key)
-
-            if not keys_to_get:
-                return succeed(
-                    self.create_status_dict([torrent_id], keys)[torrent_id]
-                )
-            else:
-                d = client.core.get_torrent_status(torrent_id, keys_to_get, True)
-                def on_status(result, torrent_id):
-                    t = time.time()
-                    self.torrents[torrent_id][0] = t
-                    self.torrents[torrent_id][1].update(result)
-                    for key in keys_to_get:
-                        self.cache_times[torrent_id][key] = t
-                    return self.create_status_dict([torrent_id], keys)[torrent_id]
-                return d.addCallback(on_status, torrent_id)
+        keys = set(keys) if keys else None
+        if torrent_id in self.torrents and covers(self.keys, keys):
+            d = self.update_cache(self.keys)
+            d.addCallback(lambda result: self.create_status_dict([torrent_id], keys).get(torrent_id, {}))
+            return d
+
+        # The keys are only fetched for this torrent, like the files or peers
+        # of the torrent shown in the details
+        extra = self.extra_keys.get(torrent_id)
+        if extra and covers(extra[1], keys) and time.time() - extra[0] < self.cache_time:
+            return succeed(self.create_status_dict([torrent_id], keys)[torrent_id])
+
+        def on_status(result):
+            if result:
+                self.torrents.setdefault(torrent_id, {}).update(result)
+                self.status_changed(torrent_id)
+                self.extra_keys[torrent_id] = [time.time(), keys]
+            return result
+        d = client.core.get_torrent_status(torrent_id, sorted(keys or []))
+        return d.addCallback(on_status)
+
+    def filter_torrent_ids(self, filter_dict):
+        """
+        Returns the ids of the cached torrents matching the filter.
+
+        :param filter_dict: a filter with only CACHED_FILTERS keys
+        :type filter_dict: dict
+
+        :returns: the torrent_ids
+        :rtype: list
+
+        """
+        if "id" in filter_dict:
+            torrent_ids = [torrent_id for torrent_id in filter_dict["id"] if torrent_id in self.torrents]
         else:
-            d = client.core.get_torrent_status(torrent_id, keys, True)
-            def on_status(result):
-                if result:
-                    t = time.time()
-                    self.torrents[torrent_id] = (t, result)
-                    self.cache_times[torrent_id] = {}
-                    for key in result:
-                        self.cache_times[torrent_id][key] = t
-
-                return result
-            return d.addCallback(on_status)
-
-    def get_torrents_status(self, filter_dict, keys):
+            torrent_ids = self.torrents.keys()
+
+        for key, values in filter_dict.iteritems():
+            if key == "id":
+                continue
+            if isinstance(values, basestring):
+                values = [values]
+            values = set(values)
+            active = False
+            if key == "state" and "Active" in values:
+                # Active torrents are transferring, in any of the other states given
+                active = True
+                values.discard("Active")
+
+            matched = []
+            for torrent_id in torrent_ids:
+                status = self.torrents[torrent_id]
+                if values and status.get(key) not in values:
+                    continue
+                if active and not (status.get("download_payload_rate") or
+                                   status.get("upload_payload_rate")):
+                    continue
+                matched.append(torrent_id)
+            torrent_ids = matched
+
+        return torrent_ids
+
+    def get_torrents_status(self, filter_dict, keys, shared=False):
         """
         Get a dict of torrent statuses.
 
-        The filter can take 2 keys, *state* and *id*.  The state filter can be
-        one of the torrent states or the special one *Active*.  The *id* key is
-        simply a list of torrent_ids.
+        The id, state, tracker_host, owner and label filters are answered from
+        the cache.  The state filter can be one of the torrent states or the
+        special one *Active*.  The *id* key is simply a list of torrent_ids.
+        Other filters are passed on to the core.
 
         :param filter_dict: the filter used for this query
         :type filter_dict: dict
         :param keys: the status keys
         :type keys: list of strings
+        :param shared: if True, the status dicts of unchanged torrents are the
+            same objects as in the previous call with the same keys, and must
+            not be modified
+        :type shared: bool
 
         :returns: a dict of torrent_ids and their status dicts
         :rtype: dict
 
         """
-        # Helper functions and callbacks ---------------------------------------
-        def on_status(result, torrent_ids, keys):
-            # Update the internal torrent status dict with the update values
-            t = time.time()
-            for key, value in result.items():
-                try:
-                    self.torrents[key][0] = t
-                    self.torrents[key][1].update(value)
-                    for k in value:
-                        self.cache_times[key][k] = t
-                except KeyError:
-                    #The torrent was removed
-                    continue
-
-            # Create the status dict
-            if not torrent_ids:
-                torrent_ids = result.keys()
-
-            return self.create_status_dict(torrent_ids, keys)
-
-        def find_torrents_to_fetch(torrent_ids):
-            to_fetch = []
-            t = time.time()
-            for torrent_id in torrent_ids:
-                torrent = self.torrents[torrent_id]
-                if t - torrent[0] > self.cache_time:
-                    to_fetch.append(torrent_id)
-                else:
-                    # We need to check if a key is expired
-                    for key in keys:
-                        if t - self.cache_times[torrent_id].get(key, 0.0) > self.cache_time:
-                            to_fetch.append(torrent_id)
-                            break
-
-            return to_fetch
-        #-----------------------------------------------------------------------
-
-        if not filter_dict:
-            # This means we want all the torrents status
-            # We get a list of any torrent_ids with expired status dicts
-            to_fetch = find_torrents_to_fetch(self.torrents.keys())
-            if to_fetch:
-                d = client.core.get_torrents_status({"id": to_fetch}, keys, True)
-                return d.addCallback(on_status, self.torrents.keys(), keys)
-
-            # Don't need to fetch anything
-            return maybeDeferred(self.create_status_dict, self.torrents.keys(), keys)
-
-
-        if len(filter_dict) == 1 and "id" in filter_dict:
-            # At this point we should have a filter with just "id" in it
-            to_fetch = find_torrents_to_fetch(filter_dict["id"])
-            if to_fetch:
-                d = client.core.get_torrents_status({"id": to_fetch}, keys, True)
-                return d.addCallback(on_status, filter_dict["id"], keys)
-            else:
-                # Don't need to fetch anything, so just return data from the cache
-                return maybeDeferred(self.create_status_dict, filter_dict["id"], keys)
-        else:
-            # This is a keyworded filter so lets just pass it onto the core
-            # XXX: Add more caching here.
-            d = client.core.get_torrents_status(filter_dict, keys, True)
-            return d.addCallback(on_status, None, keys)
+        filter_dict = filter_dict or {}
+        cached = all(key in CACHED_FILTERS for key in filter_dict)
+        # The tracker errors are matched on the translated tracker status of the core
+        if "Error" in filter_dict.get("tracker_host", ()):
+            cached = False
+
+        if cached:
+            needed_keys = None
+            if keys:
+                needed_keys = set(keys)
+                for key in filter_dict:
+                    needed_keys.update(CACHED_FILTERS[key])
+                if "Active" in filter_dict.get("state", ()):
+                    needed_keys.update(ACTIVE_KEYS)
+
+            def on_update(result):
+                return self.create_status_dict(self.filter_torrent_ids(filter_dict), keys, shared)
+            return self.update_cache(needed_keys).addCallback(on_update)
+
+        # This is a filter the core has to answer, the status is still cached
+        def on_status(result):
+            for torrent_id, status in result.iteritems():
+                if torrent_id in self.torrents:
+                    self.torrents[torrent_id].update(status)
+                    self.status_changed(torrent_id)
+            return result
+        d = client.core.get_torrents_status(filter_dict, keys)
+        return d.addCallback(on_status)
 
     def on_torrent_state_changed(self, torrent_id, state):
         if torrent_id in self.torrents:
-            self.torrents[torrent_id][1].setdefault("state", state)
-            self.cache_times.setdefault(torrent_id, {}).update(state=time.time())
+            self.torrents[torrent_id]["state"] = state
+            self.status_changed(torrent_id)
 
     def on_torrent_added(self, torrent_id, from_state):
-        self.torrents[torrent_id] = [time.time() - self.cache_time - 1, {}]
-        self.cache_times[torrent_id] = {}
-        def on_status(status):
-            self.torrents[torrent_id][1].update(status)
-            t = time.time()
-            for key in status:
-                self.cache_times[torrent_id][key] = t
-        client.core.get_torrent_status(torrent_id, []).addCallback(on_status)
+        self.on_torrents_added([torrent_id], from_state)
+
+    def on_torrents_added(self, torrent_ids, from_state):
+        # The torrents have new status versions, so they are fetched on the
+        # next update, which is not delayed by the cache time
+        for torrent_id in torrent_ids:
+            self.torrents.setdefault(torrent_id, {})
+            self.status_changed(torrent_id)
+        self.last_update = 0.0
 
     def on_torrent_removed(self, torrent_id):
-        if torrent_id in self.torrents:
-            del self.torrents[torrent_id]
-            del self.cache_times[torrent_id]
+        self.torrents.pop(torrent_id, None)
+        self.extra_keys.pop(torrent_id, None)
+        self.status_changed(torrent_id)
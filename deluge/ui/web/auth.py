@@ -96,6 +96,8 @@ class Auth(JSONComponent):
 
     def __init__(self):
         super(Auth, self).__init__("Auth")
+        # Per session state that is only kept in memory, {session_id: dict}
+        self.session_data = {}
         self.worker = LoopingCall(self._clean_sessions)
         self.worker.start(5)
 
@@ -115,6 +117,22 @@ def _clean_sessions(self):
                 del config["sessions"][session_id]
                 continue
 
+        for session_id in self.session_data.keys():
+            if session_id not in config["sessions"]:
+                del self.session_data[session_id]
+
+    def get_session_data(self, session_id):
+        """
+        Returns the in memory state of a session, it is dropped along with
+        the session and is not saved to the config.
+
+        :param session_id: the id of the session
+        :type session_id: string
+        :returns: the session state
+        :rtype: dictionary
+        """
+        return self.session_data.setdefault(session_id, {})
+
     def _create_session(self, request, login='admin'):
         """
         Creates a new session.
@@ -136,7 +154,7 @@ def _create_session(self, request, login='admin'):
         checksum = str(make_checksum(session_id))
 
         request.addCookie('_session_id', session_id + checksum,
-                path=request.base+"json", expires=expires_str)
+                path=request.base, expires=expires_str)
 
         log.debug("Creating session for %s", login)
         config = component.get("DelugeWeb").config
@@ -233,7 +251,7 @@ def check_request(self, request, method=None, level=None):
 
             _session_id = request.getCookie("_session_id")
             request.addCookie('_session_id', _session_id,
-                    path=request.base+"json", expires=expires_str)
+                    path=request.base, expires=expires_str)
 
         if method:
             if not hasattr(method, "_json_export"):
@@ -306,6 +324,7 @@ def delete_session(self):
         d = Deferred()
         config = component.get("DelugeWeb").config
         del config["sessions"][__request__.session_id]
+        self.session_data.pop(__request__.session_id, None)
         return True
 
     @export(AUTH_LEVEL_NONE)
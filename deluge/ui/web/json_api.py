@@ -336,16 +336,58 @@ def register_object(self, obj, name=None):
 
 FILES_KEYS = ["files", "file_progress", "file_priorities"]
 
+# The number of seconds a get_events request waits for events
+EVENTS_TIMEOUT = 5
+
+# The number of update_ui revisions kept per session, each open tab uses one
+UI_REVISIONS = 8
+
+def diff_torrents_status(old, new):
+    """
+    Compares two torrent status dicts returned by the SessionProxy.  The
+    status dicts of unchanged torrents are the same objects, so only the
+    changed ones have their values compared.
+
+    :param old: the previous status of the torrents
+    :type old: dictionary
+    :param new: the current status of the torrents
+    :type new: dictionary
+    :returns: the status of the added torrents and the changed values of
+        the others, and the ids of the removed torrents
+    :rtype: tuple (dictionary, list)
+    """
+    changed = {}
+    for torrent_id, status in new.iteritems():
+        old_status = old.get(torrent_id)
+        if old_status is None:
+            changed[torrent_id] = status
+        elif old_status is not status:
+            values = dict([(key, value) for key, value in status.iteritems()
+                           if key not in old_status or old_status[key] != value])
+            if values:
+                changed[torrent_id] = values
+    removed = [torrent_id for torrent_id in old if torrent_id not in new]
+    return changed, removed
+
+def get_listener_id(request):
+    """
+    Returns the id of the event listener of a request.  A WebSocket listens
+    on its own, the other requests share the listener of their session.
+    """
+    return getattr(request, "listener_id", request.session_id)
+
 class EventQueue(object):
     """
     This class subscribes to events from the core and stores them until all
-    the subscribed listeners have received the events.
+    the subscribed listeners have received the events.  A listener waiting
+    for events gets them as soon as they arrive.
     """
 
     def __init__(self):
         self.__events = {}
         self.__handlers = {}
         self.__queue = {}
+        # The listeners waiting for events {listener_id: (Deferred, timeout)}
         self.__requests = {}
 
     def add_listener(self, listener_id, event):
@@ -364,6 +406,8 @@ def on_event(*args):
                     if listener not in self.__queue:
                         self.__queue[listener] = []
                     self.__queue[listener].append((event, args))
+                    if listener in self.__requests:
+                        self._send_events(listener)
 
             client.register_event_handler(event, on_event)
             self.__handlers[event] = on_event
@@ -371,12 +415,27 @@ def on_event(*args):
         elif listener_id not in self.__events[event]:
             self.__events[event].append(listener_id)
 
-    def get_events(self, listener_id):
+    def get_listener_events(self, listener_id):
+        """
+        Returns the names of the events the listener is added to.
+
+        :param listener_id: A unique id for the listener
+        :type listener_id: string
+        """
+        return [event for event, listeners in self.__events.iteritems()
+                if listener_id in listeners]
+
+    def get_events(self, listener_id, timeout=EVENTS_TIMEOUT):
         """
-        Retrieve the pending events for the listener.
+        Retrieve the pending events for the listener.  If there are none, the
+        returned Deferred fires as soon as events arrive, or with None after
+        timeout seconds.
 
         :param listener_id: A unique id for the listener
         :type listener_id: string
+        :param timeout: the number of seconds to wait for events, None to
+            wait until they arrive
+        :type timeout: float
         """
 
         # Check to see if we have anything to return immediately
@@ -385,23 +444,38 @@ def get_events(self, listener_id):
             del self.__queue[listener_id]
             return queue
 
-        # Create a deferred to and check again in 100ms
+        # A listener only waits once, the older request is answered empty
+        if listener_id in self.__requests:
+            self._send_events(listener_id)
+
         d = Deferred()
-        reactor.callLater(0.1, self._get_events, listener_id, 0, d)
+        delayed_call = None
+        if timeout is not None:
+            # Prevent the request waiting indefinitely incase a client leaves
+            # the page or disconnects uncleanly.
+            delayed_call = reactor.callLater(timeout, self._send_events, listener_id)
+        self.__requests[listener_id] = (d, delayed_call)
         return d
 
-    def _get_events(self, listener_id, count, d):
-        if listener_id in self.__queue:
-            queue = self.__queue[listener_id]
-            del self.__queue[listener_id]
-            d.callback(queue)
-        else:
-            # Prevent this loop going on indefinitely incase a client leaves
-            # the page or disconnects uncleanly.
-            if count >= 50:
-                d.callback(None)
-            else:
-                reactor.callLater(0.1, self._get_events, listener_id, count + 1, d)
+    def _send_events(self, listener_id):
+        d, delayed_call = self.__requests.pop(listener_id)
+        if delayed_call and delayed_call.active():
+            delayed_call.cancel()
+        d.callback(self.__queue.pop(listener_id, None))
+
+    def cancel_events(self, listener_id):
+        """
+        Stops waiting for the events of the listener, the pending request is
+        answered with None.
+
+        :param listener_id: A unique id for the listener
+        :type listener_id: string
+        """
+        if listener_id in self.__requests:
+            d, delayed_call = self.__requests.pop(listener_id)
+            if delayed_call and delayed_call.active():
+                delayed_call.cancel()
+            d.callback(None)
 
     def remove_listener(self, listener_id, event):
         """
@@ -417,6 +491,8 @@ def remove_listener(self, listener_id, event):
             client.deregister_event_handler(event, self.__handlers[event])
             del self.__events[event]
             del self.__handlers[event]
+        if not self.get_listener_events(listener_id):
+            self.__queue.pop(listener_id, None)
 
 class WebApi(JSONComponent):
     """
@@ -430,6 +506,7 @@ def __init__(self):
         self.host_list = ConfigManager("hostlist.conf.1.2", DEFAULT_HOSTS)
         self.core_config = CoreConfig()
         self.event_queue = EventQueue()
+        self.ui_revision = 0
         try:
             self.sessionproxy = component.get("SessionProxy")
         except KeyError:
@@ -493,21 +570,34 @@ def disconnect(self):
         return True
 
     @export
-    def update_ui(self, keys, filter_dict):
+    def update_ui(self, keys, filter_dict, revision=None):
         """
         Gather the information required for updating the web interface.
 
+        Every reply carries a revision.  When the revision of an earlier
+        reply for the session is passed, "torrents" only holds the added
+        torrents and the changed values of the others, "removed" lists the
+        removed torrents and "filters" is None if the filter tree did not
+        change.  If that revision is no longer known, or was for other keys
+        or filters, the full information is returned and "since" is None.
+
         :param keys: the information about the torrents to gather
         :type keys: list
         :param filter_dict: the filters to apply when selecting torrents.
         :type filter_dict: dictionary
+        :param revision: the revision of the last reply seen by the caller
+        :type revision: int
         :returns: The torrent and ui information.
         :rtype: dictionary
         """
         d = Deferred()
+        session_id = __request__.session_id
         ui_info = {
             "connected": client.connected(),
+            "revision": None,
+            "since": None,
             "torrents": None,
+            "removed": [],
             "filters": None,
             "stats": {
                 "max_download": self.core_config.get("max_download_speed"),
@@ -541,9 +631,10 @@ def got_torrents(torrents):
             ui_info["torrents"] = torrents
 
         def on_complete(result):
+            self._diff_ui_info(session_id, ui_info, keys, filter_dict, revision)
             d.callback(ui_info)
 
-        d1 = component.get("SessionProxy").get_torrents_status(filter_dict, keys)
+        d1 = component.get("SessionProxy").get_torrents_status(filter_dict, keys, shared=True)
         d1.addCallback(got_torrents)
 
         d2 = client.core.get_filter_tree()
@@ -569,6 +660,68 @@ def on_complete(result):
         dl.addCallback(on_complete)
         return d
 
+    def _diff_ui_info(self, session_id, ui_info, keys, filter_dict, revision):
+        """
+        Stores the torrents and filters of ui_info as a new revision of the
+        session and replaces them by the changes since revision, if the
+        session still has it.
+        """
+        if ui_info["torrents"] is None:
+            return
+
+        session = component.get("Auth").get_session_data(session_id)
+        revisions = session.setdefault("ui_revisions", {})
+
+        self.ui_revision += 1
+        ui_info["revision"] = self.ui_revision
+        revisions[self.ui_revision] = (keys, filter_dict, ui_info["torrents"], ui_info["filters"])
+        while len(revisions) > UI_REVISIONS:
+            # The revisions are numbered in order, so the oldest is the lowest
+            del revisions[min(revisions)]
+
+        # A tab only goes on from its last revision, so it can be dropped
+        last = revisions.pop(revision, None)
+        if last is None or last[:2] != (keys, filter_dict):
+            return
+
+        ui_info["since"] = revision
+        ui_info["torrents"], ui_info["removed"] = diff_torrents_status(last[2], ui_info["torrents"])
+        if ui_info["filters"] == last[3]:
+            ui_info["filters"] = None
+
+    @export
+    def get_torrents_page(self, keys, filter_dict, sort_key, reverse=False, offset=0, limit=None):
+        """
+        Gather the status of the torrents shown in a window of the torrent
+        grid.  The torrents are sorted and the window is taken by the core.
+
+        :param keys: the information about the torrents to gather
+        :type keys: list
+        :param filter_dict: the filters to apply when selecting torrents.
+        :type filter_dict: dictionary
+        :param sort_key: the status key to sort the torrents on
+        :type sort_key: string
+        :param reverse: if True, sort in descending order
+        :type reverse: boolean
+        :param offset: the index of the first torrent in the window
+        :type offset: int
+        :param limit: the number of torrents in the window
+        :type limit: int
+        :returns: the number of torrents matching the filters, the ids of
+            the torrents in the window in order and their status
+        :rtype: dictionary
+        """
+        def on_page(result):
+            total, torrent_ids, torrents = result
+            return {
+                "total": total,
+                "torrent_ids": torrent_ids,
+                "torrents": torrents
+            }
+
+        d = client.core.get_torrents_page(filter_dict, keys, sort_key, reverse, offset, limit)
+        return d.addCallback(on_page)
+
     def _on_got_files(self, torrent, d):
         files = torrent.get("files")
         file_progress = torrent.get("file_progress")
@@ -1000,7 +1153,7 @@ def register_event_listener(self, event):
         :param event: The event name
         :type event: string
         """
-        self.event_queue.add_listener(__request__.session_id, event)
+        self.event_queue.add_listener(get_listener_id(__request__), event)
 
     @export
     def deregister_event_listener(self, event):
@@ -1010,11 +1163,11 @@ def deregister_event_listener(self, event):
         :param event: The event name
         :type event: string
         """
-        self.event_queue.remove_listener(__request__.session_id, event)
+        self.event_queue.remove_listener(get_listener_id(__request__), event)
 
     @export
     def get_events(self):
         """
         Retrieve the pending events for the session.
         """
-        return self.event_queue.get_events(__request__.session_id)
+        return self.event_queue.get_events(get_listener_id(__request__))
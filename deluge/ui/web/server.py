@@ -56,6 +56,7 @@
 from deluge.ui.web.common import Template, compress
 from deluge.ui.web.json_api import JSON, WebApi
 from deluge.ui.web.pluginmanager import PluginManager
+from deluge.ui.web.websocket import WebSocket
 
 log = logging.getLogger(__name__)
 
@@ -83,7 +84,8 @@
     "port": 8112,
     "https": False,
     "pkey": "ssl/daemon.pkey",
-    "cert": "ssl/daemon.cert"
+    "cert": "ssl/daemon.cert",
+    "websocket": False
 }
 
 UI_CONFIG_KEYS = (
@@ -465,6 +467,8 @@ def __init__(self):
         self.putChild("render", Render())
         self.putChild("themes", static.File(rpath("themes")))
         self.putChild("tracker", Tracker())
+        if component.get("DelugeWeb").config["websocket"]:
+            self.putChild("websocket", WebSocket())
 
         theme = component.get("DelugeWeb").config["theme"]
         if not os.path.isfile(rpath("themes", "css", "xtheme-%s.css" % theme)):
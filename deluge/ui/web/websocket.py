@@ -0,0 +1,336 @@
+#
+# deluge/ui/web/websocket.py
+#
+# Copyright (C) 2012 Deluge Team
+#
+# Deluge is free software.
+#
+# You may redistribute it and/or modify it under the terms of the
+# GNU General Public License, as published by the Free Software
+# Foundation; either version 3 of the License, or (at your option)
+# any later version.
+#
+# deluge is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+# See the GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with deluge.    If not, write to:
+# 	The Free Software Foundation, Inc.,
+# 	51 Franklin Street, Fifth Floor
+# 	Boston, MA  02110-1301, USA.
+#
+#    In addition, as a special exception, the copyright holders give
+#    permission to link the code of portions of this program with the OpenSSL
+#    library.
+#    You must obey the GNU General Public License in all respects for all of
+#    the code used other than OpenSSL. If you modify file(s) with this
+#    exception, you may extend this exception to your version of the file(s),
+#    but you are not obligated to do so. If you do not wish to do so, delete
+#    this exception statement from your version. If you delete this exception
+#    statement from all source files in the program, then also delete it here.
+#
+#
+
+
+"""
+A WebSocket endpoint for the web interface.
+
+A logged in browser can open a WebSocket (RFC 6455) on /websocket instead of
+polling /json.  It sends the same JSON-RPC requests as to /json, one per
+message, and gets the responses back on the socket.  The events it registered
+for with web.register_event_listener are pushed as they arrive in messages::
+
+    {"method": "events", "params": [[[event_name, args], ...]], "id": null}
+
+so an idle page costs no requests nor timers.  Status diffs are streamed the
+same way, by calling core.subscribe_torrents_status and listening for the
+TorrentsStatusChangedEvent.
+
+Each socket is an event listener of its own, starting with the events its
+session listens to, so the other requests of the session keep their events.
+"""
+
+import base64
+import hashlib
+import itertools
+import logging
+import struct
+import urlparse
+
+from twisted.internet.defer import Deferred, maybeDeferred
+from twisted.web import http, resource, server
+
+from deluge import common, component
+from deluge.ui.web.auth import AUTH_LEVEL_DEFAULT, AuthError
+from deluge.ui.web.json_api import JSONException
+
+json = common.json
+
+log = logging.getLogger(__name__)
+
+WEBSOCKET_GUID = "258EAFA5-E914-47DA-95CA-C5AB0DC85B11"
+WEBSOCKET_VERSION = "13"
+# The largest message accepted from a browser
+MAX_MESSAGE_SIZE = 1024 * 1024
+
+OPCODE_CONTINUATION = 0x0
+OPCODE_TEXT = 0x1
+OPCODE_BINARY = 0x2
+OPCODE_CLOSE = 0x8
+OPCODE_PING = 0x9
+OPCODE_PONG = 0xA
+
+CLOSE_NORMAL = 1000
+CLOSE_PROTOCOL_ERROR = 1002
+CLOSE_TOO_BIG = 1009
+
+# Numbers the sockets to give them their own event listener
+connection_ids = itertools.count(1)
+
+def accept_key(key):
+    """
+    Returns the Sec-WebSocket-Accept value answering a Sec-WebSocket-Key.
+    """
+    return base64.b64encode(hashlib.sha1(key + WEBSOCKET_GUID).digest())
+
+def encode_frame(opcode, payload):
+    """
+    Returns a final, unmasked frame as sent by a server.
+
+    :param opcode: the frame opcode
+    :type opcode: int
+    :param payload: the payload
+    :type payload: str
+
+    """
+    length = len(payload)
+    if length < 126:
+        header = struct.pack("!BB", 0x80 | opcode, length)
+    elif length < 2 ** 16:
+        header = struct.pack("!BBH", 0x80 | opcode, 126, length)
+    else:
+        header = struct.pack("!BBQ", 0x80 | opcode, 127, length)
+    return header + payload
+
+def decode_frame(data):
+    """
+    Decodes the first frame in data, as sent by a client.
+
+    :param data: the received data
+    :type data: str
+
+    :returns: (fin, opcode, payload, size of the frame), or None if the frame
+        is incomplete
+    :rtype: tuple
+
+    :raises ValueError: if the frame is not masked or is too big
+
+    """
+    if len(data) < 2:
+        return None
+    first, second = struct.unpack("!BB", data[:2])
+    if not second & 0x80:
+        raise ValueError("Client frames must be masked")
+
+    length = second & 0x7f
+    offset = 2
+    if length == 126:
+        if len(data) < 4:
+            return None
+        length = struct.unpack("!H", data[2:4])[0]
+        offset = 4
+    elif length == 127:
+        if len(data) < 10:
+            return None
+        length = struct.unpack("!Q", data[2:10])[0]
+        offset = 10
+    if length > MAX_MESSAGE_SIZE:
+        raise ValueError("Frame too big")
+
+    if len(data) < offset + 4 + length:
+        return None
+    mask = [ord(c) for c in data[offset:offset + 4]]
+    payload = data[offset + 4:offset + 4 + length]
+    payload = "".join([chr(ord(c) ^ mask[i % 4]) for i, c in enumerate(payload)])
+    return bool(first & 0x80), first & 0x0f, payload, offset + 4 + length
+
+class WebSocketConnection(object):
+    """
+    Handles a WebSocket once the handshake is done, on the connection of the
+    HTTP request that opened it.
+    """
+
+    def __init__(self, request):
+        self.request = request
+        self.transport = request.channel.transport
+        self.connected = True
+        self.buffer = ""
+        self.fragments = None
+        # The Deferred of the events being waited for
+        self.events_deferred = None
+        self.listener_id = None
+
+    def start(self):
+        if self.request.session_id:
+            event_queue = component.get("Web").event_queue
+            self.listener_id = "%s:websocket-%d" % (self.request.session_id, connection_ids.next())
+            # The methods called on the socket use its listener
+            self.request.listener_id = self.listener_id
+            for event in event_queue.get_listener_events(self.request.session_id):
+                event_queue.add_listener(self.listener_id, event)
+            self.wait_for_events()
+
+    def data_received(self, data):
+        self.buffer += data
+        while self.connected:
+            try:
+                frame = decode_frame(self.buffer)
+            except ValueError, e:
+                log.debug("Closing the websocket: %s", e)
+                code = CLOSE_TOO_BIG if "big" in str(e) else CLOSE_PROTOCOL_ERROR
+                self.close(code)
+                return
+            if frame is None:
+                return
+            fin, opcode, payload, size = frame
+            self.buffer = self.buffer[size:]
+            self.frame_received(fin, opcode, payload)
+
+    def frame_received(self, fin, opcode, payload):
+        if opcode == OPCODE_CLOSE:
+            self.close(CLOSE_NORMAL)
+        elif opcode == OPCODE_PING:
+            self.transport.write(encode_frame(OPCODE_PONG, payload))
+        elif opcode == OPCODE_PONG:
+            pass
+        elif opcode in (OPCODE_TEXT, OPCODE_BINARY, OPCODE_CONTINUATION):
+            if opcode != OPCODE_CONTINUATION:
+                self.fragments = []
+            elif self.fragments is None:
+                self.close(CLOSE_PROTOCOL_ERROR)
+                return
+            self.fragments.append(payload)
+            if sum(len(fragment) for fragment in self.fragments) > MAX_MESSAGE_SIZE:
+                self.close(CLOSE_TOO_BIG)
+            elif fin:
+                message, self.fragments = "".join(self.fragments), None
+                self.message_received(message)
+        else:
+            self.close(CLOSE_PROTOCOL_ERROR)
+
+    def message_received(self, message):
+        """
+        Calls the JSON-RPC method in the message and sends the response.
+        """
+        response = {"result": None, "error": None, "id": None}
+        self.request.json = message
+        try:
+            response["id"], result, response["error"] = \
+                component.get("JSON")._handle_request(self.request)
+        except JSONException, e:
+            response["error"] = {"message": str(e), "code": 5}
+            self.send(response)
+            return
+
+        def on_result(result):
+            response["result"] = result
+            self.send(response)
+
+        def on_error(failure):
+            response["error"] = {"message": failure.getErrorMessage(), "code": 3}
+            self.send(response)
+        maybeDeferred(lambda: result).addCallbacks(on_result, on_error)
+
+    def wait_for_events(self):
+        event_queue = component.get("Web").event_queue
+        while self.connected:
+            events = event_queue.get_events(self.listener_id, timeout=None)
+            if isinstance(events, Deferred):
+                self.events_deferred = events
+                events.addCallback(self.on_events)
+                return
+            self.send_events(events)
+
+    def on_events(self, events):
+        self.events_deferred = None
+        if events is None:
+            # The socket is closed
+            return
+        self.send_events(events)
+        self.wait_for_events()
+
+    def send_events(self, events):
+        self.send({"method": "events", "params": [events], "id": None})
+
+    def send(self, message):
+        if self.connected:
+            self.transport.write(encode_frame(OPCODE_TEXT, json.dumps(message)))
+
+    def close(self, code):
+        if self.connected:
+            self.transport.write(encode_frame(OPCODE_CLOSE, struct.pack("!H", code)))
+            self.transport.loseConnection()
+        self.connection_lost()
+
+    def connection_lost(self, reason=None):
+        if not self.connected:
+            return
+        self.connected = False
+        if self.listener_id:
+            event_queue = component.get("Web").event_queue
+            event_queue.cancel_events(self.listener_id)
+            for event in event_queue.get_listener_events(self.listener_id):
+                event_queue.remove_listener(self.listener_id, event)
+
+class WebSocket(resource.Resource):
+    """
+    The /websocket resource, it answers the WebSocket handshake and hands
+    the connection over to a WebSocketConnection.
+    """
+    isLeaf = True
+
+    def render(self, request):
+        key = request.getHeader("sec-websocket-key")
+        if request.method != "GET" or not key or \
+                (request.getHeader("upgrade") or "").lower() != "websocket":
+            request.setResponseCode(http.BAD_REQUEST)
+            return "<h1>400 - Expected a WebSocket handshake</h1>"
+
+        if request.getHeader("sec-websocket-version") != WEBSOCKET_VERSION:
+            request.setResponseCode(426)
+            request.setHeader("Sec-WebSocket-Version", WEBSOCKET_VERSION)
+            return ""
+
+        # Browsers send the cookies of the session with the handshakes of any
+        # page, so the sockets opened by other sites are refused
+        origin = request.getHeader("origin")
+        if origin and urlparse.urlparse(origin).netloc.lower() != \
+                (request.getHeader("host") or "").lower():
+            request.setResponseCode(http.FORBIDDEN)
+            return "<h1>403 - Cross-origin WebSocket refused</h1>"
+
+        try:
+            component.get("Auth").check_request(request, level=AUTH_LEVEL_DEFAULT)
+        except AuthError:
+            request.setResponseCode(http.UNAUTHORIZED)
+            return "<h1>401 - Not authenticated</h1>"
+
+        # The response is written straight to the connection, the HTTP request
+        # is never finished so twisted.web doesn't add anything
+        channel = request.channel
+        channel.transport.write("\r\n".join([
+            "HTTP/1.1 101 Switching Protocols",
+            "Upgrade: websocket",
+            "Connection: Upgrade",
+            "Sec-WebSocket-Accept: %s" % accept_key(key),
+            "", ""]))
+
+        connection = WebSocketConnection(request)
+        # From now on the data received by the HTTP channel are frames
+        channel.setRawMode()
+        channel.rawDataReceived = connection.data_received
+        request.notifyFinish().addBoth(connection.connection_lost)
+        connection.start()
+        return server.NOT_DONE_YET
@@ -38,6 +38,8 @@
 from distutils import cmd, sysconfig
 from distutils.command.build import build as _build
 from distutils.command.clean import clean as _clean
+from distutils.errors import CCompilerError, DistutilsExecError, DistutilsPlatformError
+from distutils.command.build_ext import build_ext as _build_ext
 try:
     from sphinx.setup_command import BuildDoc
 except ImportError:
@@ -271,8 +273,26 @@ def run(self):
             print("Deleting %s" % desktop_data)
             os.remove(desktop_data)
 
+class build_ext(_build_ext):
+    """
+    Builds the C extensions, which are all optional.  When one can not be
+    compiled the pure Python module is used instead of failing the install.
+    """
+    def run(self):
+        try:
+            _build_ext.run(self)
+        except DistutilsPlatformError, e:
+            print("Warning: unable to build the C extensions: %s" % e)
+
+    def build_extension(self, ext):
+        try:
+            _build_ext.build_extension(self, ext)
+        except (CCompilerError, DistutilsExecError, DistutilsPlatformError, IOError), e:
+            print("Warning: unable to build %s, the Python module is used: %s" % (ext.name, e))
+
 cmdclass = {
     'build': build,
+    'build_ext': build_ext,
     'build_trans': build_trans,
     'build_plugins': build_plugins,
     'build_docs': build_docs,
@@ -324,6 +344,12 @@ def run(self):
 if windows_check():
     entry_points["console_scripts"].append("deluge-debug = deluge.main:start_ui")
 
+# The native rencode is optional, deluge.rencode is used when it cannot be built,
+# see build_ext
+_ext_modules = [
+    Extension("deluge._rencode", sources=["deluge/_rencode.c"])
+]
+
 # Main setup
 setup(
     name = "deluge",
@@ -370,5 +396,6 @@ def run(self):
                                ]},
     packages = find_packages(exclude=["plugins", "docs", "tests"]),
     namespace_packages = ["deluge", "deluge.plugins"],
-    entry_points = entry_points
+    entry_points = entry_points,
+    ext_modules = _ext_modules
 )